@@ -0,0 +1 @@
+"""Benchmarks for the export and result file pipelines"""
@@ -0,0 +1,67 @@
+"""Micro-benchmark for datetime detection and formatting in TransformBase
+
+Run with
+> $ pipenv run python -m benchmarks.bench_datetime
+"""
+import timeit
+import dateutil.parser
+import pytz
+from service.transforms.transform import TransformBase
+
+# a typical mix of submission values, most of them are not datetimes
+VALUES = [
+    '2020-08-17T16:56:09.191Z',
+    '2020-12-02T17:53:49.000Z',
+    'ADU ORDINANCE# 162-16, ADD 1',
+    'existingBuilding',
+    '(555) 555-5555',
+    'test@test.com',
+    '07-07-2027',
+    '94122',
+    '',
+    'no'
+]
+
+def legacy_datetime_valid(dt_str):
+    """ datetime_valid before the fast path """
+    try:
+        time = dateutil.parser.parse(dt_str)
+        time_str = time.isoformat("T", "milliseconds").replace("+00:00", "Z")
+        return time_str == dt_str
+    #pylint: disable=bare-except
+    except:
+        pass
+    return False
+
+def legacy_pretty_time(value, zone='America/Los_Angeles'):
+    """ pretty_time before the fast path """
+    time = dateutil.parser.parse(value)
+    timezone = pytz.timezone(zone)
+    return time.astimezone(timezone).strftime('%Y-%m-%d %I:%M:%S %p')
+
+def legacy_format(values):
+    """ pretty_format datetime branch before the fast path """
+    return [legacy_pretty_time(value) if legacy_datetime_valid(value) else value for value in values]
+
+def fast_format(values):
+    """ pretty_format datetime branch with a single shared parse """
+    ret = []
+    for value in values:
+        time = TransformBase.parse_datetime(value)
+        ret.append(TransformBase.format_time(time) if time is not None else value)
+    return ret
+
+def run(number=2000):
+    """ time both implementations and print the speedup """
+    assert legacy_format(VALUES) == fast_format(VALUES)
+
+    legacy = min(timeit.repeat(lambda: legacy_format(VALUES), number=number, repeat=3))
+    fast = min(timeit.repeat(lambda: fast_format(VALUES), number=number, repeat=3))
+    values = number * len(VALUES)
+    print('legacy: {:.2f} us/value'.format(legacy / values * 1e6))
+    print('fast:   {:.2f} us/value'.format(fast / values * 1e6))
+    print('speedup: {:.1f}x'.format(legacy / fast))
+    return {'legacy': legacy, 'fast': fast}
+
+if __name__ == '__main__':
+    run()
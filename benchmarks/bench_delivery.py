@@ -0,0 +1,134 @@
+"""Benchmark of the export delivery backends, offline
+
+Transforms synthetic submissions once, then times what each delivery option costs
+before anything goes over the network: building the delivered files (compression,
+part files), serializing them for the sftp proxy (multipart body) and for SendGrid
+(base64 mail JSON), and writing them with the local and memory backends. Finally a
+whole export runs end to end with Form.io replaced by the synthetic submissions and
+both channels on the memory backend.
+
+Run with
+> $ pipenv run python -m benchmarks.bench_delivery --size 10000
+"""
+import os
+import sys
+import copy
+import time
+import shutil
+import argparse
+import tempfile
+from unittest.mock import patch
+from service.modules import export_files
+from service.modules import delivery_backends
+from service.modules.http_client import MultipartStream
+from service.modules.permit_applications import PermitApplication
+from service.resources.export import Export
+from service.transforms.export_submissions import ExportSubmissionsTransform, WRITER_STREAM
+from . import generator
+
+SEP = '|'
+# (label, compression, part_rows)
+OPTIONS = (
+    ('plain', None, 0),
+    ('gzip', 'gzip', 0),
+    ('zip', 'zip', 0),
+    ('parts', None, 1000),
+    ('gzip parts', 'gzip', 1000)
+)
+STAGES = ('files', 'sftp_proxy', 'sendgrid', 'local', 'memory')
+RECIPIENTS = {
+    'from_email': 'from@example.com',
+    'to_emails': 'to@example.com',
+    'cc_emails': None,
+    'bcc_emails': None
+}
+
+def best_time(func, repeat):
+    """ best of `repeat` runs of func() """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def time_option(csv_text, compression, part_rows, directory, repeat):
+    """ seconds of each delivery stage for one option """
+    files = export_files.get_files(csv_text, SEP, 'DBI_permits_bench', compression, part_rows)
+    memory = delivery_backends.MemoryBackend()
+    local = delivery_backends.LocalBackend(directory)
+    export = Export()
+    email_name, email_content = export_files.compress('bench.csv', csv_text.encode('utf-8'), compression)
+
+    def multipart():
+        for item in files:
+            stream = MultipartStream('file', item['file_name'], item['content'], item['content_type'])
+            len(stream)
+            for _chunk in stream:
+                pass
+
+    def sendgrid():
+        with patch.object(Export, 'send_email', memory.send):
+            export.email(RECIPIENTS, 'bench', 'bench', email_name, email_content, export_files.CONTENT_TYPES[compression])
+
+    return {
+        'files': best_time(lambda: export_files.get_files(csv_text, SEP, 'DBI_permits_bench', compression, part_rows), repeat),
+        'sftp_proxy': best_time(multipart, repeat),
+        'sendgrid': best_time(sendgrid, repeat),
+        'local': best_time(lambda: [local.upload(item['content'], item['file_name']) for item in files], repeat),
+        'memory': best_time(lambda: [memory.upload(item['content'], item['file_name']) for item in files], repeat),
+        'bytes': sum(len(item['content']) for item in files)
+    }
+
+def time_export(submissions):
+    """ seconds of a whole export delivered to the memory backend """
+    backend = delivery_backends.MemoryBackend()
+    previous = delivery_backends.set_backend('memory', backend)
+    environ = {
+        'EXPORT_UPLOAD_BACKEND': 'memory',
+        'EXPORT_EMAIL_BACKEND': 'memory',
+        'EXPORT_EMAIL_FROM': 'from@example.com',
+        'EXPORT_EMAIL_TO': 'to@example.com'
+    }
+    try:
+        with patch.dict(os.environ, environ), \
+                patch.object(PermitApplication, 'get_applications_by_query', lambda *_args, **_kwargs: copy.deepcopy(submissions)):
+            start = time.perf_counter()
+            Export().export_submissions({'sftp_upload': '1', 'send_email': '1', 'writer': WRITER_STREAM, 'compress': 'gzip'})
+            return time.perf_counter() - start
+    finally:
+        delivery_backends.set_backend('memory', previous)
+
+def run(size=10000, repeat=3, seed=0):
+    """ time every delivery option and a whole export, and print the results """
+    submissions = generator.generate(size, seed)
+    csv_text = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), SEP, writer=WRITER_STREAM)
+    print('{0} submissions, {1} bytes of csv\n'.format(size, len(csv_text.encode('utf-8'))))
+
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        print('{:>12}  {:>12}'.format('option', 'bytes') + ''.join('{:>13}'.format(stage) for stage in STAGES))
+        for label, compression, part_rows in OPTIONS:
+            results[label] = time_option(csv_text, compression, part_rows, directory, repeat)
+            print('{:>12}  {:>12}'.format(label, results[label]['bytes']) + ''.join(
+                '{:>11.4f} s'.format(results[label][stage]) for stage in STAGES))
+    finally:
+        shutil.rmtree(directory)
+
+    results['export'] = time_export(submissions)
+    print('\nwhole gzip export to the memory backend {:.4f} s'.format(results['export']))
+    return results
+
+def main(argv=None):
+    """ command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=10000, help='submissions exported')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best one is kept')
+    parser.add_argument('--seed', type=int, default=0, help='synthetic submissions seed')
+    args = parser.parse_args(argv)
+    return run(args.size, args.repeat, args.seed)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
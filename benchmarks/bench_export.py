@@ -0,0 +1,105 @@
+"""Benchmark of each stage of the ExportSubmissionsTransform pipeline on synthetic submissions
+
+Times get_data, set_pts_fields, pretty_format, normalize and to_csv separately at
+several batch sizes and saves the results as JSON. Pass --compare with an earlier
+results file to print how much each stage changed.
+
+Run with
+> $ pipenv run python -m benchmarks.bench_export --sizes 100 1000 10000 --output bench_export.json
+> $ pipenv run python -m benchmarks.bench_export --compare bench_export.json
+"""
+import sys
+import copy
+import json
+import time
+import argparse
+import platform
+import datetime
+from service.transforms.export_submissions import ExportSubmissionsTransform
+from . import generator
+
+SIZES = (100, 1000, 10000)
+STAGES = ('get_data', 'set_pts_fields', 'pretty_format', 'normalize', 'to_csv')
+
+def time_stage(func, make_input, repeat):
+    """ best of `repeat` runs of func, the input is rebuilt outside the timing for every run """
+    best = None
+    for _ in range(repeat):
+        stage_input = make_input()
+        start = time.perf_counter()
+        func(stage_input)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def time_stages(submissions, repeat=3):
+    """ seconds per stage for one batch, each stage gets the output of the previous ones as input """
+    transform = ExportSubmissionsTransform()
+    records = [transform.get_data(submission) for submission in copy.deepcopy(submissions)]
+    formatted = [transform.pretty_format(record) for record in copy.deepcopy(records)]
+    dataframe = transform.normalize(formatted)
+
+    return {
+        'get_data': time_stage(
+            lambda batch: [transform.get_data(submission) for submission in batch],
+            lambda: copy.deepcopy(submissions), repeat),
+        'set_pts_fields': time_stage(
+            lambda batch: [transform.set_pts_fields(record) for record in batch],
+            lambda: copy.deepcopy(records), repeat),
+        # pretty_format runs set_pts_fields first
+        'pretty_format': time_stage(
+            lambda batch: [transform.pretty_format(record) for record in batch],
+            lambda: copy.deepcopy(records), repeat),
+        'normalize': time_stage(transform.normalize, lambda: formatted, repeat),
+        'to_csv': time_stage(lambda frame: transform.to_csv(frame, '|'), lambda: dataframe, repeat)
+    }
+
+def run(sizes=SIZES, repeat=3, seed=0):
+    """ time every stage at every batch size and print the results """
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'seed': seed,
+        'repeat': repeat,
+        'sizes': {}
+    }
+    print('{:>7}  '.format('size') + ''.join('{:>15}'.format(stage) for stage in STAGES))
+    for size in sizes:
+        timings = time_stages(generator.generate(size, seed), repeat)
+        results['sizes'][str(size)] = timings
+        print('{:>7}  '.format(size) + ''.join('{:>13.4f} s'.format(timings[stage]) for stage in STAGES))
+    return results
+
+def compare(baseline, current):
+    """ print the change of every stage against a baseline results dict, returns the ratios """
+    ratios = {}
+    print('{:>7}  '.format('size') + ''.join('{:>15}'.format(stage) for stage in STAGES))
+    for size, timings in current['sizes'].items():
+        if size not in baseline['sizes']:
+            continue
+        ratios[size] = {stage: timings[stage] / baseline['sizes'][size][stage] for stage in STAGES}
+        print('{:>7}  '.format(size) + ''.join('{:>14.2f}x'.format(ratios[size][stage]) for stage in STAGES))
+    return ratios
+
+def main(argv=None):
+    """ command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='batch sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best one is kept')
+    parser.add_argument('--seed', type=int, default=0, help='synthetic submissions seed')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results file to compare against')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as file_obj:
+            json.dump(results, file_obj, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as file_obj:
+            print('\nrelative to ' + args.compare)
+            compare(json.load(file_obj), results)
+    return results
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
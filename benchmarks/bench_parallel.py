@@ -0,0 +1,47 @@
+"""Benchmark for the parallel transform in ExportSubmissionsTransform,
+prints serial and parallel timings per batch size and the crossover point
+
+Run with
+> $ pipenv run python -m benchmarks.bench_parallel [batch sizes...]
+"""
+import os
+import sys
+import copy
+import timeit
+from unittest.mock import patch
+from service.transforms.export_submissions import ExportSubmissionsTransform
+from . import generator
+
+SIZES = (1000, 5000, 20000, 100000)
+
+def run(sizes=SIZES, workers=None, writer='stream'):
+    """ time the serial and parallel transform of each batch size and print the results """
+    workers = workers if workers else max(2, os.cpu_count())
+    ret = {}
+    crossover = None
+    print('{} workers, {} writer'.format(workers, writer))
+    for size in sizes:
+        submissions = generator.generate(size)
+        timings = {}
+        for name, count in (('serial', 0), ('parallel', workers)):
+            # the transform changes submissions in place, each run gets a fresh copy
+            batches = [copy.deepcopy(submissions) for _ in range(3)]
+            transform = ExportSubmissionsTransform(workers=count)
+            # every batch goes to the pool whatever the configured threshold
+            with patch.dict(os.environ, {'PARALLEL_TRANSFORM_THRESHOLD': '0'}):
+                timings[name] = min(timeit.repeat(
+                    lambda transform=transform, batches=batches: transform.transform(batches.pop(), '|', True, writer),
+                    number=1, repeat=3))
+        ret[size] = timings
+        if crossover is None and timings['parallel'] < timings['serial']:
+            crossover = size
+        print('{:>7} submissions  serial {:.3f} s  parallel {:.3f} s  speedup {:.2f}x'.format(
+            size, timings['serial'], timings['parallel'], timings['serial'] / timings['parallel']))
+    if crossover:
+        print('parallel is faster from {} submissions on this host'.format(crossover))
+    else:
+        print('parallel was never faster')
+    return ret
+
+if __name__ == '__main__':
+    run([int(size) for size in sys.argv[1:]] or SIZES)
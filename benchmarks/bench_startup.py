@@ -0,0 +1,120 @@
+"""Benchmark of the service's cold start
+
+Starts a fresh interpreter for every run. Records the import time of the service
+modules and their heavy dependencies on their own (python -X importtime), which of
+them start_service() loads, the time start_service() takes and the time of the first
+/welcome and /export requests. Runs with PRELOAD_ROUTES set are timed as well for
+comparison.
+
+Run with
+> $ pipenv run python -m benchmarks.bench_startup --repeat 5 --output bench_startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import datetime
+import subprocess
+
+# modules whose cumulative import time is reported
+MODULES = (
+    'service.microservice', 'service.resources.export', 'service.modules.process_result',
+    'service.transforms.export_submissions', 'sentry_sdk', 'falcon', 'pandas', 'pysftp',
+    'paramiko', 'sendgrid', 'xlsxwriter', 'dateutil.parser', 'requests'
+)
+
+# run in the child interpreter, prints its timings as JSON on the last line of stdout
+CHILD = '''
+import sys, json, time
+start = time.perf_counter()
+import service.microservice
+from falcon import testing
+imported = time.perf_counter()
+client = testing.TestClient(service.microservice.start_service())
+started = time.perf_counter()
+loaded = [name for name in MODULES if name in sys.modules]
+client.simulate_get('/welcome')
+welcome = time.perf_counter()
+client.simulate_get('/export', params={'token': 'not a token'})
+export = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'start_service': started - imported,
+    'first_welcome': welcome - started,
+    'first_export': export - welcome,
+    'loaded_by_start_service': loaded
+}))
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_child(args, env=None):
+    """ run python with args in a new interpreter from the repository root """
+    return subprocess.run(
+        [sys.executable] + args, env=env, cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+def import_seconds(name):
+    """ cumulative seconds of importing a module on its own, from python -X importtime """
+    stderr = run_child(['-X', 'importtime', '-c', 'import ' + name]).stderr
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and line.endswith('| ' + name):
+            return int(line.split('|')[1]) / 1e6
+    return None
+
+def run_once(preload=False):
+    """ timings of one cold start in a new interpreter """
+    env = dict(os.environ, ACCESS_KEY='bench', EXPORT_TOKEN='bench')
+    env.pop('PRELOAD_ROUTES', None)
+    if preload:
+        env['PRELOAD_ROUTES'] = '1'
+    child = 'MODULES = {0!r}\n'.format(MODULES) + CHILD
+    return json.loads(run_child(['-c', child], env).stdout.strip().splitlines()[-1])
+
+def best_of(runs):
+    """ the fastest time of every measurement over several runs """
+    best = {key: min(run[key] for run in runs) for key in runs[0] if key != 'loaded_by_start_service'}
+    best['loaded_by_start_service'] = runs[0]['loaded_by_start_service']
+    return best
+
+def run(repeat=3):
+    """ time cold starts with lazy routes and with PRELOAD_ROUTES and print the results """
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'repeat': repeat
+    }
+    for mode, preload in (('lazy', False), ('preload', True)):
+        results[mode] = best_of([run_once(preload) for _ in range(repeat)])
+    results['modules'] = {}
+    for name in MODULES:
+        seconds = [import_seconds(name) for _ in range(repeat)]
+        results['modules'][name] = min(seconds) if None not in seconds else None
+
+    print('{:>38}  {:>10}  {:>10}'.format('', 'lazy', 'preload'))
+    for key in ('import', 'start_service', 'first_welcome', 'first_export'):
+        print('{:>38}  {:>8.3f} s  {:>8.3f} s'.format(key, results['lazy'][key], results['preload'][key]))
+    print('\n{:>38}  {:>10}  {:>10}  {:>10}'.format('import time on its own', 'seconds', 'lazy', 'preload'))
+    for name in MODULES:
+        seconds = results['modules'][name]
+        print('{:>38}  {:>10}  {:>10}  {:>10}'.format(
+            name, '-' if seconds is None else '{:.3f} s'.format(seconds),
+            *['loaded' if name in results[mode]['loaded_by_start_service'] else '-' for mode in ('lazy', 'preload')]))
+    return results
+
+def main(argv=None):
+    """ command line entry point """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3, help='cold starts per mode, the best one is kept')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    if args.output:
+        with open(args.output, 'w') as file_obj:
+            json.dump(results, file_obj, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
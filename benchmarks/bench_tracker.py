@@ -0,0 +1,63 @@
+"""Benchmark for the tracker spreadsheet writers in ProcessResultFile
+
+Run with
+> $ pipenv run python -m benchmarks.bench_tracker
+"""
+import os
+import tempfile
+import timeit
+import pandas as pd
+from service.modules.process_result import ProcessResultFile
+from service.transforms.transform import TransformBase
+
+def make_tracker(rows):
+    """ tracker columns with `rows` rows of realistic values """
+    tracker = ProcessResultFile.new_tracker()
+    for index in range(rows):
+        tracker['formio id'].append('{:024x}'.format(index))
+        tracker['status'].append('Success' if index % 3 else 'Error')
+        tracker['error'].append('' if index % 3 else 'APPLICANT_BTRC missing or incorrect')
+        tracker['bb_project_id'].append(str(100000 + index))
+        tracker['project_address'].append('{} 18TH AVE'.format(index))
+        tracker['block'].append('1661')
+        tracker['lot'].append('006')
+        tracker['date_created'].append('2020/12/02 17:53:49')
+        tracker['applicant_name'].append('Danny Test')
+        tracker['applicant_phone'].append('(555) 555-5555')
+        tracker['applicant_email'].append('test@test.com')
+        for column in ('staff_assignment', 'bpa#', 'last_remark_date', 'last_remarks', 'ppc_release_date', 'issued_closed_date'):
+            tracker[column].append('')
+    return tracker
+
+def legacy_create_tracker_file(tracker):
+    """ create_tracker_file before the in-memory writers, round trips through a temp file """
+    tracker_file = os.path.join(tempfile.mkdtemp(), 'tracker_tmp.xlsx')
+    data_frame = pd.DataFrame(tracker)
+    #pylint: disable=abstract-class-instantiated
+    writer = pd.ExcelWriter(tracker_file, engine='xlsxwriter')
+    data_frame.rename(columns=TransformBase.pretty_string, inplace=True)
+    data_frame.to_excel(writer, sheet_name='New Submittals', index=False)
+    writer.close()
+    with open(tracker_file, 'rb') as file_obj:
+        file_content = file_obj.read()
+    os.remove(tracker_file)
+    os.rmdir(os.path.dirname(tracker_file))
+    return file_content
+
+def run(rows=10000, number=3):
+    """ time each writer and print the results """
+    tracker = make_tracker(rows)
+    process_result = ProcessResultFile()
+    writers = {
+        'legacy temp file': lambda: legacy_create_tracker_file(tracker),
+        'pandas in memory': lambda: process_result.create_tracker_file(tracker, 'pandas'),
+        'xlsxwriter': lambda: process_result.create_tracker_file(tracker, 'xlsxwriter')
+    }
+    ret = {}
+    for name, writer in writers.items():
+        ret[name] = min(timeit.repeat(writer, number=number, repeat=3)) / number
+        print('{:<18} {:.3f} s per {} rows'.format(name, ret[name], rows))
+    return ret
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,164 @@
+"""Synthetic Form.io building permit submissions for benchmarks
+
+Submissions start from the test fixture, so they carry every form key, and then
+randomize each field family in FieldConfigs: nested addresses, building use with
+"other", multi-selects, uploads, dates, phone numbers and new/existing permit types.
+The same seed always generates the same submissions.
+"""
+import os
+import copy
+import json
+import random
+import datetime
+from service.resources.field_maps import FieldMaps
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests/mocks/export_submissions.json')
+
+PERMIT_TYPES = ('existingBuilding', 'newConstruction')
+APPLICANT_TYPES = ('architect', 'contractor', 'engineer', 'agent', 'owner', 'attorneyInFact')
+TEAM_MEMBERS = ('agent', 'architect', 'attorneyInFact', 'contractor', 'engineer')
+BUILDING_USE_FIELDS = ('existingBuildingPresentUse', 'proposedUse', 'newBuildingUse')
+STREET_NAMES = ('18TH', 'MISSION', 'FUNSTON', 'VALENCIA', 'GEARY', 'IRVING', 'NORIEGA', 'TARAVAL')
+FIRST_NAMES = ('Danny', 'Maria', 'Wei', 'Aisha', 'Jose', 'Kim', 'Sam', 'Priya')
+LAST_NAMES = ('Test', 'Garcia', 'Chen', 'Okafor', 'Nguyen', 'Smith', 'Patel', 'Lee')
+DESCRIPTIONS = (
+    'ADU ORDINANCE# 162-16, ADD 1',
+    'Kitchen and bath remodel, no structural work',
+    'Replace windows in kind | 12 windows',
+    'New 3 story mixed use building\nwith ground floor retail',
+    'Seismic retrofit "soft story" per ordinance'
+)
+UPLOAD_NAMES = ('plans.pdf', 'structural calcs.pdf', 'title24.pdf', 'photo 1.jpg', 'site plan.dwg')
+
+def load_template():
+    """ the first fixture submission, every key a real submission has """
+    with open(FIXTURE, 'r') as file_obj:
+        return json.load(file_obj)[0]
+
+def random_date(rng, start_year=2019, days=730):
+    """ a Form.io ISO datetime """
+    start = datetime.datetime(start_year, 1, 1)
+    value = start + datetime.timedelta(seconds=rng.randrange(days * 86400), milliseconds=rng.randrange(1000))
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(value.microsecond // 1000)
+
+def random_phone(rng):
+    """ a formatted phone number """
+    return '({:03d}) {:03d}-{:04d}'.format(rng.randrange(200, 999), rng.randrange(200, 999), rng.randrange(10000))
+
+def random_address(rng, states):
+    """ a nested Form.io address """
+    return {
+        'line1': '{} {} {}'.format(rng.randrange(1, 4000), rng.choice(STREET_NAMES).title(), rng.choice(('Street', 'Avenue', 'Way'))),
+        'line2': rng.choice(('', '', 'Apt {}'.format(rng.randrange(1, 20)))),
+        'city': 'San Francisco',
+        'state': rng.choice(states).upper()[:2],
+        'zip': '941{:02d}'.format(rng.randrange(2, 35))
+    }
+
+def random_multi_select(rng, options, most=3):
+    """ a comma separated multi-select value """
+    return ','.join(rng.choice(options) for _ in range(rng.randrange(1, most + 1)))
+
+def random_building_use(rng, uses):
+    """ building use checkboxes, "other" sometimes checked with its free text or list value """
+    value = {use: rng.choice(('TRUE', 'FALSE', 'FALSE')) for use in rng.sample(uses, min(len(uses), 5))}
+    value['other'] = 'TRUE' if rng.random() < 0.3 else 'FALSE'
+    return value
+
+def make_submission(rng, index, template, permit_type=None):
+    """ one synthetic submission """
+    # pylint: disable=too-many-locals,too-many-statements
+    submission = copy.deepcopy(template)
+    data = submission['data']
+    states = list(FieldMaps.get_map('state_fields').keys())
+    uses = [use for use in FieldMaps.get_map('building_use').keys() if use != 'other']
+    construction_types = list(FieldMaps.get_map('construction_type').keys())
+    occupancy_codes = list(FieldMaps.get_map('occupancy_code').keys())
+    street_types = list(FieldMaps.get_map('street_suffix_fields').keys())
+
+    created = random_date(rng)
+    submission['_id'] = '{:024x}'.format(index)
+    submission['created'] = created
+    submission['modified'] = created
+
+    permit_type = permit_type if permit_type else rng.choice(PERMIT_TYPES)
+    new_construction = permit_type == 'newConstruction'
+    data['permitType'] = permit_type
+    data['dateTime'] = random_date(rng)
+    data['onlyFireDepartmentReview'] = rng.choice(('yes', 'no', ''))
+    data['reviewOverTheCounter'] = rng.choice(('yes', 'no', ''))
+
+    # people, phones and nested addresses
+    data['applicantType'] = rng.choice(APPLICANT_TYPES)
+    data['applicantFirstName'] = rng.choice(FIRST_NAMES)
+    data['applicantLastName'] = rng.choice(LAST_NAMES)
+    data['applicantPhoneNumber'] = random_phone(rng)
+    data['applicantEmail'] = 'applicant{}@example.com'.format(index)
+    data['applicantAddress'] = random_address(rng, states)
+    data['applicantArchitectLicenseExpirationDate'] = '{:02d}-{:02d}-{}'.format(
+        rng.randrange(1, 13), rng.randrange(1, 29), rng.randrange(2021, 2030))
+    data['ownerPhoneNumber'] = random_phone(rng)
+    data['ownerAddress'] = random_address(rng, states)
+    data['ownerFirstName'] = rng.choice(FIRST_NAMES)
+    data['ownerLastName'] = rng.choice(LAST_NAMES)
+    data['teamMembers'] = {member: rng.choice(('TRUE', 'FALSE')) for member in TEAM_MEMBERS}
+    data['priorityProjectSelections'] = {
+        'isInDevelopmentAgreement': rng.choice(('TRUE', 'FALSE')),
+        'is100AffordableHousing': rng.choice(('TRUE', 'FALSE'))
+    }
+
+    # project location
+    number = str(rng.randrange(1, 4000))
+    street = rng.choice(STREET_NAMES)
+    data['projectAddressNumber'] = number
+    data['projectAddressStreetName'] = street
+    data['projectAddressStreetType'] = rng.choice(street_types)
+    data['projectAddressUnitNumber'] = rng.choice(('', '', str(rng.randrange(1, 50))))
+    data['projectAddressBlock'] = '{:04d}'.format(rng.randrange(1, 7000))
+    data['projectAddressLot'] = '{:03d}'.format(rng.randrange(1, 200))
+    data['projectAddress'] = number + ' ' + street
+    data['existingBuildingState'] = rng.choice(states)
+    data['existingBuildingLotNumber'] = [data['projectAddressLot']]
+
+    # building use checkboxes with "other"
+    for field in BUILDING_USE_FIELDS:
+        data[field] = random_building_use(rng, uses)
+        other = rng.sample(uses, 2) if rng.random() < 0.5 else rng.choice(DESCRIPTIONS)
+        data[field + 'Other'] = other if data[field]['other'] == 'TRUE' else ''
+
+    # multi-selects and mapped codes
+    data['existingBuildingConstructionType'] = random_multi_select(rng, construction_types)
+    data['existingBuildingOccupancyClass'] = random_multi_select(rng, occupancy_codes)
+    data['typeOfConstruction'] = random_multi_select(rng, construction_types, 1)
+    data['occupancyClass'] = random_multi_select(rng, occupancy_codes)
+    data['estimatedCostOfProject'] = rng.choice((str(rng.randrange(1, 500000)), rng.randrange(1, 500000)))
+    data['projectDescription'] = rng.choice(DESCRIPTIONS)
+    data['sitePermitForm38'] = rng.choice(('yes', 'no', ''))
+    data['sitePermitForm12'] = rng.choice(('yes', 'no', ''))
+    data['notes'] = rng.choice(('',) + DESCRIPTIONS)
+
+    # new construction fields are mapped over the proposed ones
+    if new_construction:
+        data['newTypeOfConstruction'] = rng.choice(construction_types)
+        data['newOccupancyClass'] = random_multi_select(rng, occupancy_codes, 2)
+        data['newProjectDescription'] = rng.choice(DESCRIPTIONS)
+        data['newDwellingUnits'] = str(rng.randrange(1, 40))
+        data['newOccupancyStories'] = str(rng.randrange(1, 8))
+        data['newBasements'] = str(rng.randrange(0, 3))
+    else:
+        data['newTypeOfConstruction'] = ''
+
+    # uploads and other lists
+    data['files'] = [
+        {'storage': 'filesystem', 'originalName': name}
+        for name in rng.sample(UPLOAD_NAMES, rng.randrange(0, len(UPLOAD_NAMES) + 1))
+    ]
+    data['fileLinks'] = ['https://files.example.com/{}/{}.pdf'.format(index, link) for link in range(rng.randrange(0, 3))]
+    data['objects'] = [{'name': 'item {}'.format(item)} for item in range(rng.randrange(0, 3))]
+    return submission
+
+def generate(count, seed=0, permit_type=None):
+    """ `count` synthetic submissions, the same for the same seed """
+    rng = random.Random(seed)
+    template = load_template()
+    return [make_submission(rng, index, template, permit_type) for index in range(count)]
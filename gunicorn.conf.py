@@ -0,0 +1,6 @@
+"""gunicorn settings, loaded from the working directory"""
+
+def post_fork(_server, _worker):
+    """ resume the queued export jobs in each worker, the master doesn't run them with --preload """
+    from service import microservice # pylint: disable=import-outside-toplevel
+    microservice.resume_jobs()
@@ -5,23 +5,67 @@ import jsend
 import sentry_sdk
 import falcon
 from .resources.welcome import Welcome
-from .resources.export import Export
-from .modules.process_result import ProcessResultFile
+from .resources.field_maps import FieldMaps
+from .resources.metrics import Metrics
+from .resources.profiles import Profile
+from .resources.lazy import LazyResource
+from .modules import job_queue
+from .modules import log
+from .modules import profiler
+
+# routes whose resources pull in pandas, pysftp, sendgrid or xlsxwriter, imported on first use
+LAZY_ROUTES = (
+    ('/export', LazyResource('service.resources.export', 'Export')),
+    ('/export/jobs/{job_id}', LazyResource('service.resources.export_jobs', 'ExportJob')),
+    ('/processResultFile', LazyResource('service.modules.process_result', 'ProcessResultFile'))
+)
 
 def start_service():
     """Start this service
-    set SENTRY_DSN environmental variable to enable logging with Sentry
+    set SENTRY_DSN environmental variable to enable logging with Sentry,
+    and SENTRY_TRACES_SAMPLE_RATE to send export and result file stage timings.
+    Set PRELOAD_ROUTES to import every route's dependencies up front, e.g. with gunicorn --preload,
+    the queued export jobs are then resumed by each worker, see gunicorn.conf.py
     """
+    # JSON log lines with request correlation ids
+    log.configure()
     # Initialize Sentry
-    sentry_sdk.init(os.environ.get('SENTRY_DSN'))
+    sentry_sdk.init(
+        os.environ.get('SENTRY_DSN'),
+        traces_sample_rate=float(os.environ.get('SENTRY_TRACES_SAMPLE_RATE', 0)))
+    # Preload field mapping lookup tables
+    FieldMaps.load()
+    # Pick up export jobs queued before a restart, not in a preloading master: its job threads
+    # don't exist in the forked workers
+    if not os.environ.get('PRELOAD_ROUTES'):
+        resume_jobs()
     # Initialize Falcon
-    api = falcon.API()
+    api = falcon.API(middleware=[log.CorrelationIdMiddleware(), profiler.ProfilerMiddleware()])
     api.add_route('/welcome', Welcome())
-    api.add_route('/export', Export())
-    api.add_route('/processResultFile', ProcessResultFile())
+    for uri, resource in LAZY_ROUTES:
+        api.add_route(uri, resource)
+    api.add_route('/metrics', Metrics())
+    api.add_route('/profiles/{profile_id}', Profile())
     api.add_sink(default_error, '')
+    if os.environ.get('PRELOAD_ROUTES'):
+        preload()
     return api
 
+def preload():
+    """ import and create every lazily loaded resource """
+    for _uri, resource in LAZY_ROUTES:
+        resource.load()
+
+def resume_jobs():
+    """ start this process's job queue when jobs were queued before, running the ones left """
+    if os.path.isfile(job_queue.get_db_path()):
+        job_queue.get_queue(run_export_job)
+
+def run_export_job(params, progress):
+    """ run a queued export, Export is only imported once a job runs """
+    from .resources.export import Export # pylint: disable=import-outside-toplevel
+    return Export().run_export(params, progress)
+
 def default_error(_req, resp):
     """Handle default error"""
     resp.status = falcon.HTTP_404
@@ -0,0 +1,80 @@
+"""Concurrent delivery of an export to its channels, each with its own timeout."""
+import time
+import logging
+import contextvars
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+
+class DeliveryError(Exception):
+    """ one or more channels failed, results has the outcome of every channel """
+
+    def __init__(self, results):
+        failed = sorted(name for name, result in results.items() if result['status'] != STATUS_SUCCESS)
+        super().__init__('Delivery failed: ' + ', '.join(failed))
+        self.results = results
+
+def deliver(channels, timeouts=None):
+    """ run each channel's send() at the same time and wait for all of them.
+        channels: {name: send}, send() returns the channel's response
+        timeouts: {name: seconds}, a channel that takes longer is reported as timed out,
+        its call can't be interrupted and finishes in the background
+        returns ({name: result}, {name: response}), a result has the status, seconds,
+        error and http status_code of the channel
+    """
+    timeouts = timeouts or {}
+    results = {}
+    responses = {}
+    # copy the context so logs and Sentry spans keep the request's correlation id
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(channels)), thread_name_prefix='delivery')
+    try:
+        start = time.time()
+        futures = {
+            name: executor.submit(contextvars.copy_context().run, timed, send)
+            for name, send in channels.items()
+        }
+        for name, future in futures.items():
+            timeout = timeouts.get(name)
+            remaining = None if timeout is None else max(0, start + timeout - time.time())
+            try:
+                response, seconds = future.result(timeout=remaining)
+            except concurrent.futures.TimeoutError:
+                results[name] = {
+                    'status': STATUS_TIMEOUT,
+                    'seconds': round(time.time() - start, 3),
+                    'error': 'Timed out after {0} seconds'.format(timeout)
+                }
+                logger.warning('Delivery timed out', extra={'channel': name, 'timeout': timeout})
+                continue
+            #pylint: disable=broad-except
+            except Exception as exception:
+                results[name] = {
+                    'status': STATUS_FAILED,
+                    'seconds': round(time.time() - start, 3),
+                    'error': '{0}: {1}'.format(exception.__class__.__name__, exception)
+                }
+                logger.warning('Delivery failed', extra={'channel': name, 'error': str(exception)}, exc_info=True)
+                continue
+            responses[name] = response
+            results[name] = {'status': STATUS_SUCCESS, 'seconds': round(seconds, 3)}
+            status_code = getattr(response, 'status_code', None)
+            if isinstance(status_code, int):
+                results[name]['status_code'] = status_code
+                # the http client doesn't raise on error statuses, a 4xx/5xx didn't deliver
+                if status_code >= 400:
+                    results[name]['status'] = STATUS_FAILED
+                    results[name]['error'] = 'HTTP {0}'.format(status_code)
+                    logger.warning('Delivery failed', extra={'channel': name, 'status_code': status_code})
+    finally:
+        executor.shutdown(wait=False)
+    return results, responses
+
+def timed(send):
+    """ send() and the seconds it took """
+    start = time.time()
+    response = send()
+    return response, time.time() - start
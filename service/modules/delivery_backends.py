@@ -0,0 +1,193 @@
+"""Backends an export is uploaded and emailed with, chosen by EXPORT_UPLOAD_BACKEND and EXPORT_EMAIL_BACKEND.
+
+An upload backend has upload(data, file_name, content_type), an email backend has
+send(mail) taking the SendGrid mail JSON. Both return a response with a status_code.
+"""
+import os
+import io
+import json
+import time
+import uuid
+import tempfile
+import threading
+import sendgrid
+from . import http_client
+from . import local_store
+from . import singleton
+from . import sftp_client
+
+DEFAULT_UPLOAD_BACKEND = 'sftp_proxy'
+DEFAULT_EMAIL_BACKEND = 'sendgrid'
+LOCAL_DIR = 'deliveries'
+
+ERROR_BACKEND = "Unknown delivery backend {0}"
+ERROR_BACKEND_METHOD = "Delivery backend {0} can't {1}"
+
+class DeliveryResponse():
+    """ response of a backend that doesn't answer over http """
+
+    def __init__(self, status_code=200, body='', headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers if headers else {}
+
+class SftpProxyBackend():
+    """ uploads through the sftp proxy at SFTP_ENDPOINT """
+
+    #pylint: disable=no-self-use
+    def upload(self, data, file_name, content_type='text/plain'):
+        """ post data as a streamed multipart file """
+        content = data.encode('utf-8') if isinstance(data, str) else data
+        body = http_client.MultipartStream('file', file_name, content, content_type, {'Expires': '0'})
+
+        headers = {
+            'ACCESS_KEY': os.environ.get('SFDS_SFTP_ACCESS_KEY'),
+            'X-SFTP-HOST': os.environ.get('SFTP_HOSTNAME'),
+            'X-SFTP-HOST-KEY': os.environ.get('SFTP_HOST_KEY'),
+            'X-SFTP-USER': os.environ.get('SFTP_USERNAME'),
+            'X-SFTP-PASSWORD': os.environ.get('SFTP_PASSWORD'),
+            'X-SFDS-APIKEY': os.environ.get('X-SFDS-APIKEY'),
+            'Content-Type': 'text/plain'
+        }
+
+        params = {
+            'remotepath': '', # user home folder
+            'filename': file_name
+        }
+
+        return http_client.get_client().post(
+            os.environ.get('SFTP_ENDPOINT'),
+            endpoint='sftp.upload',
+            data=body,
+            headers=headers,
+            params=params)
+
+class SftpBackend():
+    """ uploads straight to the PTS sftp server over the shared SftpClient """
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def upload(self, data, file_name, _content_type=None):
+        """ write data to file_name in the sftp user's home folder """
+        client = self.client if self.client else sftp_client.get_client()
+        content = data.encode('utf-8') if isinstance(data, str) else data
+        client.putfo(io.BytesIO(content), file_name)
+        return DeliveryResponse(201, file_name)
+
+class SendGridBackend():
+    """ emails through SendGrid with SENDGRID_API_KEY """
+
+    #pylint: disable=no-self-use
+    def send(self, mail):
+        """ send the mail JSON """
+        sg_api = sendgrid.SendGridAPIClient(api_key=os.environ.get('SENDGRID_API_KEY'))
+        return sg_api.client.mail.send.post(request_body=mail)
+
+class LocalBackend():
+    """ uploads and emails to a local directory, EXPORT_LOCAL_DIR or deliveries/ in
+        DISPATCHER_STATE_DIR. Mails are saved as JSON in its mail/ folder
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory if directory else os.environ.get('EXPORT_LOCAL_DIR')
+
+    def get_directory(self, *folders):
+        """ the delivery directory or one of its folders, created on first use """
+        directory = os.path.join(self.directory if self.directory else local_store.get_state_path(LOCAL_DIR), *folders)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def upload(self, data, file_name, _content_type=None):
+        """ save data as file_name """
+        content = data.encode('utf-8') if isinstance(data, str) else data
+        path = self.write(self.get_directory(), os.path.basename(file_name), content)
+        return DeliveryResponse(201, path)
+
+    def send(self, mail):
+        """ save the mail JSON """
+        file_name = '{0}-{1}.json'.format(int(time.time() * 1000), uuid.uuid4().hex[:8])
+        path = self.write(self.get_directory('mail'), file_name, json.dumps(mail).encode('utf-8'))
+        return DeliveryResponse(202, path)
+
+    @staticmethod
+    def write(directory, file_name, content):
+        """ atomically write a file, readers never see part of it """
+        file_handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + file_name)
+        try:
+            with os.fdopen(file_handle, 'wb') as file_obj:
+                file_obj.write(content)
+            path = os.path.join(directory, file_name)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+class MemoryBackend():
+    """ keeps uploads and mails in memory, for tests and load tests """
+
+    def __init__(self):
+        self.files = []
+        self.mails = []
+        self.lock = threading.Lock()
+
+    def upload(self, data, file_name, content_type='text/plain'):
+        """ keep the file """
+        content = data.encode('utf-8') if isinstance(data, str) else data
+        with self.lock:
+            self.files.append({'file_name': file_name, 'content': content, 'content_type': content_type})
+        return DeliveryResponse(201, file_name)
+
+    def send(self, mail):
+        """ keep the mail JSON """
+        with self.lock:
+            self.mails.append(mail)
+        return DeliveryResponse(202)
+
+    def clear(self):
+        """ drop the kept uploads and mails """
+        with self.lock:
+            self.files = []
+            self.mails = []
+
+BACKENDS = {
+    'sftp_proxy': SftpProxyBackend,
+    'sftp': SftpBackend,
+    'sendgrid': SendGridBackend,
+    'local': LocalBackend,
+    'memory': MemoryBackend
+}
+
+# one process wide instance of each backend, made on first use
+_BACKENDS = {name: singleton.ProcessWide(backend) for name, backend in BACKENDS.items()}
+
+def get_backend(name):
+    """ the process wide backend of a name, the memory backend keeps what both channels deliver """
+    if name not in _BACKENDS:
+        raise ValueError(ERROR_BACKEND.format(name))
+    return _BACKENDS[name].get()
+
+def set_backend(name, backend):
+    """ swap the process wide backend of a name, returns the previous one.
+        With None a new one is made on next use
+    """
+    if name not in _BACKENDS:
+        raise ValueError(ERROR_BACKEND.format(name))
+    return _BACKENDS[name].set(backend)
+
+def get_upload_backend():
+    """ the backend exports are uploaded with, EXPORT_UPLOAD_BACKEND """
+    name = os.environ.get('EXPORT_UPLOAD_BACKEND') or DEFAULT_UPLOAD_BACKEND
+    backend = get_backend(name)
+    if not hasattr(backend, 'upload'):
+        raise ValueError(ERROR_BACKEND_METHOD.format(name, 'upload'))
+    return backend
+
+def get_email_backend():
+    """ the backend exports are emailed with, EXPORT_EMAIL_BACKEND """
+    name = os.environ.get('EXPORT_EMAIL_BACKEND') or DEFAULT_EMAIL_BACKEND
+    backend = get_backend(name)
+    if not hasattr(backend, 'send'):
+        raise ValueError(ERROR_BACKEND_METHOD.format(name, 'send'))
+    return backend
@@ -0,0 +1,107 @@
+"""Ledger of the submissions already exported to PTS, kept in a local SQLite store."""
+import json
+import time
+import hashlib
+import itertools
+from . import local_store
+from . import singleton
+
+LEDGER_DB_FILE = 'export_ledger.sqlite3'
+LEDGER_LOOKUP_CHUNK = 500
+
+def content_hash(submission):
+    """ hash of a submission's form data, changes whenever an exported value can change """
+    data = json.dumps(submission.get('data', {}), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def get_modified(submission):
+    """ when Form.io last modified a submission """
+    return submission.get('modified') or submission.get('created')
+
+class ExportLedger():
+    """ Exported submission ids with their content hash, modified and export time """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path if db_path else local_store.get_state_path(LEDGER_DB_FILE)
+        self.create_table()
+
+    def transaction(self):
+        """ a connection to the ledger database """
+        return local_store.sqlite_transaction(self.db_path)
+
+    def create_table(self):
+        """ create the ledger table on first use """
+        with self.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS exported ('
+                'id TEXT PRIMARY KEY, '
+                'hash TEXT NOT NULL, '
+                'modified TEXT, '
+                'exported_at REAL NOT NULL)')
+
+    def get_mark(self):
+        """ the latest modified time seen by a recorded export, None before the first one """
+        with self.transaction() as connection:
+            row = connection.execute('SELECT MAX(modified) AS mark FROM exported').fetchone()
+        return row['mark']
+
+    def get_hashes(self, ids):
+        """ {id: hash} of the given ids that are in the ledger """
+        ids = list(set(ids))
+        if not ids:
+            return {}
+        with self.transaction() as connection:
+            rows = connection.execute(
+                'SELECT id, hash FROM exported WHERE id IN (' + ','.join('?' * len(ids)) + ')',
+                ids).fetchall()
+        return {row['id']: row['hash'] for row in rows}
+
+    def filter_changed(self, submissions, seen):
+        """ yield the submissions that are new or changed since they were exported.
+            Every submission looked at is appended to seen as {'id', 'hash', 'modified', 'changed'}
+            to be recorded once the export went through
+        """
+        submissions = iter(submissions)
+        while True:
+            chunk = list(itertools.islice(submissions, LEDGER_LOOKUP_CHUNK))
+            if not chunk:
+                break
+            hashes = self.get_hashes(submission['_id'] for submission in chunk)
+            for submission in chunk:
+                submission_hash = content_hash(submission)
+                changed = hashes.get(submission['_id']) != submission_hash
+                seen.append({
+                    'id': submission['_id'],
+                    'hash': submission_hash,
+                    'modified': get_modified(submission),
+                    'changed': changed
+                })
+                if changed:
+                    yield submission
+
+    def record(self, seen):
+        """ store exported submissions, unchanged ones only move their modified time forward """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO exported (id, hash, modified, exported_at) VALUES (?, ?, ?, ?)',
+                [(entry['id'], entry['hash'], entry['modified'], now) for entry in seen if entry['changed']])
+            connection.executemany(
+                'UPDATE exported SET modified = ? WHERE id = ? AND (modified IS NULL OR modified < ?)',
+                [(entry['modified'], entry['id'], entry['modified']) for entry in seen if not entry['changed']])
+
+    def get(self, submission_id):
+        """ the ledger entry of a submission as a dict, None when it wasn't exported """
+        with self.transaction() as connection:
+            row = connection.execute('SELECT * FROM exported WHERE id = ?', (submission_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+_LEDGER = singleton.ProcessWide(ExportLedger)
+
+def get_ledger():
+    """ the process wide ExportLedger, created on first use """
+    return _LEDGER.get()
+
+def set_ledger(ledger):
+    """ swap the process wide ExportLedger, returns the previous one """
+    return _LEDGER.set(ledger)
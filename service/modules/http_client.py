@@ -0,0 +1,147 @@
+"""Shared HTTP session for outbound requests."""
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+from . import singleton
+
+# retry rate limited and server error responses
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# POST is left out: after a read timeout or an error response the upload may already have
+# been written, and the sftp proxy can't tell a re-sent file from a new one
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PATCH', 'PUT', 'DELETE'])
+
+class MultipartStream():
+    """ multipart/form-data body of one file, sent chunk by chunk instead of copied into one
+        bytes body. The bytes sent are the ones requests' files= builds.
+        It can be iterated again, so a retried request sends the whole body again
+    """
+    CHUNK_SIZE = 65536
+
+    #pylint: disable=too-many-arguments
+    def __init__(self, name, file_name, data, content_type, headers=None, boundary=None):
+        boundary = boundary if boundary else choose_boundary()
+        # as requests builds a (file_name, data, content_type, headers) files= tuple
+        field = RequestField(name=name, data='', filename=file_name, headers=headers)
+        field.make_multipart(content_type=content_type)
+        self.head = '--{0}\r\n'.format(boundary).encode('latin-1') + field.render_headers().encode('utf-8')
+        self.tail = '\r\n--{0}--\r\n'.format(boundary).encode('latin-1')
+        # the file's bytes, encoded once by the caller
+        self.data = data
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+
+    def __iter__(self):
+        yield self.head
+        for start in range(0, len(self.data), self.CHUNK_SIZE):
+            yield self.data[start:start + self.CHUNK_SIZE]
+        yield self.tail
+
+    def __len__(self):
+        # requests sends a Content-Length instead of a chunked body for sized streams
+        return len(self.head) + len(self.data) + len(self.tail)
+
+class HttpClient():
+    """ Pooled keep-alive session with timeouts, retries and per endpoint stats """
+
+    #pylint: disable=too-many-arguments
+    def __init__(
+            self,
+            pool_size=None,
+            connect_timeout=None,
+            read_timeout=None,
+            max_retries=None,
+            backoff_factor=None
+        ):
+        pool_size = int(pool_size if pool_size is not None else os.environ.get('HTTP_POOL_SIZE', 10))
+        connect_timeout = float(connect_timeout if connect_timeout is not None else os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+        read_timeout = float(read_timeout if read_timeout is not None else os.environ.get('HTTP_READ_TIMEOUT', 60))
+        max_retries = int(max_retries if max_retries is not None else os.environ.get('HTTP_MAX_RETRIES', 3))
+        backoff_factor = float(backoff_factor if backoff_factor is not None else os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """ send a request through the pooled session and record its stats under endpoint """
+        endpoint = endpoint if endpoint else method.upper() + ' ' + url
+        kwargs.setdefault('timeout', self.timeout)
+
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record(endpoint, time.time() - start, error=True)
+            raise
+
+        retries = getattr(response.raw, 'retries', None)
+        self.record(
+            endpoint,
+            time.time() - start,
+            retries=len(retries.history) if retries else 0,
+            error=response.status_code >= 400
+        )
+        return response
+
+    def get(self, url, endpoint=None, **kwargs):
+        """ send a GET request """
+        return self.request('GET', url, endpoint, **kwargs)
+
+    def patch(self, url, endpoint=None, **kwargs):
+        """ send a PATCH request """
+        return self.request('PATCH', url, endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        """ send a POST request """
+        return self.request('POST', url, endpoint, **kwargs)
+
+    def record(self, endpoint, seconds, retries=0, error=False):
+        """ update the latency, retry and error counters of an endpoint """
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {
+                'requests': 0,
+                'errors': 0,
+                'retries': 0,
+                'seconds': 0.0,
+                'max_seconds': 0.0
+            })
+            stats['requests'] += 1
+            stats['errors'] += 1 if error else 0
+            stats['retries'] += retries
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def get_stats(self):
+        """ copy of the per endpoint counters """
+        with self.lock:
+            return {endpoint: dict(stats) for endpoint, stats in self.stats.items()}
+
+    def close(self):
+        """ close pooled connections """
+        self.session.close()
+
+_CLIENT = singleton.ProcessWide(HttpClient)
+
+def get_client():
+    """ the process wide HttpClient, created on first use """
+    return _CLIENT.get()
+
+def set_client(client):
+    """ swap the process wide HttpClient, returns the previous one """
+    return _CLIENT.set(client)
@@ -0,0 +1,233 @@
+"""Background jobs run on a worker pool, their state kept in a local SQLite store."""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import local_store
+from . import log
+from . import singleton
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_FILE = 'export_jobs.sqlite3'
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+ERROR_JOB_INTERRUPTED = 'Interrupted by a restart'
+
+# tells this process from an earlier one that had the same pid, e.g. after a container restart
+PROCESS_TOKEN = uuid.uuid4().hex[:12]
+
+JOB_JSON_FIELDS = ('params', 'progress', 'result')
+
+class JobProgress():
+    """ progress callback handed to a job's runner, records how long each stage took """
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.stages = {}
+        self.last = time.time()
+
+    def __call__(self, stage, **info):
+        now = time.time()
+        info['seconds'] = round(now - self.last, 3)
+        self.last = now
+        self.stages[stage] = info
+        self.queue.set_progress(self.job_id, stage, self.stages)
+
+class JobQueue():
+    """ Runs jobs on a thread pool, queued jobs are picked up again after a restart """
+
+    def __init__(self, runner, db_path=None, max_workers=None):
+        # runner(params, progress) does the work and returns a json serializable result
+        self.runner = runner
+        self.db_path = db_path if db_path else get_db_path()
+        max_workers = int(max_workers if max_workers is not None else os.environ.get('EXPORT_JOB_WORKERS', 1))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # host:pid:token of the process running the jobs, see is_gone
+        self.worker = '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), PROCESS_TOKEN)
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.create_table()
+
+    def transaction(self):
+        """ a connection to the jobs database """
+        return local_store.sqlite_transaction(self.db_path)
+
+    def create_table(self):
+        """ create the jobs table on first use """
+        with self.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, '
+                'status TEXT NOT NULL, '
+                'stage TEXT, '
+                'params TEXT NOT NULL, '
+                'progress TEXT NOT NULL, '
+                'result TEXT, '
+                'error TEXT, '
+                'worker TEXT, '
+                'created REAL NOT NULL, '
+                'started REAL, '
+                'finished REAL)')
+
+    def enqueue(self, params):
+        """ store a new job and hand it to the pool, returns the job id """
+        job_id = uuid.uuid4().hex
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT INTO jobs (id, status, params, progress, created) VALUES (?, ?, ?, ?, ?)',
+                (job_id, STATUS_QUEUED, json.dumps(params), json.dumps({}), time.time()))
+        self.submit(job_id)
+        return job_id
+
+    def submit(self, job_id):
+        """ run a queued job on the pool """
+        with self.lock:
+            self.futures[job_id] = self.executor.submit(self.run, job_id)
+
+    def get(self, job_id):
+        """ a job as a dict, None when there is no such job """
+        with self.transaction() as connection:
+            row = connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['status'] == STATUS_RUNNING and self.is_gone(job['worker']):
+            # pollers see a job interrupted since the last resume as failed right away
+            self.interrupt([job_id])
+            return self.get(job_id)
+        for field in JOB_JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def claim(self, job_id):
+        """ mark a queued job running, False if another worker already has it """
+        with self.transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE jobs SET status = ?, worker = ?, started = ? WHERE id = ? AND status = ?',
+                (STATUS_RUNNING, self.worker, time.time(), job_id, STATUS_QUEUED))
+        return cursor.rowcount == 1
+
+    def run(self, job_id):
+        """ claim and run a job, recording its result or error """
+        if not self.claim(job_id):
+            return
+        job = self.get(job_id)
+        # the job's log records carry its id
+        log_token = log.set_request_id(job_id)
+        try:
+            logger.info('Job started', extra={'params': job['params']})
+            result = self.runner(job['params'], JobProgress(self, job_id))
+        #pylint: disable=broad-except
+        except Exception as exception:
+            logger.exception('JobQueue.run Exception')
+            self.finish(job_id, STATUS_FAILED, error="{0}".format(exception))
+        else:
+            self.finish(job_id, STATUS_SUCCEEDED, result=result)
+        finally:
+            log.reset_request_id(log_token)
+            with self.lock:
+                self.futures.pop(job_id, None)
+
+    def set_progress(self, job_id, stage, progress):
+        """ record the last finished stage and the timings so far """
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE jobs SET stage = ?, progress = ? WHERE id = ?',
+                (stage, json.dumps(progress), job_id))
+
+    def finish(self, job_id, status, result=None, error=None):
+        """ record how a job ended """
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?',
+                (status, json.dumps(result), error, time.time(), job_id))
+
+    def resume(self, timeout=None):
+        """ fail jobs left running by a process that went away and requeue the queued ones.
+            A running job counts as gone when its process on this host isn't running anymore,
+            the processes of other hosts can't be checked so their jobs are failed once they
+            started more than EXPORT_JOB_TIMEOUT seconds ago
+        """
+        timeout = float(timeout if timeout is not None else os.environ.get('EXPORT_JOB_TIMEOUT', 3600))
+        now = time.time()
+        with self.transaction() as connection:
+            running = connection.execute(
+                'SELECT id, worker, started FROM jobs WHERE status = ?', (STATUS_RUNNING,)).fetchall()
+        self.interrupt([
+            row['id'] for row in running
+            if row['started'] < now - timeout or self.is_gone(row['worker'])])
+        with self.transaction() as connection:
+            rows = connection.execute(
+                'SELECT id FROM jobs WHERE status = ? ORDER BY created', (STATUS_QUEUED,)).fetchall()
+        for row in rows:
+            self.submit(row['id'])
+        return [row['id'] for row in rows]
+
+    def interrupt(self, job_ids):
+        """ fail running jobs whose process went away """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                'UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND status = ?',
+                [(STATUS_FAILED, ERROR_JOB_INTERRUPTED, now, job_id, STATUS_RUNNING) for job_id in job_ids])
+
+    @staticmethod
+    def is_gone(worker):
+        """ check the process that claimed a job isn't running anymore, only known on its own host """
+        fields = (worker or '').split(':')
+        if len(fields) < 2 or fields[0] != socket.gethostname() or not fields[1].isdigit():
+            return False
+        pid = int(fields[1])
+        if pid == os.getpid():
+            # this pid, but an earlier process when the token differs
+            return fields[2:] != [PROCESS_TOKEN]
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            # running as another user
+            return False
+        return False
+
+    def wait(self, job_id, timeout=None):
+        """ block until a job submitted by this queue is done, returns the job """
+        with self.lock:
+            future = self.futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+        return self.get(job_id)
+
+    def close(self, wait=True):
+        """ stop the worker pool """
+        self.executor.shutdown(wait=wait)
+
+def get_db_path():
+    """ path of the jobs database in the local state directory """
+    return local_store.get_state_path(JOBS_DB_FILE)
+
+def create_queue(runner):
+    """ a JobQueue running jobs with runner, resuming the jobs left by the previous process """
+    queue = JobQueue(runner)
+    queue.resume()
+    return queue
+
+_QUEUE = singleton.ProcessWide(create_queue)
+
+def get_queue(runner):
+    """ the process wide JobQueue, created and resumed on first use """
+    return _QUEUE.get(runner)
+
+def set_queue(queue):
+    """ swap the process wide JobQueue, returns the previous one """
+    return _QUEUE.set(queue)
@@ -0,0 +1,70 @@
+"""Local state kept on disk between runs."""
+import os
+import json
+import fcntl
+import sqlite3
+import tempfile
+import contextlib
+
+DEFAULT_STATE_DIR = os.path.dirname(__file__) + '/exported_data/'
+
+def get_state_path(file_name):
+    """ path of a state file, in DISPATCHER_STATE_DIR when set """
+    state_dir = os.environ.get('DISPATCHER_STATE_DIR', DEFAULT_STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, file_name)
+
+def is_persistent():
+    """ check DISPATCHER_STATE_DIR is set, the default directory is inside the package
+        and is lost whenever the service is deployed or its dyno restarts
+    """
+    return bool(os.environ.get('DISPATCHER_STATE_DIR'))
+
+def read_json(file_name, default=None):
+    """ read a json state file, default when it doesn't exist yet """
+    path = get_state_path(file_name)
+    if not os.path.isfile(path):
+        return default
+    with open(path, 'r') as file_obj:
+        return json.load(file_obj)
+
+def write_json(file_name, data):
+    """ atomically replace a json state file """
+    path = get_state_path(file_name)
+    file_handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + file_name)
+    try:
+        with os.fdopen(file_handle, 'w') as file_obj:
+            json.dump(data, file_obj)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+@contextlib.contextmanager
+def sqlite_transaction(path):
+    """ a sqlite connection committed on success and closed after use,
+        open one per call since sqlite connections can't be shared between threads
+    """
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+@contextlib.contextmanager
+def claim(file_name):
+    """ an exclusive lock on a state file held while the block runs, shared by every process
+        and thread using the state directory. Yields False without waiting when it's already held
+    """
+    with open(get_state_path(file_name), 'a') as file_obj:
+        try:
+            fcntl.flock(file_obj.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(file_obj.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,133 @@
+"""Structured JSON logging with request correlation ids, sampling and truncation."""
+import os
+import json
+import time
+import uuid
+import random
+import zlib
+import logging
+import datetime
+import contextvars
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+DEFAULT_MAX_FIELD_LENGTH = 1000
+
+# correlation id of the request or background job being handled
+REQUEST_ID = contextvars.ContextVar('request_id', default=None)
+
+# LogRecord attributes that are not extra fields
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def get_request_id():
+    """ correlation id of the current request, None outside of one """
+    return REQUEST_ID.get()
+
+def set_request_id(request_id):
+    """ set the correlation id, returns a token for reset_request_id """
+    return REQUEST_ID.set(request_id)
+
+def reset_request_id(token):
+    """ restore the correlation id set before set_request_id """
+    REQUEST_ID.reset(token)
+
+def truncate(value, max_length, keep_tail=False):
+    """ cut long strings, noting how much was dropped """
+    if not isinstance(value, str) or len(value) <= max_length:
+        return value
+    dropped = '...(+{0} chars)'.format(len(value) - max_length)
+    if keep_tail:
+        return dropped + value[-max_length:]
+    return value[:max_length] + dropped
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per line: time, level, logger, message, request id and extra fields """
+
+    def __init__(self, max_field_length=None):
+        super().__init__()
+        self.max_field_length = int(max_field_length if max_field_length is not None else os.environ.get(
+            'LOG_MAX_FIELD_LENGTH', DEFAULT_MAX_FIELD_LENGTH))
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': truncate(record.getMessage(), self.max_field_length)
+        }
+        request_id = get_request_id()
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = self.truncate_value(value)
+        if record.exc_info:
+            # the end of a traceback says what went wrong
+            entry['exception'] = truncate(self.formatException(record.exc_info), self.max_field_length * 4, keep_tail=True)
+        return json.dumps(entry, default=str)
+
+    def truncate_value(self, value):
+        """ truncate the strings of an extra field, one level into dicts and lists """
+        if isinstance(value, dict):
+            return {key: truncate(item, self.max_field_length) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [truncate(item, self.max_field_length) for item in value]
+        return truncate(value, self.max_field_length)
+
+class SamplingFilter(logging.Filter):
+    """ keep a share of the records below WARNING. Records of one request are kept or dropped together """
+
+    def __init__(self, rate=None):
+        super().__init__()
+        self.rate = float(rate if rate is not None else os.environ.get('LOG_SAMPLE_RATE', 1))
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        request_id = get_request_id()
+        if request_id:
+            return zlib.crc32(request_id.encode('utf-8')) % 10000 < self.rate * 10000
+        return random.random() < self.rate
+
+def configure():
+    """ send the root logger's records to stderr as JSON lines, at LOG_LEVEL. Safe to call again """
+    root = logging.getLogger()
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    # a copy, removing from the list being iterated skips the next handler
+    for handler in list(root.handlers):
+        if getattr(handler, 'structured', False):
+            root.removeHandler(handler)
+    handler = logging.StreamHandler()
+    handler.structured = True
+    if os.environ.get('LOG_FORMAT', 'json') == 'json':
+        handler.setFormatter(JsonFormatter())
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+    return handler
+
+class CorrelationIdMiddleware():
+    """ Falcon middleware giving every request a correlation id, from the X-Request-ID header or a new one.
+        The id is returned in the X-Request-ID response header and each request is logged with its timing
+    """
+    logger = logging.getLogger('service.request')
+
+    def process_request(self, req, _resp):
+        #pylint: disable=no-self-use
+        """ set the correlation id before routing """
+        request_id = req.get_header(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        req.context.request_id = request_id
+        req.context.log_token = set_request_id(request_id)
+        req.context.start_time = time.time()
+
+    def process_response(self, req, resp, _resource, _req_succeeded):
+        """ log the request, the query string is left out since it carries the token """
+        request_id = getattr(req.context, 'request_id', None)
+        if request_id is None:
+            return
+        resp.set_header(REQUEST_ID_HEADER, request_id)
+        self.logger.info('request', extra={
+            'method': req.method,
+            'path': req.path,
+            'status': resp.status,
+            'seconds': round(time.time() - req.context.start_time, 3)
+        })
+        reset_request_id(req.context.log_token)
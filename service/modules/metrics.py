@@ -0,0 +1,145 @@
+"""In process counters and timers, rendered in the Prometheus text format."""
+import time
+import threading
+import contextlib
+import sentry_sdk
+from . import singleton
+
+METRIC_PREFIX = 'pts_dispatcher_'
+
+# help text of every metric, a metric is rendered as a counter unless it's in TIMERS or GAUGES
+DESCRIPTIONS = {
+    'export_runs': 'Export runs by result',
+    'export_submissions': 'Submissions exported to PTS',
+    'export_upload_bytes': 'Bytes of csv uploaded to the sftp proxy',
+    'export_email_bytes': 'Bytes of csv attached to export emails',
+    'export_stage_seconds': 'Time spent in each export stage',
+    'result_runs': 'Result file runs by result',
+    'result_rows': 'Result file rows by PTS status',
+    'result_status_updates': 'Form.io status updates after a result file by result',
+    'result_stage_seconds': 'Time spent in each result file stage',
+    'http_requests': 'Outbound http requests by endpoint',
+    'http_errors': 'Outbound http requests that failed or returned an error status',
+    'http_retries': 'Outbound http request retries',
+    'http_request_seconds': 'Time spent in outbound http requests',
+    'http_request_max_seconds': 'Slowest outbound http request',
+    'row_cache_hits': 'Transformed row cache hits',
+    'row_cache_misses': 'Transformed row cache misses'
+}
+TIMERS = {'export_stage_seconds', 'result_stage_seconds', 'http_request_seconds'}
+GAUGES = {'http_request_max_seconds'}
+
+class MetricsRegistry():
+    """ Thread safe counters and timers keyed by name and labels """
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(name, labels):
+        """ hashable key of a metric and its labels """
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        """ add value to a counter """
+        key = self.get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """ record one timing """
+        key = self.get_key(name, labels)
+        with self.lock:
+            timing = self.timers.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['sum'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ time a block, also recorded as a span of the current Sentry transaction """
+        description = ','.join('{0}={1}'.format(key, value) for key, value in sorted(labels.items()))
+        start = time.time()
+        with sentry_sdk.start_span(op=name, description=description):
+            try:
+                yield
+            finally:
+                self.observe(name, time.time() - start, **labels)
+
+    def get_stats(self):
+        """ copy of the counters and timers """
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': {key: dict(timing) for key, timing in self.timers.items()}
+            }
+
+    def render(self, extra=None):
+        """ Prometheus text exposition of every metric.
+            extra: {(name, labels): value} collected elsewhere, timers as {'count': .., 'sum': ..}
+        """
+        stats = self.get_stats()
+        counters = dict(stats['counters'])
+        counters.update(extra or {})
+
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append((labels, value))
+        for (name, labels), timing in stats['timers'].items():
+            families.setdefault(name, []).append((labels, timing))
+
+        lines = []
+        for name in sorted(families):
+            metric = METRIC_PREFIX + name
+            if name in TIMERS:
+                metric_type = 'summary'
+            elif name in GAUGES:
+                metric_type = 'gauge'
+            else:
+                metric_type = 'counter'
+                metric += '_total'
+            lines.append('# HELP {0} {1}'.format(metric, DESCRIPTIONS.get(name, name)))
+            lines.append('# TYPE {0} {1}'.format(metric, metric_type))
+            for labels, value in sorted(families[name], key=lambda sample: sample[0]):
+                if metric_type == 'summary':
+                    lines.append('{0}_count{1} {2}'.format(metric, format_labels(labels), value['count']))
+                    lines.append('{0}_sum{1} {2}'.format(metric, format_labels(labels), repr(float(value['sum']))))
+                else:
+                    lines.append('{0}{1} {2}'.format(metric, format_labels(labels), repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """ reset every metric """
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+def format_labels(labels):
+    """ {key="value",...} with Prometheus escaping, empty without labels """
+    if not labels:
+        return ''
+    escaped = [
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+_REGISTRY = singleton.ProcessWide(MetricsRegistry)
+
+def get_registry():
+    """ the process wide MetricsRegistry, created on first use """
+    return _REGISTRY.get()
+
+def set_registry(registry):
+    """ swap the process wide MetricsRegistry, returns the previous one """
+    return _REGISTRY.set(registry)
+
+def inc(name, value=1, **labels):
+    """ add value to a counter of the process wide registry """
+    get_registry().inc(name, value, **labels)
+
+def timer(name, **labels):
+    """ time a block in the process wide registry """
+    return get_registry().timer(name, **labels)
@@ -1,6 +1,13 @@
 """Functions related to interacting with building permit applications."""
 import os
-import requests
+import logging
+import concurrent.futures
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_STATUS_UPDATE_CONCURRENCY = 8
 
 # pylint: disable=too-few-public-methods
 class PermitApplication():
@@ -27,14 +34,67 @@ class PermitApplication():
             submission_endpoint='applications'
         )
 
-        response = requests.get(
+        response = http_client.get_client().get(
             url,
+            endpoint='formio.get_applications',
             headers=headers,
             params=query_params
         )
         response.raise_for_status()
-        print(response.json())
-        return response.json()
+        submissions = response.json()
+        # metadata only, submissions carry applicant PII
+        logger.info('Fetched submissions', extra={'params': query_params, 'submissions': len(submissions)})
+        return submissions
+
+    @staticmethod
+    def iter_applications_by_query(
+            query_params,
+            page_size=None,
+            cursor=False,
+            prefetch=True,
+            base_url=None,
+            formio_api_key=None
+        ):
+        """
+        Given a query parameters, lazily yield submissions one page at a time.
+        Pages use limit/skip, or with cursor=True the _id of the last submission,
+        which doesn't skip records when earlier ones drop out of the query.
+        With prefetch=True the next page is requested while the current one is consumed
+        """
+        page_size = int(page_size if page_size else os.environ.get('FORMIO_PAGE_SIZE', DEFAULT_PAGE_SIZE))
+
+        def get_page(skip, last_id):
+            params = dict(query_params)
+            params.setdefault('sort', '_id')
+            params['limit'] = page_size
+            if cursor:
+                if last_id:
+                    params['_id__gt'] = last_id
+            else:
+                params['skip'] = skip
+            return PermitApplication.get_applications_by_query(params, base_url, formio_api_key)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            skip = 0
+            last_id = None
+            next_page = None
+            while True:
+                page = next_page.result() if next_page else get_page(skip, last_id)
+                next_page = None
+                if not page:
+                    break
+
+                skip += len(page)
+                last_id = page[-1]['_id']
+                last_page = len(page) < page_size
+                if prefetch and not last_page:
+                    next_page = executor.submit(get_page, skip, last_id)
+
+                for submission in page:
+                    yield submission
+
+                if last_page:
+                    break
 
     @staticmethod
     def update_status(
@@ -59,10 +119,44 @@ class PermitApplication():
             id=formio_id
         )
 
-        response = requests.patch(
+        response = http_client.get_client().patch(
             url,
+            endpoint='formio.update_status',
             headers=headers,
             data=payload
         )
         response.raise_for_status()
         return response.json()
+
+    @staticmethod
+    def update_statuses(
+            formio_ids,
+            max_workers=None,
+            base_url=None,
+            formio_api_key=None
+        ):
+        """
+        update actionState of many submissions concurrently, at most max_workers at a time.
+        A failed update doesn't stop the others, returns {formio_id: {'status': 'success'|'error', ...}}
+        """
+        max_workers = int(max_workers if max_workers else os.environ.get(
+            'STATUS_UPDATE_CONCURRENCY', DEFAULT_STATUS_UPDATE_CONCURRENCY))
+        ret = {}
+        if not formio_ids:
+            return ret
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(PermitApplication.update_status, formio_id, base_url, formio_api_key): formio_id
+                for formio_id in formio_ids
+            }
+            for future in concurrent.futures.as_completed(futures):
+                formio_id = futures[future]
+                try:
+                    future.result()
+                    ret[formio_id] = {'status': 'success'}
+                #pylint: disable=broad-except
+                except Exception as exception:
+                    logger.exception('PermitApplication.update_statuses Exception', extra={'formio_id': formio_id})
+                    ret[formio_id] = {'status': 'error', 'message': '{0}'.format(exception)}
+        return ret
@@ -1,22 +1,63 @@
 """Process result file module"""
 import os
+import io
+import csv
 import json
+import time
 import datetime
 import logging
+import collections
+import contextlib
 #import ast
 import jsend
 import falcon
 import pytz
-import pysftp
 import sendgrid
 import sentry_sdk
-import pandas as pd
+import xlsxwriter
+from . import local_store
+from . import sftp_client
+from . import metrics
 from .permit_applications import PermitApplication
 from ..resources.export import Export
 from ..transforms.transform import TransformBase
 
+# tracker spreadsheet columns, the remaining columns are left empty for permit techs
+TRACKER_COLUMNS = (
+    'formio id',
+    'status',
+    'error',
+    'bb_project_id',
+    'project_address',
+    'block',
+    'lot',
+    'date_created',
+    'applicant_name',
+    'applicant_phone',
+    'applicant_email',
+    'staff_assignment',
+    'bpa#',
+    'last_remark_date',
+    'last_remarks',
+    'ppc_release_date',
+    'issued_closed_date'
+)
+
+# DBI_permits_YYYYMMDDHHMI_response.csv, month/day/hour/minute are not zero padded
+RESULT_FILE_PATTERN = r'DBI_permits_\d+_response\.csv'
+RESULT_STATE_FILE = 'result_files.json'
+RESULT_LOCK_FILE = 'result_files.lock'
+
+TRACKER_SHEET_NAME = 'New Submittals'
+TRACKER_WRITER_PANDAS = 'pandas'
+TRACKER_WRITER_XLSXWRITER = 'xlsxwriter'
+
+logger = logging.getLogger(__name__)
+
 ERROR_GENERIC = "Bad Request"
 ERROR_ACCESS_401 = "Unauthorized"
+ERROR_RESULT_STATE = "Set DISPATCHER_STATE_DIR to a persistent directory to discover result files"
+ERROR_RESULT_BUSY = "Result files are already being processed"
 
 class ProcessResultFile():
     """ Class for processing result file """
@@ -24,6 +65,12 @@ class ProcessResultFile():
 
     def on_get(self, req, resp):
         """ on get request """
+        with sentry_sdk.start_transaction(op='result', name='ProcessResultFile.on_get'):
+            self.process_result(req, resp)
+        metrics.inc('result_runs', result='success' if resp.status == falcon.HTTP_200 else 'error')
+
+    def process_result(self, req, resp):
+        """ process today's result file, or every new one with discover=1 """
         try:
             if req.params['token'] != os.environ.get('EXPORT_TOKEN') and req.params['token'] != os.environ.get('ACCESS_KEY'):
                 raise ValueError(ERROR_ACCESS_401)
@@ -37,17 +84,29 @@ class ProcessResultFile():
             hours_added = datetime.timedelta(hours=-1) # rewind 1 hour to get the correct uploaded file name
             file_time = current_time + hours_added
             file_name = 'DBI_permits_' + str(file_time.year) + str(file_time.month) + str(file_time.day) + str(file_time.hour) + str(file_time.minute) + '_response.csv'
-            result = self.get_result_file(file_name)
+            stream = bool(req.params['stream']) if 'stream' in req.params else False
+            discover = bool(req.params['discover']) if 'discover' in req.params else False
+            if discover:
+                # process every result file since the last processed one
+                file_names = self.process_new_result_files(stream)
+                resp.body = json.dumps(jsend.success({'message': file_names, 'responses':len(file_names)}))
+                resp.status = falcon.HTTP_200
+                return
 
-            if result == file_name:
-                # dowloaded the result file
-                self.process_file(self.data_file_path + file_name)
+            if stream:
+                result = file_name if self.process_remote_file(file_name) is not None else ''
+            else:
+                result = self.get_result_file(file_name)
+                if result == file_name:
+                    # dowloaded the result file
+                    self.process_file(self.data_file_path + file_name)
 
+            if result == file_name:
                 resp.body = json.dumps(jsend.success({'message': file_name, 'responses':len(file_name)}))
                 resp.status = falcon.HTTP_200
         #pylint: disable=broad-except
         except Exception as exception:
-            logging.exception('ProcessResultFile.on_get Exception')
+            logger.exception('ProcessResultFile.on_get Exception')
             resp.status = falcon.HTTP_500
 
             msg_error = ERROR_GENERIC
@@ -58,36 +117,30 @@ class ProcessResultFile():
 
     #pylint: disable=no-self-use,too-many-locals
     def process_file(self, file_name):
-        """ process the result file """
-        tracker = {
-            'formio id': [],
-            'status': [],
-            'error': [],
-            'bb_project_id': [],
-            'project_address': [],
-            'block': [],
-            'lot': [],
-            'date_created': [],
-            'applicant_name': [],
-            'applicant_phone': [],
-            'applicant_email': [],
-            'staff_assignment': [],
-            'bpa#': [],
-            'last_remark_date': [],
-            'last_remarks': [],
-            'ppc_release_date': [],
-            'issued_closed_date': [],
-        }
+        """ process the result file, a local path, an open file or its parsed rows """
+        tracker = self.new_tracker()
 
-        exported_submissions = self.get_exported_submissions()
+        with metrics.timer('result_stage_seconds', stage='fetch'):
+            exported_submissions = self.get_exported_submissions()
         #data_file = open(self.data_file_path + 'exported_submissions.txt', 'r')
         #data_string = data_file.read()
         #exported_submissions = ast.literal_eval(data_string)
         #data_file.close()
 
-        summary_email_content = self.create_email_content(file_name, tracker, exported_submissions)
+        with metrics.timer('result_stage_seconds', stage='read'):
+            summary_email_content = self.create_email_content(file_name, tracker, exported_submissions)
+        # if successfully loaded into PTS, update submission status
+        with metrics.timer('result_stage_seconds', stage='status_update'):
+            status_updates = PermitApplication.update_statuses(summary_email_content['success_ids'])
+        summary_email_content['status_updates'] = status_updates
+        failed_updates = [formio_id for formio_id, result in status_updates.items() if result['status'] != 'success']
+        metrics.inc('result_status_updates', len(status_updates) - len(failed_updates), result='success')
+        metrics.inc('result_status_updates', len(failed_updates), result='error')
+        if failed_updates:
+            summary_email_content['email_body_content'] += '<p>Status update failed: ' + ', '.join(failed_updates) + '</p>'
         # create tracker XLS
-        tracker_file_content = self.create_tracker_file(summary_email_content['tracker_content'])
+        with metrics.timer('result_stage_seconds', stage='tracker'):
+            tracker_file_content = self.create_tracker_file(summary_email_content['tracker_content'])
 
         subject = 'CSV export summary'
         recipients = {
@@ -96,30 +149,86 @@ class ProcessResultFile():
             'cc_emails': os.environ.get('SUMMARY_EMAIL_CC', None),
             'bcc_emails': os.environ.get('SUMMARY_EMAIL_BCC', None)
         }
-        Export().email(recipients, subject, summary_email_content['email_body_content'], 'Tracker.xlsx', tracker_file_content)
+        with metrics.timer('result_stage_seconds', stage='email'):
+            Export().email(recipients, subject, summary_email_content['email_body_content'], 'Tracker.xlsx', tracker_file_content)
         return summary_email_content
 
     #pylint: disable=no-self-use,too-many-locals
     def get_result_file(self, file_name):
-        """ get result fild from sftp folder """
-
-        host = os.environ.get('SFTP_HOSTNAME')
-        user = os.environ.get('SFTP_USERNAME')
-        pass_ = os.environ.get('SFTP_PASSWORD')
-        cnopts = pysftp.CnOpts()
-        cnopts.hostkeys = None
-
-        with pysftp.Connection(host=host, username=user, password=pass_, cnopts=cnopts) as sftp:
-            localfilepath = self.data_file_path + file_name
-            try:
-                sftp.get(file_name, localfilepath)
-            #pylint: disable=broad-except
-            except Exception as exception:
-                print("Exception: {0}".format(str(exception)))
-                return ''
+        """ get result fild from sftp folder, the sftp connection is reused across calls """
+        localfilepath = self.data_file_path + file_name
+        try:
+            with metrics.timer('result_stage_seconds', stage='download'):
+                sftp_client.get_client().get(file_name, localfilepath)
+        #pylint: disable=broad-except
+        except Exception as exception:
+            logger.warning('Result file download failed', extra={'file_name': file_name, 'error': str(exception)})
+            return ''
 
         return file_name
 
+    def process_remote_file(self, file_name):
+        """ read the result file from the sftp folder into process_file, without a local file.
+            Its rows are parsed into memory, one short row per exported submission, so the remote
+            file is closed before they're processed
+            returns the summary, None if the file doesn't exist
+        """
+        client = sftp_client.get_client()
+        if not client.exists(file_name):
+            return None
+        # parsed before the Form.io, PTS and SendGrid calls, which would otherwise hold
+        # the remote file and the sftp connection
+        with client.open_text(file_name) as result_file:
+            rows = list(self.iter_result_rows(result_file))
+        return self.process_file(rows)
+
+    def process_new_result_files(self, stream=False):
+        """ list the sftp folder once and process every result file newer than the high-water mark,
+            oldest first. The mark is saved after each file so a failure resumes from that file.
+            A lost mark would process the files of the lookback window again, re-sending their status
+            updates and emails, so the mark has to be kept in a persistent DISPATCHER_STATE_DIR.
+            Only one run at a time claims the files, an overlapping run fails with ERROR_RESULT_BUSY
+        """
+        if not local_store.is_persistent():
+            raise ValueError(ERROR_RESULT_STATE)
+        file_names = []
+        with local_store.claim(RESULT_LOCK_FILE) as claimed:
+            if not claimed:
+                raise ValueError(ERROR_RESULT_BUSY)
+            for attr in self.discover_result_files():
+                if stream:
+                    self.process_remote_file(attr.filename)
+                elif self.get_result_file(attr.filename) == attr.filename:
+                    self.process_file(self.data_file_path + attr.filename)
+                else:
+                    raise IOError('Unable to download ' + attr.filename)
+                self.set_high_water_mark(attr.st_mtime, attr.filename)
+                file_names.append(attr.filename)
+        return file_names
+
+    def discover_result_files(self):
+        """ result files newer than the high-water mark, sorted by modification time then name """
+        mark = self.get_high_water_mark()
+        result_files = sftp_client.get_client().list_files(RESULT_FILE_PATTERN)
+        result_files = [attr for attr in result_files if (attr.st_mtime, attr.filename) > mark]
+        return sorted(result_files, key=lambda attr: (attr.st_mtime, attr.filename))
+
+    @staticmethod
+    def get_high_water_mark():
+        """ (mtime, file name) of the last processed result file.
+            Without one, files from the last RESULT_FILE_LOOKBACK_HOURS are picked up
+        """
+        state = local_store.read_json(RESULT_STATE_FILE)
+        if state:
+            return (state['mtime'], state['file_name'])
+        lookback = float(os.environ.get('RESULT_FILE_LOOKBACK_HOURS', 24))
+        return (time.time() - lookback * 3600, '')
+
+    @staticmethod
+    def set_high_water_mark(mtime, file_name):
+        """ persist the last processed result file """
+        local_store.write_json(RESULT_STATE_FILE, {'mtime': mtime, 'file_name': file_name})
+
     def get_exported_submissions(self):
         """ get submissions in the current csv export """
         _query = {
@@ -138,109 +247,161 @@ class ProcessResultFile():
             ret[item['_id']]['date_created'] = item['created']
         return ret
 
-    def create_tracker_file(self, tracker):
-        """ create the tracker spreadsheet """
-        file_content = ''
+    def create_tracker_file(self, tracker, writer=None):
+        """ create the tracker spreadsheet in memory
+            writer: 'pandas' (default) or 'xlsxwriter', defaults to TRACKER_WRITER
+        """
+        writer = writer if writer else os.environ.get('TRACKER_WRITER', TRACKER_WRITER_PANDAS)
+        if writer == TRACKER_WRITER_XLSXWRITER:
+            return self.write_tracker_xlsx(tracker)
+
+        # pandas is only needed by the pandas tracker writer
+        import pandas as pd # pylint: disable=import-outside-toplevel
+        buffer = io.BytesIO()
         # Create a Pandas dataframe from tracker data.
-        tracker_file = self.data_file_path + 'tracker_tmp.xlsx'
-        # Create a Pandas dataframe from some data.
         data_frame = pd.DataFrame(tracker)
 
         # Create a Pandas Excel writer using XlsxWriter as the engine.
         #pylint: disable=abstract-class-instantiated
-        writer = pd.ExcelWriter(tracker_file, engine='xlsxwriter')
+        excel_writer = pd.ExcelWriter(buffer, engine='xlsxwriter')
 
         # update column names
         data_frame.rename(columns=TransformBase.pretty_string, inplace=True)
-        data_frame.to_excel(writer, sheet_name='New Submittals', index=False)
+        data_frame.to_excel(excel_writer, sheet_name=TRACKER_SHEET_NAME, index=False)
 
         # Close the Pandas Excel writer and output the Excel file.
-        writer.save()
-
-        if os.path.isfile(tracker_file):
-            file1 = open(tracker_file, 'rb')
-            file_content = file1.read()
-            file1.close()
-            #clean up tmp file
-            os.remove(tracker_file)
-        return file_content
+        excel_writer.close()
+        return buffer.getvalue()
+
+    @staticmethod
+    def write_tracker_xlsx(tracker):
+        """ create the tracker spreadsheet with xlsxwriter directly, no DataFrame is built """
+        buffer = io.BytesIO()
+        workbook = xlsxwriter.Workbook(buffer, {'in_memory': True})
+        worksheet = workbook.add_worksheet(TRACKER_SHEET_NAME)
+        # same header style as pandas to_excel
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+        for col, column in enumerate(tracker):
+            worksheet.write_string(0, col, TransformBase.pretty_string(column), header_format)
+            for row, value in enumerate(tracker[column], 1):
+                worksheet.write(row, col, value)
+
+        workbook.close()
+        return buffer.getvalue()
 
     #pylint: disable=no-self-use, too-many-locals, R0915
-    def create_email_content(self, file_name, tracker, exported_submissions):
-        """ Create summary email for permit techs """
+    def create_email_content(self, file_name, tracker, exported_submissions, debug_dump=None):
+        """ Create summary email for permit techs
+            the result file is read row by row and the html table is joined once at the end.
+            debug_dump: path to write the tracker to, defaults to RESULT_DEBUG_DUMP, off when unset
+        """
         ret = {}
-        file_handle = open(file_name, 'r')
-        content = '<table><tr><th>Integration Status</th><th>Error</th><th>Date Created</th><th>BB Project ID</th><th>Formio ID</th>'
-        content += '<th>Email</th><th>Name</th><th>Project Address</th><th>Block</th><th>Lot</th><th>Uploaded Files</th></tr>'
+        success_ids = []
+        statuses = collections.Counter()
+        content = ['<table><tr><th>Integration Status</th><th>Error</th><th>Date Created</th><th>BB Project ID</th><th>Formio ID</th>']
+        content.append('<th>Email</th><th>Name</th><th>Project Address</th><th>Block</th><th>Lot</th><th>Uploaded Files</th></tr>')
         # loop through the result file to create the summary table
-        file2 = open('tracker.txt', 'w')
-        for line in file_handle:
-            fields = line.split('|')
-            #skip header
-            if fields[0] == 'FORMIO':
-                continue
-            formio_id = fields[0]
-            status = fields[1]
-            uploaded_files = bb_project_id = date_created = applicant_first_name = applicant_last_name = block = lot = project_address = applicant_email =  ''
-            if formio_id in exported_submissions:
-                tracker['formio id'].append(formio_id)
-                tracker['status'].append(status)
-                tracker['error'].append(fields[2])
-                #file2.write(str(exported_submissions[formio_id]))
-                project_address = exported_submissions[formio_id].get('projectAddress', '')
-                tracker['project_address'].append(project_address)
-                block = exported_submissions[formio_id].get('projectAddressBlock', '')
-                tracker['block'].append(block)
-                lot = exported_submissions[formio_id].get('projectAddressLot', '')
-                tracker['lot'].append(lot)
-                bb_project_id = exported_submissions[formio_id].get('bluebeamId', '')
-                tracker['bb_project_id'].append(bb_project_id)
-                applicant_email = exported_submissions[formio_id].get('applicantEmail', '')
-                tracker['applicant_email'].append(applicant_email)
-                applicant_first_name = exported_submissions[formio_id].get('applicantFirstName', '')
-                applicant_last_name = exported_submissions[formio_id].get('applicantLastName', '')
-                tracker['applicant_name'].append(applicant_first_name + ' ' + applicant_last_name)
-                applicant_phone = exported_submissions[formio_id].get('applicantPhoneNumber', '')
-                tracker['applicant_phone'].append(applicant_phone)
-                date_created = exported_submissions[formio_id].get('date_created', '')
-                if date_created:
-                    date_created = datetime.datetime.strptime(date_created, '%Y-%m-%dT%H:%M:%S.%fZ').strftime("%Y/%m/%d %H:%M:%S")
-                tracker['date_created'].append(date_created)
-                uploaded_files = self.get_uploaded_file_names(exported_submissions[formio_id])
-                #fill empty tracker columns with empty values
-                tracker['staff_assignment'].append('')
-                tracker['bpa#'].append('')
-                tracker['last_remark_date'].append('')
-                tracker['last_remarks'].append('')
-                tracker['ppc_release_date'].append('')
-                tracker['issued_closed_date'].append('')
-            # if successfully loaded into PTS, update submission status
+        for formio_id, status, error in self.read_result_rows(file_name):
+            statuses[status] += 1
+            submission = exported_submissions.get(formio_id)
+            row = self.get_tracker_row(formio_id, status, error, submission)
+            uploaded_files = ''
+            if submission is not None:
+                for column in TRACKER_COLUMNS:
+                    tracker[column].append(row[column])
+                uploaded_files = self.get_uploaded_file_names(submission)
+            # successfully loaded into PTS, status is updated after the whole file is read
             if status == 'Success':
-                PermitApplication.update_status(formio_id)
+                success_ids.append(formio_id)
                 # send email to applicants with success email template?
 
-            content += '<tr>'
-            content += '<td>' + status + '</td>'
-            content += '<td>' + fields[2] + '</td>'
-            content += '<td>' + date_created + '</td>'
-            content += '<td>' + bb_project_id + '</td>'
-            content += '<td>' + formio_id + '</td>'
-            content += '<td>' + applicant_email + '</td>'
-            content += '<td>' + applicant_first_name + ' ' + applicant_last_name + '</td>'
-            content += '<td>' + project_address + '</td>'
-            content += '<td>' + block + '</td>'
-            content += '<td>' + lot + '</td>'
-            content += '<td>' + uploaded_files + '</td>'
-            content += '</tr>'
-
-        file_handle.close()
-        file2.write(str(tracker))
-        file2.close()
-        content += '</table>'
-        ret['email_body_content'] = content
+            content.append(''.join([
+                '<tr>',
+                '<td>', status, '</td>',
+                '<td>', error, '</td>',
+                '<td>', row['date_created'], '</td>',
+                '<td>', row['bb_project_id'], '</td>',
+                '<td>', formio_id, '</td>',
+                '<td>', row['applicant_email'], '</td>',
+                '<td>', row['applicant_name'], '</td>',
+                '<td>', row['project_address'], '</td>',
+                '<td>', row['block'], '</td>',
+                '<td>', row['lot'], '</td>',
+                '<td>', uploaded_files, '</td>',
+                '</tr>'
+            ]))
+
+        for status, count in statuses.items():
+            metrics.inc('result_rows', count, status=status)
+
+        debug_dump = debug_dump if debug_dump else os.environ.get('RESULT_DEBUG_DUMP')
+        if debug_dump:
+            with open(debug_dump, 'w') as dump_file:
+                dump_file.write(str(tracker))
+        content.append('</table>')
+        ret['email_body_content'] = ''.join(content)
         ret['tracker_content'] = tracker
+        ret['success_ids'] = success_ids
         return ret
 
+    @staticmethod
+    @contextlib.contextmanager
+    def open_result_file(result_file):
+        """ open a result file path, or pass through an already open file or line iterator """
+        if isinstance(result_file, str):
+            with open(result_file, 'r', newline='') as file_handle:
+                yield file_handle
+        else:
+            yield result_file
+
+    def read_result_rows(self, result_file):
+        """ (formio id, status, error) rows of a result file path, an open file or already parsed rows """
+        if isinstance(result_file, list):
+            yield from result_file
+            return
+        with self.open_result_file(result_file) as file_handle:
+            yield from self.iter_result_rows(file_handle)
+
+    @staticmethod
+    def iter_result_rows(file_handle):
+        """ lazily parse the pipe delimited result file into (formio id, status, error) rows """
+        for fields in csv.reader(file_handle, delimiter='|', quoting=csv.QUOTE_NONE):
+            #skip header and blank lines
+            if not fields or fields[0] == 'FORMIO':
+                continue
+            fields += [''] * (3 - len(fields))
+            yield fields[0], fields[1], fields[2]
+
+    @staticmethod
+    def new_tracker():
+        """ empty tracker columns """
+        return {column: [] for column in TRACKER_COLUMNS}
+
+    @staticmethod
+    def get_tracker_row(formio_id, status, error, submission):
+        """ tracker values of one result file row, empty when the submission wasn't exported """
+        row = {column: '' for column in TRACKER_COLUMNS}
+        row['formio id'] = formio_id
+        row['status'] = status
+        row['error'] = error
+        row['applicant_name'] = ' '
+        if submission is None:
+            return row
+
+        row['project_address'] = submission.get('projectAddress', '')
+        row['block'] = submission.get('projectAddressBlock', '')
+        row['lot'] = submission.get('projectAddressLot', '')
+        row['bb_project_id'] = submission.get('bluebeamId', '')
+        row['applicant_email'] = submission.get('applicantEmail', '')
+        row['applicant_name'] = submission.get('applicantFirstName', '') + ' ' + submission.get('applicantLastName', '')
+        row['applicant_phone'] = submission.get('applicantPhoneNumber', '')
+        date_created = submission.get('date_created', '')
+        if date_created:
+            date_created = datetime.datetime.strptime(date_created, '%Y-%m-%dT%H:%M:%S.%fZ').strftime("%Y/%m/%d %H:%M:%S")
+        row['date_created'] = date_created
+        return row
+
     def get_uploaded_file_names(self, exported_submission):
         """ get all upload file names """
         aws_file_url = os.environ['AWS_FILE_URL']
@@ -0,0 +1,111 @@
+"""Opt-in cProfile profiling of single requests, profiles kept by request id."""
+import os
+import re
+import io
+import glob
+import uuid
+import pstats
+import logging
+import cProfile
+import threading
+from . import local_store
+from . import log
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+PROFILES_DIR = 'profiles'
+PROFILED_PATHS = ('/export', '/processResultFile')
+DEFAULT_PROFILE_KEEP = 20
+DEFAULT_PROFILE_LIMIT = 40
+
+# profile ids end up in file names
+PROFILE_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+def is_valid_profile_id(profile_id):
+    """ whether a profile id is safe to use as a file name """
+    return bool(PROFILE_ID_PATTERN.match(profile_id or ''))
+
+def get_profile_path(profile_id):
+    """ path of the pstats file of a profile """
+    directory = local_store.get_state_path(PROFILES_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, profile_id + '.pstats')
+
+def save_profile(profile_id, profile, keep=None):
+    """ write a profile's pstats, keeping only the `keep` most recent profiles """
+    keep = int(keep if keep is not None else os.environ.get('PROFILE_KEEP', DEFAULT_PROFILE_KEEP))
+    path = get_profile_path(profile_id)
+    profile.dump_stats(path)
+    saved = sorted(glob.glob(os.path.join(os.path.dirname(path), '*.pstats')), key=os.path.getmtime)
+    for old_path in saved[:-keep] if keep > 0 else saved:
+        if old_path != path:
+            os.remove(old_path)
+    return path
+
+def load_profile(profile_id):
+    """ path of a saved profile, None when there isn't one """
+    if not is_valid_profile_id(profile_id):
+        return None
+    path = get_profile_path(profile_id)
+    return path if os.path.isfile(path) else None
+
+def format_profile(path, sort='cumulative', limit=DEFAULT_PROFILE_LIMIT):
+    """ the top `limit` functions of a saved profile as pstats text """
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+class ProfilerMiddleware():
+    """ Falcon middleware profiling a request of PROFILED_PATHS with cProfile when it has
+        the X-Profile header or the profile query flag and a valid ACCESS_KEY header.
+        The profile is saved under the request id, returned in the X-Profile-Id header,
+        and read back from /profiles/{profile_id}.
+        Only the request's thread is profiled, export jobs run with async=1 are not
+    """
+    # only one profiler can be active in the process at a time
+    lock = threading.Lock()
+
+    def __init__(self, paths=PROFILED_PATHS):
+        self.paths = paths
+
+    def is_requested(self, req):
+        """ whether the request asked to be profiled and may be """
+        if req.path not in self.paths:
+            return False
+        if not (req.get_header(PROFILE_HEADER) or req.get_param_as_bool(PROFILE_PARAM)):
+            return False
+        access_key = os.environ.get('ACCESS_KEY')
+        return bool(access_key) and req.get_header('ACCESS_KEY') == access_key
+
+    def process_request(self, req, resp):
+        """ start profiling before routing """
+        if not self.is_requested(req):
+            return
+        if not self.lock.acquire(blocking=False):
+            resp.set_header(PROFILE_HEADER, 'busy')
+            return
+        profile_id = log.get_request_id()
+        req.context.profile_id = profile_id if is_valid_profile_id(profile_id) else uuid.uuid4().hex
+        req.context.profile = cProfile.Profile()
+        req.context.profile.enable()
+
+    def process_response(self, req, resp, _resource, _req_succeeded):
+        """ stop profiling and save the profile """
+        profile = getattr(req.context, 'profile', None)
+        if profile is None:
+            return
+        try:
+            profile.disable()
+        finally:
+            req.context.profile = None
+            self.lock.release()
+        try:
+            save_profile(req.context.profile_id, profile)
+            resp.set_header(PROFILE_ID_HEADER, req.context.profile_id)
+        #pylint: disable=broad-except
+        except Exception:
+            logger.exception('ProfilerMiddleware.process_response Exception')
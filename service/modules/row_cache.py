@@ -0,0 +1,155 @@
+"""Cache of transformed csv rows keyed by submission content."""
+import os
+import json
+import hashlib
+import time
+import threading
+import collections
+from . import local_store
+from . import singleton
+
+ROW_CACHE_DB_FILE = 'row_cache.sqlite3'
+DEFAULT_ROW_CACHE_SIZE = 10000
+DEFAULT_ROW_CACHE_DISK_SIZE = 100000
+
+def get_key(submission, salt=''):
+    """ cache key of a submission, changes with its _id, created time, data or the salt """
+    content = json.dumps(
+        [salt, submission.get('_id'), submission.get('created'), submission.get('data')],
+        sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+class RowCache():
+    """ Bounded LRU cache of csv rows, optionally backed by a SQLite file """
+
+    def __init__(self, max_size=None, db_path=None, max_disk_size=None):
+        self.max_size = int(max_size if max_size is not None else os.environ.get(
+            'ROW_CACHE_SIZE', DEFAULT_ROW_CACHE_SIZE))
+        self.max_disk_size = int(max_disk_size if max_disk_size is not None else os.environ.get(
+            'ROW_CACHE_DISK_SIZE', DEFAULT_ROW_CACHE_DISK_SIZE))
+        self.db_path = db_path
+        self.rows = collections.OrderedDict()
+        # rows waiting to be written to disk, see flush()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.lock = threading.Lock()
+        if self.db_path:
+            self.create_table()
+
+    def transaction(self):
+        """ a connection to the cache database """
+        return local_store.sqlite_transaction(self.db_path)
+
+    def create_table(self):
+        """ create the rows table on first use """
+        with self.transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS rows ('
+                'key TEXT PRIMARY KEY, '
+                'row TEXT NOT NULL, '
+                'used REAL NOT NULL)')
+
+    def get(self, key):
+        """ the cached row, None on a miss """
+        with self.lock:
+            row = self.rows.get(key)
+            if row is not None:
+                self.rows.move_to_end(key)
+                self.hits += 1
+                return row
+
+        row = self.get_from_disk(key) if self.db_path else None
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self.add(key, row)
+        return row
+
+    def get_from_disk(self, key):
+        """ a row from the SQLite file """
+        with self.transaction() as connection:
+            found = connection.execute('SELECT row FROM rows WHERE key = ?', (key,)).fetchone()
+            if found is None:
+                return None
+            connection.execute('UPDATE rows SET used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(found['row'])
+
+    def set(self, key, row):
+        """ cache a row, written to disk on the next flush() """
+        with self.lock:
+            self.add(key, row)
+            if self.db_path:
+                self.pending[key] = row
+
+    def add(self, key, row):
+        """ add a row to the in memory LRU, evicting the least recently used ones """
+        self.rows[key] = row
+        self.rows.move_to_end(key)
+        while len(self.rows) > self.max_size:
+            self.rows.popitem(last=False)
+
+    def flush(self):
+        """ write the rows cached since the last flush to disk, keeping the most recently used ones """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        if not pending or not self.db_path:
+            return
+        now = time.time()
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO rows (key, row, used) VALUES (?, ?, ?)',
+                [(key, json.dumps(row), now) for key, row in pending.items()])
+            connection.execute(
+                'DELETE FROM rows WHERE key NOT IN (SELECT key FROM rows ORDER BY used DESC LIMIT ?)',
+                (self.max_disk_size,))
+
+    def get_stats(self):
+        """ hit and miss counters """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'size': len(self.rows)
+            }
+
+    def clear(self):
+        """ drop every cached row and reset the counters """
+        with self.lock:
+            self.rows.clear()
+            self.pending = {}
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+        if self.db_path:
+            with self.transaction() as connection:
+                connection.execute('DELETE FROM rows')
+
+def create_cache():
+    """ a RowCache, None when ROW_CACHE_SIZE is 0.
+        Rows are also kept in DISPATCHER_STATE_DIR when ROW_CACHE_DISK is set
+    """
+    if int(os.environ.get('ROW_CACHE_SIZE', DEFAULT_ROW_CACHE_SIZE)) <= 0:
+        return None
+    db_path = local_store.get_state_path(ROW_CACHE_DB_FILE) if os.environ.get('ROW_CACHE_DISK') else None
+    return RowCache(db_path=db_path)
+
+_CACHE = singleton.ProcessWide(create_cache)
+
+def get_cache():
+    """ the process wide RowCache, None when ROW_CACHE_SIZE is 0 """
+    return _CACHE.get()
+
+def peek_cache():
+    """ the process wide RowCache if it was created, without creating it """
+    return _CACHE.peek()
+
+def set_cache(cache):
+    """ swap the process wide RowCache, returns the previous one """
+    return _CACHE.set(cache)
@@ -0,0 +1,101 @@
+"""Reusable SFTP connection to the PTS sftp server."""
+import os
+import re
+import codecs
+import threading
+import contextlib
+import pysftp
+from . import singleton
+
+class SftpClient():
+    """ Keeps one pysftp connection open and reuses it across calls """
+
+    def __init__(self, host=None, username=None, password=None, connection_factory=None):
+        self.host = host if host else os.environ.get('SFTP_HOSTNAME')
+        self.username = username if username else os.environ.get('SFTP_USERNAME')
+        self.password = password if password else os.environ.get('SFTP_PASSWORD')
+        # injectable for tests, returns a pysftp.Connection like object
+        self.connection_factory = connection_factory if connection_factory else self.connect
+        self.connection = None
+        self.connects = 0
+        self.lock = threading.RLock()
+
+    def connect(self):
+        """ open a new pysftp connection """
+        cnopts = pysftp.CnOpts()
+        cnopts.hostkeys = None
+        return pysftp.Connection(host=self.host, username=self.username, password=self.password, cnopts=cnopts)
+
+    def get_connection(self):
+        """ the open connection, reconnecting if there is none or the transport died """
+        with self.lock:
+            if self.connection is not None and not self.is_active(self.connection):
+                self.close()
+            if self.connection is None:
+                self.connection = self.connection_factory()
+                self.connects += 1
+            return self.connection
+
+    @staticmethod
+    def is_active(connection):
+        """ check the ssh transport behind a pysftp connection is still up """
+        # pysftp keeps the paramiko transport in _transport, and sets it to None on close
+        transport = getattr(connection, '_transport', None)
+        return transport is not None and transport.is_active()
+
+    def listdir(self, remotepath='.'):
+        """ file names in a remote directory """
+        with self.lock:
+            return self.get_connection().listdir(remotepath)
+
+    def listdir_attr(self, remotepath='.'):
+        """ SFTPAttributes, with filename and st_mtime, of the files in a remote directory """
+        with self.lock:
+            return self.get_connection().listdir_attr(remotepath)
+
+    def list_files(self, pattern, remotepath='.'):
+        """ SFTPAttributes of the remote files whose name matches the regex pattern """
+        regex = re.compile(pattern)
+        return [attr for attr in self.listdir_attr(remotepath) if regex.fullmatch(attr.filename)]
+
+    def exists(self, remotepath):
+        """ check a remote file exists """
+        with self.lock:
+            return self.get_connection().exists(remotepath)
+
+    def get(self, remotepath, localpath):
+        """ download a remote file to localpath """
+        with self.lock:
+            return self.get_connection().get(remotepath, localpath)
+
+    def putfo(self, file_obj, remotepath):
+        """ upload the contents of a file like object to remotepath """
+        with self.lock:
+            return self.get_connection().putfo(file_obj, remotepath)
+
+    @contextlib.contextmanager
+    def open_text(self, remotepath, encoding='utf-8'):
+        """ stream a remote text file line by line without a local copy """
+        with self.lock:
+            # paramiko's text mode already yields str lines, decode the binary ones ourselves
+            with self.get_connection().open(remotepath, 'rb') as remote_file:
+                yield codecs.iterdecode(remote_file, encoding)
+
+    def close(self):
+        """ close the connection """
+        with self.lock:
+            if self.connection is not None:
+                try:
+                    self.connection.close()
+                finally:
+                    self.connection = None
+
+_CLIENT = singleton.ProcessWide(SftpClient)
+
+def get_client():
+    """ the process wide SftpClient, created on first use """
+    return _CLIENT.get()
+
+def set_client(client):
+    """ swap the process wide SftpClient, returns the previous one """
+    return _CLIENT.set(client)
@@ -0,0 +1,41 @@
+"""Process wide instances shared by the threads of a worker, created on first use."""
+import os
+import threading
+
+class ProcessWide():
+    """ one instance per process, made by factory(*args) on first get and swapped with set.
+        A forked child, e.g. a gunicorn --preload worker, doesn't share the parent's instance:
+        its threads and connections stay in the parent, the child makes its own
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.instance = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get(self, *args):
+        """ the instance, created on first use. A factory returning None leaves it unset """
+        with self.lock:
+            if self.current() is None:
+                self.instance = self.factory(*args)
+                self.pid = os.getpid()
+            return self.instance
+
+    def peek(self):
+        """ the instance, None when it hasn't been created """
+        with self.lock:
+            return self.current()
+
+    def set(self, instance):
+        """ swap the instance, returns the previous one """
+        with self.lock:
+            previous = self.current()
+            self.instance = instance
+            self.pid = os.getpid()
+            return previous
+
+    def current(self):
+        """ the instance when this process made it, call with the lock held """
+        if self.pid != os.getpid():
+            self.instance = None
+        return self.instance
@@ -5,135 +5,283 @@ import datetime
 import base64
 import logging
 import re
-import requests
+import itertools
 import pytz
 import falcon
 import jsend
 import sendgrid
 import sentry_sdk
+from ..modules import job_queue
+from ..modules import export_ledger
+from ..modules import row_cache
+from ..modules import metrics
+from ..modules import delivery
+from ..modules import delivery_backends
+from ..modules import export_files
 from ..modules.permit_applications import PermitApplication
-from ..transforms.export_submissions import ExportSubmissionsTransform
+from .hooks import error_response
+from ..transforms.export_submissions import ExportSubmissionsTransform, WRITER_PANDAS, WRITERS, ERROR_WRITER
+
+logger = logging.getLogger(__name__)
 
 ERROR_EXPORT_GENERIC = "Bad Request"
 ERROR_EXPORT_401 = "Unauthorized"
 
+DEFAULT_UPLOAD_TIMEOUT = 300
+DEFAULT_EMAIL_TIMEOUT = 120
+
 class Export():
     """Export class"""
     def on_get(self, req, resp):
-        #pylint: disable=no-self-use,too-many-locals
+        #pylint: disable=no-self-use
         """
         on get request
-        return export message and response if successful
+        return export message and response if successful,
+        or the id of a background export job when called with async=1
         """
         try:
-            if req.params['token'] != os.environ.get('EXPORT_TOKEN') and req.params['token'] != os.environ.get('ACCESS_KEY'):
+            if not self.is_valid_token(req.params['token']):
                 raise ValueError(ERROR_EXPORT_401)
 
-            timezone = pytz.timezone('America/Los_Angeles')
+            run_async = bool(req.params['async']) if 'async' in req.params else False
+            if run_async:
+                params = {key: value for key, value in req.params.items() if key not in ('token', 'async')}
+                job_id = self.get_job_queue().enqueue(params)
+                resp.body = json.dumps(jsend.success({
+                    'job_id': job_id,
+                    'status': job_queue.STATUS_QUEUED,
+                    'url': '/export/jobs/' + job_id
+                }))
+                resp.status = falcon.HTTP_202
+                return
+
+            result = self.run_export(req.params)
+            if result is not None:
+                resp.body = json.dumps(jsend.success(result))
+                resp.status = falcon.HTTP_200
+
+        except delivery.DeliveryError as exception:
+            logger.exception('Export.on_get DeliveryError')
+            resp.status = falcon.HTTP_500
+            resp.body = json.dumps(jsend.error(str(exception), data=exception.results))
+
+        #pylint: disable=broad-except
+        except Exception as exception:
+            logger.exception('Export.on_get Exception')
+            error_response(resp, exception, ERROR_EXPORT_GENERIC)
+
+    def run_export(self, params, progress=None):
+        """
+        export_submissions in a Sentry transaction, counting runs by result
+        """
+        with sentry_sdk.start_transaction(op='export', name='Export.run_export'):
+            try:
+                result = self.export_submissions(params, progress)
+            except Exception:
+                metrics.inc('export_runs', result='error')
+                raise
+            metrics.inc('export_runs', result='success' if result is not None else 'empty')
+            return result
+
+    def export_submissions(self, params, progress=None):
+        #pylint: disable=too-many-locals,too-many-statements,too-many-branches
+        """
+        fetch, transform, upload and email the submissions waiting for export
+        progress(stage, **info) is called as the fetched, transformed, uploaded and emailed stages finish
+        with incremental=1 only submissions modified since the last recorded export are fetched
+        and the ones whose data didn't change since they were exported are skipped
+        return export message and number of submissions, None when there was nothing to export
+        """
+        progress = progress if progress else self.no_progress
+        timezone = pytz.timezone('America/Los_Angeles')
+
+        yesterday = datetime.datetime.now(timezone) - datetime.timedelta(days=1)
+        start_datetime_obj = datetime.datetime.combine(
+            yesterday, datetime.datetime.min.time())
+
+        # subject name
+        subject_name = "PTS_Export"
+        if 'name' in params:
+            subject_name = params['name'] + ' ' + subject_name
+
+        formio_query = {
+            'actionState': 'Export to PTS'
+        }
+
+        incremental = bool(params['incremental']) if 'incremental' in params else False
+        if incremental:
+            ledger = export_ledger.get_ledger()
+            mark = ledger.get_mark()
+            if mark:
+                # gte, submissions modified in the same millisecond are skipped by their hash
+                formio_query['modified__gte'] = mark
+
+        with sentry_sdk.configure_scope() as scope:
+            scope.set_extra('formio_query', formio_query)
+
+        send_email = bool(params['send_email']) if 'send_email' in params else False
+        sftp_upload = bool(params['sftp_upload']) if 'sftp_upload' in params else False
+        compiled = bool(params['compiled']) if 'compiled' in params else False
+        writer = params['writer'] if 'writer' in params else WRITER_PANDAS
+        if writer not in WRITERS:
+            raise ValueError(ERROR_WRITER)
+        # compress=gzip|zip and part_rows=N change the files the export is delivered as
+        compression, part_rows = export_files.get_options(params)
+        submissions_csv = None
+        sep = ','
+
+        # with pagination only the first page is fetched here, the others are timed with the transform
+        with metrics.timer('export_stage_seconds', stage='fetch'):
+            paginate = bool(params['paginate']) if 'paginate' in params else False
+            if paginate:
+                # submissions are fetched page by page while they are transformed
+                responses = PermitApplication.iter_applications_by_query(
+                    formio_query, page_size=params.get('page_size'))
+            else:
+                responses = PermitApplication.get_applications_by_query(formio_query)
+
+            seen = []
+            if incremental:
+                responses = ledger.filter_changed(responses, seen)
+
+            responses = iter(responses)
+            first_response = next(responses, None)
+        if first_response is None:
+            progress('fetched', submissions=0)
+            if incremental:
+                ledger.record(seen)
+            return None
+
+        if sftp_upload:
+            sep = '|'
+        counter = {'count': 0}
+        responses = self.count_items(
+            itertools.chain([first_response], responses),
+            counter,
+            on_done=lambda: progress('fetched', submissions=counter['count']))
+        with metrics.timer('export_stage_seconds', stage='transform'):
+            submissions_csv = ExportSubmissionsTransform(row_cache.get_cache()).transform(
+                responses, sep, compiled, writer)
+        metrics.inc('export_submissions', counter['count'])
+        progress('transformed', submissions=counter['count'])
+        #DBI_permits_YYYYMMDDHHMI.csv  where HH = 24 hour clock Mi  = minutes
+        current_time = datetime.datetime.now(timezone)
+        file_name = 'DBI_permits_' + str(current_time.year) + str(current_time.month) + str(current_time.day) + str(current_time.hour) + str(current_time.minute)
+        msg = subject_name
+        msg += " with export to PTS status, "
+        msg += str(counter['count']) + " Submissions"
+
+        def upload():
+            response = upload_files()
+            # recorded as soon as the files are delivered, not after deliver: an upload that
+            # outlives its timeout still delivers them, the next incremental export mustn't resend them
+            if incremental and response.status_code < 400:
+                ledger.record(seen)
+            return response
 
-            yesterday = datetime.datetime.now(timezone) - datetime.timedelta(days=1)
-            start_datetime_obj = datetime.datetime.combine(
-                yesterday, datetime.datetime.min.time())
+        def upload_files():
+            if not compression and not part_rows:
+                # encoded once, the upload streams these bytes
+                content = submissions_csv.encode('utf-8')
+                with metrics.timer('export_stage_seconds', stage='upload'):
+                    response = self.sftp(content, file_name + '.csv')
+                if response.status_code < 400:
+                    metrics.inc('export_upload_bytes', len(content))
+                    progress('uploaded', file_name=file_name + '.csv')
+                return response
+            files = export_files.get_files(submissions_csv, sep, file_name, compression, part_rows)
+            with metrics.timer('export_stage_seconds', stage='upload'):
+                for item in files:
+                    response = self.sftp(item['content'], item['file_name'], item['content_type'])
+                    if response.status_code >= 400:
+                        # the manifest isn't uploaded without all of its parts,
+                        # deliver reports the error response as a failed upload
+                        return response
+                    metrics.inc('export_upload_bytes', len(item['content']))
+            progress('uploaded', file_name=files[-1]['file_name'], files=[item['file_name'] for item in files])
+            return response
+        channels = {'upload': upload}
 
-            # subject name
-            subject_name = "PTS_Export"
-            if 'name' in req.params:
-                subject_name = req.params['name'] + ' ' + subject_name
+        if send_email:
+            subject = subject_name+" "+str(start_datetime_obj.date())
 
-            formio_query = {
-                'actionState': 'Export to PTS'
+            email_file_name = re.sub("[^0-9a-zA-Z-_]+", "-", subject_name)
+            email_file_name += "-"+str(start_datetime_obj.date())+".csv"
+
+            recipients = {
+                'from_email': sendgrid.helpers.mail.Email(os.environ.get('EXPORT_EMAIL_FROM')),
+                'to_emails': os.environ.get('EXPORT_EMAIL_TO'),
+                'cc_emails': os.environ.get('EXPORT_EMAIL_CC', None),
+                'bcc_emails': os.environ.get('EXPORT_EMAIL_BCC', None)
             }
 
-            with sentry_sdk.configure_scope() as scope:
-                scope.set_extra('formio_query', formio_query)
-
-            responses = PermitApplication.get_applications_by_query(formio_query)
-
-            send_email = bool(req.params['send_email']) if 'send_email' in req.params else False
-            sftp_upload = bool(req.params['sftp_upload']) if 'sftp_upload' in req.params else False
-            submissions_csv = None
-            sep = ','
-            if len(responses) > 0:
-                if sftp_upload:
-                    sep = '|'
-                submissions_csv = ExportSubmissionsTransform().transform(responses, sep)
-                #DBI_permits_YYYYMMDDHHMI.csv  where HH = 24 hour clock Mi  = minutes
-                current_time = datetime.datetime.now(timezone)
-                file_name = 'DBI_permits_' + str(current_time.year) + str(current_time.month) + str(current_time.day) + str(current_time.hour) + str(current_time.minute)
-                self.sftp(submissions_csv, file_name + '.csv')
-                #file2 = open(file_name + '.csv', "w")  # write mode
-                #file2.write(str(submissions_csv))
-                #file2.close()
-                msg = subject_name
-                msg += " with export to PTS status, "
-                msg += str(len(responses)) + " Submissions"
-                if send_email:
-                    subject = subject_name+" "+str(start_datetime_obj.date())
-
-                    file_name = re.sub("[^0-9a-zA-Z-_]+", "-", subject_name)
-                    file_name += "-"+str(start_datetime_obj.date())+".csv"
-
-                    recipients = {
-                        'from_email': sendgrid.helpers.mail.Email(os.environ.get('EXPORT_EMAIL_FROM')),
-                        'to_emails': os.environ.get('EXPORT_EMAIL_TO'),
-                        'cc_emails': os.environ.get('EXPORT_EMAIL_CC', None),
-                        'bcc_emails': os.environ.get('EXPORT_EMAIL_BCC', None)
-                    }
-                    self.email(
+            def email():
+                # the whole export in one attachment, compressed to stay below SendGrid's size limit
+                attachment_name, attachment = export_files.compress(
+                    email_file_name, submissions_csv.encode('utf-8'), compression)
+                with metrics.timer('export_stage_seconds', stage='email'):
+                    response = self.email(
                         recipients,
                         subject,
                         content=msg,
-                        file_name=file_name,
-                        file_content=submissions_csv.encode("utf-8"))
+                        file_name=attachment_name,
+                        file_content=attachment,
+                        file_type=export_files.CONTENT_TYPES[compression])
+                metrics.inc('export_email_bytes', len(attachment))
+                progress('emailed', file_name=attachment_name)
+                return response
+            channels['email'] = email
 
-                resp.body = json.dumps(jsend.success({'message': msg, 'responses':len(responses)}))
-                resp.status = falcon.HTTP_200
-                sentry_sdk.capture_message('PTS Dispatch Export', 'info')
+        # the upload and the email go to different services, they're sent at the same time
+        deliveries, _responses = delivery.deliver(channels, self.get_delivery_timeouts())
+        if any(outcome['status'] != delivery.STATUS_SUCCESS for outcome in deliveries.values()):
+            raise delivery.DeliveryError(deliveries)
 
-        #pylint: disable=broad-except
-        except Exception as exception:
-            logging.exception('Export.on_get Exception')
-            resp.status = falcon.HTTP_500
+        sentry_sdk.capture_message('PTS Dispatch Export', 'info')
+        result = {'message': msg, 'responses': counter['count'], 'deliveries': deliveries}
+        if incremental:
+            result['skipped'] = len([entry for entry in seen if not entry['changed']])
+        return result
 
-            msg_error = ERROR_EXPORT_GENERIC
-            if exception.__class__.__name__ == 'ValueError':
-                msg_error = "{0}".format(exception)
-
-            resp.body = json.dumps(jsend.error(msg_error))
-
-    #pylint: disable=no-self-use,too-many-locals
-    def sftp(self, data, file_name):
-        """ uploads data to sftp folder """
-        files = {'file': (file_name, data, 'text/plain', {'Expires': '0'})}
-        #reset exported file name
-
-        headers = {
-            'ACCESS_KEY': os.environ.get('SFDS_SFTP_ACCESS_KEY'),
-            'X-SFTP-HOST': os.environ.get('SFTP_HOSTNAME'),
-            'X-SFTP-HOST-KEY': os.environ.get('SFTP_HOST_KEY'),
-            'X-SFTP-USER': os.environ.get('SFTP_USERNAME'),
-            'X-SFTP-PASSWORD': os.environ.get('SFTP_PASSWORD'),
-            'X-SFDS-APIKEY': os.environ.get('X-SFDS-APIKEY'),
-            'Content-Type': 'text/plain'
-        }
+    @staticmethod
+    def no_progress(_stage, **_info):
+        """ progress callback that ignores progress """
 
-        params = {
-            'remotepath': '', # user home folder
-            'filename': file_name
+    @staticmethod
+    def is_valid_token(token):
+        """ check an export token against EXPORT_TOKEN and ACCESS_KEY """
+        return token is not None and token in (os.environ.get('EXPORT_TOKEN'), os.environ.get('ACCESS_KEY'))
+
+    @staticmethod
+    def get_delivery_timeouts():
+        """ seconds the upload and the email may take """
+        return {
+            'upload': float(os.environ.get('EXPORT_UPLOAD_TIMEOUT', DEFAULT_UPLOAD_TIMEOUT)),
+            'email': float(os.environ.get('EXPORT_EMAIL_TIMEOUT', DEFAULT_EMAIL_TIMEOUT))
         }
 
-        result = requests.post(
-            os.environ.get('SFTP_ENDPOINT'),
-            files=files,
-            headers=headers,
-            params=params)
-        #if result:
-            #set exported file name for process_result
-        return result
+    @staticmethod
+    def get_job_queue():
+        """ the queue background exports run on """
+        return job_queue.get_queue(Export().run_export)
+
+    @staticmethod
+    def count_items(items, counter, on_done=None):
+        """ yield items, counting them in counter['count'], on_done() is called once they run out """
+        for item in items:
+            counter['count'] += 1
+            yield item
+        if on_done:
+            on_done()
+
+    #pylint: disable=no-self-use
+    def sftp(self, data, file_name, content_type='text/plain'):
+        """ uploads data with the EXPORT_UPLOAD_BACKEND, the sftp proxy by default """
+        return delivery_backends.get_upload_backend().upload(data, file_name, content_type)
 
     #pylint: disable=too-many-arguments
-    def email(self, recipients, subject, content="Hi", file_name=None, file_content=None):
-        """ Email CSV """
+    def email(self, recipients, subject, content="Hi", file_name=None, file_content=None, file_type='text/csv'):
+        """ Email CSV, returns the SendGrid response """
         #pylint: disable=too-many-locals
 
         with sentry_sdk.configure_scope() as scope:
@@ -168,21 +316,20 @@ class Export():
             encoded = base64.b64encode(file_content).decode() #not all attachments can be encoded to utf
             attachment = sendgrid.helpers.mail.Attachment()
             attachment.file_content = sendgrid.helpers.mail.FileContent(encoded)
-            attachment.file_type = sendgrid.helpers.mail.FileType('text/csv')
+            attachment.file_type = sendgrid.helpers.mail.FileType(file_type)
             attachment.file_name = sendgrid.helpers.mail.FileName(file_name)
             attachment.disposition = sendgrid.helpers.mail.Disposition('attachment')
             attachment.content_id = sendgrid.helpers.mail.ContentId(file_name+' Content ID')
             mail.attachment = attachment
 
         response = self.send_email(mail.get())
-        print(response.status_code)
-        print(response.body)
-        print(response.headers)
+        logger.info('Email sent', extra={'subject': subject, 'status_code': response.status_code})
+        logger.debug('Email response', extra={'body': str(response.body), 'headers': str(response.headers)})
+        return response
 
     @staticmethod
     def send_email(data):
         """
-        Send email via sendgrid
+        Send email with the EXPORT_EMAIL_BACKEND, SendGrid by default
         """
-        sg_api = sendgrid.SendGridAPIClient(api_key=os.environ.get('SENDGRID_API_KEY'))
-        return sg_api.client.mail.send.post(request_body=data)
+        return delivery_backends.get_email_backend().send(data)
@@ -0,0 +1,38 @@
+"""Export job status module"""
+#pylint: disable=too-few-public-methods
+import json
+import logging
+import falcon
+import jsend
+from .export import Export, ERROR_EXPORT_GENERIC, ERROR_EXPORT_401
+from .hooks import error_response
+
+logger = logging.getLogger(__name__)
+
+ERROR_EXPORT_JOB_404 = "Job not found"
+
+class ExportJob():
+    """ExportJob class"""
+    def on_get(self, req, resp, job_id):
+        #pylint: disable=no-self-use
+        """
+        on get request
+        return the status, finished stages with their timings and result of an export job
+        """
+        try:
+            if not Export.is_valid_token(req.params['token']):
+                raise ValueError(ERROR_EXPORT_401)
+
+            job = Export.get_job_queue().get(job_id)
+            if job is None:
+                resp.status = falcon.HTTP_404
+                resp.body = json.dumps(jsend.fail({'job_id': ERROR_EXPORT_JOB_404}))
+                return
+
+            resp.body = json.dumps(jsend.success(job))
+            resp.status = falcon.HTTP_200
+
+        #pylint: disable=broad-except
+        except Exception as exception:
+            logger.exception('ExportJob.on_get Exception')
+            error_response(resp, exception, ERROR_EXPORT_GENERIC)
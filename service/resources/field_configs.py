@@ -1,4 +1,16 @@
 """ Custom field configurations from form.io """
+from collections import namedtuple
+
+# compiled per-field record, see FieldConfigs.get_field_index()
+FieldIndex = namedtuple('FieldIndex', [
+    'map_key', # key in map_field_configs, used by FieldMaps
+    'pretty_key', # key in pretty_field_configs
+    'relabel', # MIS header the field is renamed to
+    'is_pts', # included in the csv export
+    'missing_fields', # blank MIS fields added in place of this field
+    'position' # column index in the csv export, None if not exported
+])
+
 # pylint: disable=too-few-public-methods
 class FieldConfigs():
     """ Takes field configs from environment var as JSON. Could also pass in from POST, if do_post is implemented
@@ -18,14 +30,40 @@ class FieldConfigs():
     # new construction fields, map them to proposed
     new_proposed_fields = ["newProjectDescription", "newTypeOfConstruction", "newOccupancyClass", "newDwellingUnits", "newOccupancyStories", "newBasements"]
 
+    # proposed field to the new construction field it's mapped from
+    new_proposed_map = {
+        "projectDescription": "newProjectDescription",
+        "typeOfConstruction": "newTypeOfConstruction",
+        "occupancyClass": "newOccupancyClass",
+        "proposedDwellingUnits": "newDwellingUnits",
+        "proposedOccupancyStories": "newOccupancyStories",
+        "proposedBasementsAndCellars": "newBasements"
+    }
+
     # addresses that have nested structure
     address_fields = ["ownerAddress", "applicantAddress"]
 
     missing_fields = ["ownerName", "contractorName", "engineerName", "architectName", "agentName", "attorneyName"]
 
+    # MIS field prefix of the blank fields added for each missing field
+    missing_field_prefixes = {
+        "ownerName": "owner",
+        "contractorName": "contractor",
+        "engineerName": "engineer",
+        "architectName": "architect",
+        "agentName": "contractor",
+        "attorneyName": "attorney"
+    }
+
     # fields that need to be convert to Yes/No instead of True/False
     convert_bool_fields = ["onlyFireDepartmentReview"]
 
+    # Fire Rating fields to the construction type field they are mapped from
+    fire_rating_fields = {
+        "existingFireRating": "existingBuildingConstructionType",
+        "proposedFireRating": "typeOfConstruction"
+    }
+
     # fields that need to be relabel
     relabel_fields = {
         "occupancyClass": "proposedOccupancyClass",
@@ -71,19 +109,76 @@ class FieldConfigs():
                       "attorneyOrganizationName", "attorneyFirstName", "attorneyLastName", "attorneyEmail", "attorneyPhoneNumber", "attorneyAddress1",
                       "attorneyAddress2", "attorneyCity", "attorneyState", "attorneyZipCode", "notes"]
 
+    # built on first use from the class attributes above
+    _field_index = None
+    _ordered_columns = None
+
+    @staticmethod
+    def get_field_index():
+        """ compile the field configs into a single lookup dict of field name to FieldIndex """
+        if FieldConfigs._field_index is None:
+            map_keys = FieldConfigs.invert_configs(FieldConfigs.map_field_configs)
+            pretty_keys = FieldConfigs.invert_configs(FieldConfigs.pretty_field_configs)
+            positions = {key: index for index, key in enumerate(FieldConfigs.get_ordered_columns())}
+            pts_fields = set(FieldConfigs.pts_fields)
+
+            names = set(map_keys) | set(pretty_keys) | set(positions) | pts_fields
+            names |= set(FieldConfigs.relabel_fields) | set(FieldConfigs.missing_fields)
+
+            FieldConfigs._field_index = {
+                name: FieldIndex(
+                    map_key=map_keys.get(name),
+                    pretty_key=pretty_keys.get(name),
+                    relabel=FieldConfigs.relabel_fields.get(name),
+                    is_pts=name in pts_fields,
+                    missing_fields=FieldConfigs.get_missing_field_names(name),
+                    position=positions.get(name)
+                ) for name in names
+            }
+        return FieldConfigs._field_index
+
+    @staticmethod
+    def get_field(field):
+        """ get the compiled FieldIndex record of a field, None if the field is not configured """
+        return FieldConfigs.get_field_index().get(field)
+
+    @staticmethod
+    def get_ordered_columns():
+        """ ordered_fields without duplicates, the csv export columns """
+        if FieldConfigs._ordered_columns is None:
+            FieldConfigs._ordered_columns = tuple(dict.fromkeys(FieldConfigs.ordered_fields))
+        return FieldConfigs._ordered_columns
+
+    @staticmethod
+    def invert_configs(field_configs):
+        """ invert {key: {field, ...}} configs into {field: key} """
+        ret = {}
+        for field_key, field_value in field_configs.items():
+            for field in field_value:
+                ret.setdefault(field, field_key)
+        return ret
+
+    @staticmethod
+    def get_missing_field_names(field):
+        """ blank MIS fields that replace a missing field """
+        address_prefix = FieldConfigs.missing_field_prefixes.get(field) if field in FieldConfigs.missing_fields else None
+        if not address_prefix:
+            return ()
+
+        suffixes = ['FirstName', 'LastName']
+        if address_prefix != 'owner':
+            suffixes += ['PhoneNumber', 'Address1', 'Address2', 'City', 'State', 'ZipCode']
+        return tuple(address_prefix + suffix for suffix in suffixes)
+
     @staticmethod
     def get_field_key(value, field_type):
         """ get the key from field_config based on value """
+        field = FieldConfigs.get_field(value)
+        if field is None:
+            return None
         if field_type == 'map':
-            field_configs = FieldConfigs.map_field_configs
-        else:
-            field_configs = FieldConfigs.pretty_field_configs
-
-        # loop through the Field Config variables to find the key, so value ="buildingPermitApplicationNumber" returns "appnum_fields"
-        for field_key, field_value in field_configs.items():
-            if value in field_value:
-                return field_key
-        return None
+            return field.map_key
+        return field.pretty_key
 
     @staticmethod
     def is_nested_address_field(field):
@@ -93,24 +188,24 @@ class FieldConfigs():
     @staticmethod
     def is_missing_field(field):
         """ check which MIS fields are missing """
-        return field and field in FieldConfigs.missing_fields
+        record = FieldConfigs.get_field(field)
+        return field and record is not None and bool(record.missing_fields)
 
     @staticmethod
     def is_pts_fields(field):
         """ check pts specific fields to be included in the csv export, according to
             https://docs.google.com/spreadsheets/d/1CkGnw8aYxzPwp_CzEGwsmDhqJOATIB3EGp2gsVJtmjc/edit#gid=937406231
         """
-        return field and field in FieldConfigs.pts_fields
+        record = FieldConfigs.get_field(field)
+        return field and record is not None and record.is_pts
 
     @staticmethod
     def is_building_use(field):
         """ check if field is one of building_use field """
-        return field and field in FieldConfigs.map_field_configs['building_use']
+        return field and FieldConfigs.get_field_key(field, 'map') == 'building_use'
 
     @staticmethod
     def get_relabel_fields(field):
         """ relabel field to MIS specified header """
-        for field_key, field_value in FieldConfigs.relabel_fields.items():
-            if field == field_key:
-                return field_value
-        return None
+        record = FieldConfigs.get_field(field)
+        return record.relabel if record is not None else None
@@ -2,6 +2,11 @@
 
 import os
 import json
+import time
+import hashlib
+import threading
+import functools
+from types import MappingProxyType
 
 # pylint: disable=too-few-public-methods
 class FieldMaps():
@@ -9,30 +14,116 @@ class FieldMaps():
 
     cur_path = os.path.dirname(__file__)
 
+    # preloaded lookup tables, see FieldMaps.load()
+    _registry = None
+    _signature = None
+    _mtimes = {}
+    _last_checked = 0
+    _lock = threading.Lock()
+
     @staticmethod
     def map_key_value(key, key_value):
         """ converts field values defined in field_configs.py: map_field_configs
             to MIS accepted values using mapping data in data/*.json
         """
         ret = key_value
-        with open(FieldMaps.cur_path + '/data/' + FieldMaps.get_map_file(key), 'r') as file:
-            map_object = json.loads(file.read())
+        map_object = FieldMaps.get_map(key)
         # mutli-select values that need to be mapped
         if key_value and ',' in key_value:
-            list_values = key_value.strip('"').split(',')
-            r_values = []
-            for value in list_values:
-                if value.strip() in map_object:
-                    r_values.append(map_object[value.strip()])
-            ret = ','.join(r_values)
+            ret = FieldMaps.map_multi_select(key, key_value)
         elif key_value and key_value in map_object:
             ret = map_object[key_value]
         return ret
 
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def map_multi_select(key, key_value):
+        """ map a comma separated multi-select value, the split/strip/lookup
+            result is cached since the same selections repeat across submissions
+        """
+        map_object = FieldMaps.get_map(key)
+        r_values = []
+        for value in key_value.strip('"').split(','):
+            value = value.strip()
+            if value in map_object:
+                r_values.append(map_object[value])
+        return ','.join(r_values)
+
+    @staticmethod
+    def get_map(key):
+        """ get the preloaded lookup table for a map key, loading the registry on first use """
+        registry = FieldMaps._registry
+        if registry is None or FieldMaps.is_stale():
+            registry = FieldMaps.load()
+        return registry[key]
+
+    @staticmethod
+    def get_signature():
+        """ hash of the loaded mapping data, changes when a data file is reloaded """
+        if FieldMaps._registry is None or FieldMaps.is_stale():
+            FieldMaps.load()
+        return FieldMaps._signature
+
+    @staticmethod
+    def load():
+        """ read every data/*.json mapping file into an immutable lookup registry """
+        with FieldMaps._lock:
+            registry = {}
+            mtimes = {}
+            signature = hashlib.sha256()
+            for key in FieldMaps.get_map_keys():
+                file_path = FieldMaps.get_map_path(key)
+                with open(file_path, 'r') as file:
+                    content = file.read()
+                registry[key] = MappingProxyType(json.loads(content))
+                mtimes[file_path] = os.path.getmtime(file_path)
+                signature.update(content.encode('utf-8'))
+
+            FieldMaps._registry = MappingProxyType(registry)
+            FieldMaps._signature = signature.hexdigest()
+            FieldMaps._mtimes = mtimes
+            FieldMaps._last_checked = time.time()
+            FieldMaps.map_multi_select.cache_clear()
+        return FieldMaps._registry
+
+    @staticmethod
+    def is_stale():
+        """ check if a data file changed on disk, only when FIELD_MAPS_HOT_RELOAD is set.
+            Files are checked at most once every FIELD_MAPS_RELOAD_INTERVAL seconds
+        """
+        if not os.environ.get('FIELD_MAPS_HOT_RELOAD'):
+            return False
+
+        now = time.time()
+        interval = float(os.environ.get('FIELD_MAPS_RELOAD_INTERVAL', 5))
+        if now - FieldMaps._last_checked < interval:
+            return False
+        FieldMaps._last_checked = now
+
+        for file_path, mtime in FieldMaps._mtimes.items():
+            if os.path.getmtime(file_path) != mtime:
+                return True
+        return False
+
+    @staticmethod
+    def get_map_path(key):
+        """ get the full path of the mapping data file """
+        return FieldMaps.cur_path + '/data/' + FieldMaps.get_map_file(key)
+
+    @staticmethod
+    def get_map_keys():
+        """ all map keys that have a mapping data file """
+        return FieldMaps.get_map_switcher().keys()
+
     @staticmethod
     def get_map_file(argument):
         """ python switch statement to get map file name """
-        switcher = {
+        return FieldMaps.get_map_switcher().get(argument, "")
+
+    @staticmethod
+    def get_map_switcher():
+        """ map key to mapping data file name """
+        return {
             'state_fields': 'states.json',
             'building_use':'building_use.json',
             'fire_rating':'fire_rating.json',
@@ -40,4 +131,3 @@ class FieldMaps():
             'occupancy_code':'occupancy_code.json',
             'street_suffix_fields':'street_suffix.json'
         }
-        return switcher.get(argument, "")
@@ -1,9 +1,21 @@
 """ hooks """
 import os
+import json
 import falcon
+import jsend
 
 def validate_access(req, _resp, _resource, _params):
     """ validate access method """
     access_key = os.environ.get('ACCESS_KEY')
     if not access_key or req.get_header('ACCESS_KEY') != access_key:
         raise falcon.HTTPForbidden(description='Access Denied')
+
+def error_response(resp, exception, generic_error):
+    """ answer 500 with the message of a ValueError, generic_error for any other exception """
+    resp.status = falcon.HTTP_500
+
+    msg_error = generic_error
+    if exception.__class__.__name__ == 'ValueError':
+        msg_error = "{0}".format(exception)
+
+    resp.body = json.dumps(jsend.error(msg_error))
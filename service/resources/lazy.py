@@ -0,0 +1,33 @@
+"""Lazy loading of route resources"""
+import importlib
+import threading
+
+class LazyResource():
+    """ Stand-in for a route's resource, its module is imported and the resource created
+        on the route's first request, so heavy dependencies don't slow down start up.
+        methods: the HTTP methods the resource responds to, known before it's imported
+    """
+
+    def __init__(self, module_name, class_name, methods=('GET',)):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.methods = tuple(method.upper() for method in methods)
+        self.resource = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """ the resource, imported and created on first use """
+        with self.lock:
+            if self.resource is None:
+                module = importlib.import_module(self.module_name)
+                self.resource = getattr(module, self.class_name)()
+            return self.resource
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't set, Falcon looks up on_<method> responders
+        methods = self.__dict__.get('methods', ())
+        if name.startswith('on_') and name[3:].upper() in methods:
+            def responder(req, resp, **params):
+                return getattr(self.load(), name)(req, resp, **params)
+            return responder
+        raise AttributeError(name)
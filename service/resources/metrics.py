@@ -0,0 +1,38 @@
+"""Metrics module"""
+#pylint: disable=too-few-public-methods
+import falcon
+from .hooks import validate_access
+from ..modules import metrics
+from ..modules import http_client
+from ..modules import row_cache
+
+@falcon.before(validate_access)
+class Metrics():
+    """Metrics class"""
+    def on_get(self, _req, resp):
+        """on get request
+        return the metrics of this process in the Prometheus text format
+        """
+        resp.body = metrics.get_registry().render(self.collect())
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.status = falcon.HTTP_200
+
+    @staticmethod
+    def collect():
+        """ http client and row cache stats, kept by those modules, as extra metrics """
+        extra = {}
+        for endpoint, stats in http_client.get_client().get_stats().items():
+            labels = (('endpoint', endpoint),)
+            extra[('http_requests', labels)] = stats['requests']
+            extra[('http_errors', labels)] = stats['errors']
+            extra[('http_retries', labels)] = stats['retries']
+            extra[('http_request_seconds', labels)] = {'count': stats['requests'], 'sum': stats['seconds']}
+            extra[('http_request_max_seconds', labels)] = stats['max_seconds']
+
+        # a scrape doesn't create the cache, or open its sqlite store
+        cache = row_cache.peek_cache()
+        if cache is not None:
+            stats = cache.get_stats()
+            extra[('row_cache_hits', ())] = stats['hits']
+            extra[('row_cache_misses', ())] = stats['misses']
+        return extra
@@ -0,0 +1,44 @@
+"""Request profiles module"""
+#pylint: disable=too-few-public-methods
+import json
+import pstats
+import falcon
+import jsend
+from .hooks import validate_access
+from ..modules import profiler
+
+ERROR_PROFILE_404 = "Profile not found"
+ERROR_PROFILE_SORT = "Invalid sort key"
+
+@falcon.before(validate_access)
+class Profile():
+    """Profile class"""
+    def on_get(self, req, resp, profile_id):
+        #pylint: disable=no-self-use
+        """on get request
+        return a request profile saved by the profiler middleware, as pstats text
+        or as the pstats file with format=pstats
+        """
+        path = profiler.load_profile(profile_id)
+        if path is None:
+            resp.status = falcon.HTTP_404
+            resp.body = json.dumps(jsend.fail({'profile_id': ERROR_PROFILE_404}))
+            return
+
+        if req.get_param('format') == 'pstats':
+            with open(path, 'rb') as file_obj:
+                resp.data = file_obj.read()
+            resp.content_type = 'application/octet-stream'
+            resp.downloadable_as = profile_id + '.pstats'
+            resp.status = falcon.HTTP_200
+            return
+
+        sort = req.get_param('sort', default='cumulative')
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            resp.status = falcon.HTTP_400
+            resp.body = json.dumps(jsend.fail({'sort': ERROR_PROFILE_SORT}))
+            return
+        limit = req.get_param_as_int('limit', min_value=1) or profiler.DEFAULT_PROFILE_LIMIT
+        resp.body = profiler.format_profile(path, sort, limit)
+        resp.content_type = 'text/plain'
+        resp.status = falcon.HTTP_200
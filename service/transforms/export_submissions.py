@@ -1,23 +1,320 @@
 """ Export Submissions Transform module """
 #pylint: disable=too-few-public-methods
-import pandas as pd
+import io
+import os
+import csv
+import itertools
+import collections
+import multiprocessing
+import concurrent.futures
 from .transform import TransformBase
 from ..resources.field_configs import FieldConfigs
 from ..resources.field_maps import FieldMaps
+from ..modules import row_cache
+
+# csv dialects of the streaming writer, email attachments use ',' and the PTS sftp upload uses '|'
+csv.register_dialect('pts_email', delimiter=',', lineterminator='\r\n', quoting=csv.QUOTE_MINIMAL)
+csv.register_dialect('pts_sftp', delimiter='|', lineterminator='\r\n', quoting=csv.QUOTE_MINIMAL)
+CSV_DIALECTS = {',': 'pts_email', '|': 'pts_sftp'}
+
+WRITER_PANDAS = 'pandas'
+WRITER_STREAM = 'stream'
+WRITERS = (WRITER_PANDAS, WRITER_STREAM)
+
+ERROR_WRITER = "Invalid writer, use pandas or stream"
+
+# bump when a change to the converters changes the rows of cached submissions
+ROW_CACHE_VERSION = 1
+
+# submissions below which the parallel transform stays serial, none by default,
+# and submissions sent to a worker at a time
+DEFAULT_PARALLEL_THRESHOLD = 0
+DEFAULT_PARALLEL_CHUNK = 250
 
 class ExportSubmissionsTransform(TransformBase):
     """ Transform for Export Submissions """
-    def transform(self, data, sep):
+
+    # ordered column converters, see compile_plan()
+    _plan = None
+    # pretty csv header, see get_csv_header()
+    _csv_header = None
+
+    def __init__(self, cache=None, workers=None):
+        # RowCache of transformed rows, used by the compiled plan
+        self.cache = cache
+        # worker processes of the parallel transform, serial below 2
+        self.workers = int(workers if workers is not None else os.environ.get('PARALLEL_TRANSFORM_WORKERS', 0))
+
+    def transform(self, data, sep, compiled=False, writer=WRITER_PANDAS):
         """
         transform submissions from export
+        compiled: apply the compiled column plan instead of the per key pipeline
+        writer: 'pandas' builds a DataFrame, 'stream' writes rows with the csv module
+        as they are transformed, and always uses the compiled plan. Both return the whole
+        csv as one string, 'stream' only avoids the DataFrame, iter_csv yields the lines
+        ValueError for any other writer
         """
-        output = list(map(self.get_data, data))
-        output = list(map(self.pretty_format, output))
+        if writer not in WRITERS:
+            raise ValueError(ERROR_WRITER)
+        if writer == WRITER_STREAM:
+            return ''.join(self.iter_csv(data, sep))
+
+        if compiled:
+            # pandas is only needed by the pandas writer
+            import pandas as pd # pylint: disable=import-outside-toplevel
+            output = self.apply_plan(data)
+            output = pd.DataFrame(output, columns=FieldConfigs.get_ordered_columns())
+            output.rename(columns=self.pretty_string, inplace=True)
+            return self.to_csv(output, sep)
+
+        output = list(self.map_ordered(transform_record, data))
         output = [i for i in output if i is not None]
         output = self.normalize(output)
         output = self.to_csv(output, sep)
         return output
 
+    def apply_plan(self, data):
+        """
+        transform submissions into ordered csv rows with the compiled plan
+        """
+        return list(self.iter_rows(data))
+
+    def iter_rows(self, data):
+        """
+        lazily transform submissions into ordered csv rows with the compiled plan
+        """
+        submissions = (submission for submission in data if self.is_exported(submission))
+        cache = self.cache
+        if cache is None:
+            for row in self.map_ordered(transform_row, submissions):
+                yield row
+            return
+
+        # the keys are taken before get_data, which changes the submission
+        salt = self.get_cache_salt()
+        # (key, cached row) of the submissions looked up and not yielded yet, None for a miss
+        pending = collections.deque()
+
+        def misses():
+            for submission in submissions:
+                key = row_cache.get_key(submission, salt)
+                row = cache.get(key)
+                pending.append((key, row))
+                if row is None:
+                    yield submission
+
+        # every miss goes through one map_ordered, so a parallel transform uses a single pool
+        for transformed in self.map_ordered(transform_row, misses()):
+            # the hits looked up before this miss come first
+            key, row = pending.popleft()
+            while row is not None:
+                yield row
+                key, row = pending.popleft()
+            cache.set(key, transformed)
+            yield transformed
+        # the hits after the last miss
+        for _key, row in pending:
+            yield row
+        cache.flush()
+
+    @staticmethod
+    def is_exported(submission):
+        """ skip permit type = existingPermitApplication submissions """
+        permit_type = submission['data']['permitType']
+        return bool(permit_type) and permit_type != 'existingPermitApplication'
+
+    def map_ordered(self, func, submissions):
+        """
+        yield func(submission) for each submission, in order.
+        With 2 or more workers and at least PARALLEL_TRANSFORM_THRESHOLD submissions
+        they are transformed in a process pool, PARALLEL_TRANSFORM_CHUNK at a time per worker.
+        The workers are spawned, not forked, the service's threads may hold locks at fork time.
+        func must be a module level function so it can be sent to the worker processes
+        """
+        submissions = iter(submissions)
+        if self.workers < 2:
+            for submission in submissions:
+                yield func(submission)
+            return
+
+        threshold = self.get_parallel_threshold()
+        head = list(itertools.islice(submissions, threshold))
+        if len(head) < threshold:
+            for submission in head:
+                yield func(submission)
+            return
+
+        chunk_size = int(os.environ.get('PARALLEL_TRANSFORM_CHUNK', DEFAULT_PARALLEL_CHUNK))
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            for result in executor.map(func, itertools.chain(head, submissions), chunksize=chunk_size):
+                yield result
+
+    @staticmethod
+    def get_parallel_threshold():
+        """ submissions below which the parallel transform stays serial """
+        return int(os.environ.get('PARALLEL_TRANSFORM_THRESHOLD', DEFAULT_PARALLEL_THRESHOLD))
+
+    def apply_row(self, submission, plan):
+        """
+        transform one submission into its ordered csv row
+        """
+        record = self.get_data(submission)
+        new_construction = bool(record['newTypeOfConstruction'])
+        return [convert(record, new_construction) for convert in plan]
+
+    @staticmethod
+    def get_cache_salt():
+        """ part of the row cache keys, so cached rows aren't used once columns or mapping data change """
+        return '{0}:{1}:{2}'.format(
+            ROW_CACHE_VERSION,
+            FieldMaps.get_signature(),
+            ','.join(FieldConfigs.get_ordered_columns()))
+
+    def iter_csv(self, data, sep=','):
+        """
+        generate csv lines, the header first and then one line per submission
+        as it is transformed
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, dialect=CSV_DIALECTS[sep])
+
+        writer.writerow(self.get_csv_header())
+        yield self.flush_buffer(buffer)
+        for row in self.iter_rows(data):
+            writer.writerow(row)
+            yield self.flush_buffer(buffer)
+
+    @staticmethod
+    def flush_buffer(buffer):
+        """ return and clear the content of a StringIO buffer """
+        ret = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return ret
+
+    @staticmethod
+    def get_csv_header():
+        """ csv column names, pretty_string applied to the ordered columns """
+        if ExportSubmissionsTransform._csv_header is None:
+            ExportSubmissionsTransform._csv_header = tuple(
+                TransformBase.pretty_string(column) for column in FieldConfigs.get_ordered_columns())
+        return ExportSubmissionsTransform._csv_header
+
+    @staticmethod
+    def compile_plan():
+        """
+        walk the field configs once and build one converter per csv column.
+        Each converter takes the flattened submission from get_data and produces
+        the same value set_pts_fields, pretty_format and reorder_fields would
+        """
+        if ExportSubmissionsTransform._plan is None:
+            relabel_sources = {label: key for key, label in FieldConfigs.relabel_fields.items()}
+            plan = []
+            for column in FieldConfigs.get_ordered_columns():
+                source = relabel_sources.get(column, column)
+                if column in FieldConfigs.fire_rating_fields:
+                    convert = ExportSubmissionsTransform.compile_fire_rating(FieldConfigs.fire_rating_fields[column])
+                elif column == 'sitePermit':
+                    convert = ExportSubmissionsTransform.compile_site_permit()
+                elif column == 'projectDescription':
+                    convert = ExportSubmissionsTransform.compile_project_description()
+                elif FieldConfigs.is_pts_fields(source) and not FieldConfigs.is_missing_field(source):
+                    convert = ExportSubmissionsTransform.compile_field(source)
+                else:
+                    convert = ExportSubmissionsTransform.compile_blank()
+                plan.append(convert)
+            ExportSubmissionsTransform._plan = tuple(plan)
+        return ExportSubmissionsTransform._plan
+
+    @staticmethod
+    def compile_getter(key):
+        """ value getter for a pts field, honoring the new construction mapping """
+        new_key = FieldConfigs.new_proposed_map.get(key)
+
+        def get_value(record, new_construction):
+            if new_construction and new_key:
+                return True, record[new_key]
+            if key in record:
+                return True, record[key]
+            return False, None
+        return get_value
+
+    @staticmethod
+    def compile_formatter(key):
+        """ value formatter for a field, same branches as pretty_format """
+        field = FieldConfigs.get_field(key)
+        map_key = field.map_key if field else None
+        pretty_key = field.pretty_key if field else None
+
+        def format_value(value):
+            time = TransformBase.parse_datetime(value)
+            if time is not None:
+                return TransformBase.format_time(time)
+            if map_key is not None:
+                return FieldMaps.map_key_value(map_key, value)
+            if pretty_key is not None:
+                return TransformBase.pretty_phonenumber(value) if pretty_key == 'phone_fields' else ''
+            if isinstance(value, (str, bytes)):
+                return value.replace('\n', '\t').replace('|', '')
+            return ''
+        return format_value
+
+    @staticmethod
+    def compile_field(key):
+        """ converter for a pts field """
+        get_value = ExportSubmissionsTransform.compile_getter(key)
+        format_value = ExportSubmissionsTransform.compile_formatter(key)
+        convert_bool = key in FieldConfigs.convert_bool_fields
+
+        def convert(record, new_construction):
+            found, value = get_value(record, new_construction)
+            if not found:
+                return ''
+            if convert_bool:
+                value = TransformBase.convert_bool(value)
+            return format_value(value)
+        return convert
+
+    @staticmethod
+    def compile_fire_rating(key):
+        """ converter for a Fire Rating column mapped from a construction type field """
+        get_value = ExportSubmissionsTransform.compile_getter(key)
+
+        def convert(record, new_construction):
+            found, value = get_value(record, new_construction)
+            if not found or value == '' or TransformBase.datetime_valid(value):
+                return ''
+            return FieldMaps.map_key_value('fire_rating', value)
+        return convert
+
+    @staticmethod
+    def compile_site_permit():
+        """ converter for the site permit column """
+        format_value = ExportSubmissionsTransform.compile_formatter('sitePermit')
+
+        def convert(record, _new_construction):
+            value = record['sitePermitForm38'] if record['sitePermitForm38'] else record['sitePermitForm12']
+            return format_value(value)
+        return convert
+
+    @staticmethod
+    def compile_project_description():
+        """ converter for the project description column, with the Rev # prepended """
+        get_value = ExportSubmissionsTransform.compile_getter('projectDescription')
+        format_value = ExportSubmissionsTransform.compile_formatter('projectDescription')
+
+        def convert(record, new_construction):
+            _found, value = get_value(record, new_construction)
+            bpa = TransformBase.pretty_app_num(record['buildingPermitApplicationNumber'])
+            return format_value('Revision to ' + bpa + value)
+        return convert
+
+    @staticmethod
+    def compile_blank():
+        """ converter for columns the submission never fills """
+        return lambda _record, _new_construction: ''
+
     # pylint: disable=R0201
     def get_data(self, submission):
         """
@@ -71,6 +368,8 @@ class ExportSubmissionsTransform(TransformBase):
         """
         Normalize data into a flat structure into DataFrame
         """
+        # pandas is only needed by the pandas writer
+        import pandas as pd # pylint: disable=import-outside-toplevel
         dataframe = pd.json_normalize(data)
         # update column names
         dataframe.rename(columns=self.pretty_string, inplace=True)
@@ -90,11 +389,13 @@ class ExportSubmissionsTransform(TransformBase):
         if data:
             data = self.set_pts_fields(data)
             for key in data:
-                if self.datetime_valid(data[key]):
-                    output[key] = self.pretty_time(data[key])
+                field = FieldConfigs.get_field(key)
+                time = self.parse_datetime(data[key])
+                if time is not None:
+                    output[key] = self.format_time(time)
                 else:
-                    field_key = FieldConfigs.get_field_key(key, 'map')
-                    phone_appnum_key = FieldConfigs.get_field_key(key, 'pretty')
+                    field_key = field.map_key if field else None
+                    phone_appnum_key = field.pretty_key if field else None
                     if field_key is not None:
                         output[key] = FieldMaps.map_key_value(field_key, data[key])
                         # manually add Fire Rating and proposed Fire Rating
@@ -108,8 +409,17 @@ class ExportSubmissionsTransform(TransformBase):
                     elif isinstance(data[key], (str, bytes)):
                         output[key] = data[key].replace('\n', '\t').replace('|', '')
                 # relabel field, if necessary
-                relabel_field = FieldConfigs.get_relabel_fields(key)
+                relabel_field = field.relabel if field else None
                 if relabel_field:
                     output[relabel_field] = output.pop(key)
             output = self.reorder_fields(output)
         return output
+
+def transform_record(submission):
+    """ per key pipeline for one submission, module level so process pool workers can run it """
+    transform = ExportSubmissionsTransform(workers=0)
+    return transform.pretty_format(transform.get_data(submission))
+
+def transform_row(submission):
+    """ compiled plan for one submission, module level so process pool workers can run it """
+    return ExportSubmissionsTransform(workers=0).apply_row(submission, ExportSubmissionsTransform.compile_plan())
@@ -1,11 +1,18 @@
 """ TransformBase module """
 #pylint: disable=too-few-public-methods,no-self-use
 import re
+import datetime
+import functools
 import dateutil.parser
 import pytz
 from ..resources.field_configs import FieldConfigs
 from ..resources.field_maps import FieldMaps
 
+# Form.io timestamp, e.g. 2020-08-17T16:56:09.191Z
+FORMIO_DATETIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})\.(\d{3})Z')
+# every string datetime_valid accepts starts with this
+ISO_DATETIME_PREFIX = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}')
+
 class TransformBase():
     """ Base module for Transforms """
 
@@ -33,10 +40,23 @@ class TransformBase():
         """
         return a better human readable time string
         """
-        time = dateutil.parser.parse(value)
-        timezone = pytz.timezone(zone)
-        localtime = time.astimezone(timezone).strftime('%Y-%m-%d %I:%M:%S %p')
-        return localtime
+        time = TransformBase.parse_datetime(value)
+        if time is None:
+            time = dateutil.parser.parse(value)
+        return TransformBase.format_time(time, zone)
+
+    @staticmethod
+    def format_time(time, zone='America/Los_Angeles'):
+        """
+        return a better human readable time string from a parsed datetime
+        """
+        return time.astimezone(TransformBase.get_timezone(zone)).strftime('%Y-%m-%d %I:%M:%S %p')
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_timezone(zone):
+        """ cached pytz timezone """
+        return pytz.timezone(zone)
 
     @staticmethod
     def pretty_phonenumber(value):
@@ -46,22 +66,41 @@ class TransformBase():
     @staticmethod
     def datetime_valid(dt_str):
         """ Check if string is valid datetime """
+        return TransformBase.parse_datetime(dt_str) is not None
+
+    @staticmethod
+    def parse_datetime(dt_str):
+        """
+        return the datetime of a valid ISO 8601 string with milliseconds, None otherwise.
+        Form.io timestamps are parsed directly, dateutil is only used for other offsets
+        """
+        if not isinstance(dt_str, str) or not ISO_DATETIME_PREFIX.match(dt_str):
+            return None
+
+        match = FORMIO_DATETIME.fullmatch(dt_str)
+        if match:
+            year, month, day, hour, minute, second, millisecond = map(int, match.groups())
+            try:
+                return datetime.datetime(year, month, day, hour, minute, second, millisecond * 1000, tzinfo=pytz.utc)
+            except ValueError:
+                return None
+
         try:
             time = dateutil.parser.parse(dt_str)
             time_str = time.isoformat("T", "milliseconds").replace("+00:00", "Z")
-            return time_str == dt_str
+            if time_str == dt_str:
+                return time
         #pylint: disable=bare-except
         except:
             pass
-        return False
+        return None
 
     @staticmethod
     def add_fire_rating(key, value, output):
         """ set mapping key for Fire Rating and proposed Fire Rating """
-        if key == 'existingBuildingConstructionType':
-            output['existingFireRating'] = FieldMaps.map_key_value('fire_rating', value)
-        elif key == 'typeOfConstruction':
-            output['proposedFireRating'] = FieldMaps.map_key_value('fire_rating', value)
+        for fire_rating_key, construction_key in FieldConfigs.fire_rating_fields.items():
+            if key == construction_key:
+                output[fire_rating_key] = FieldMaps.map_key_value('fire_rating', value)
 
         return output
 
@@ -109,9 +148,10 @@ class TransformBase():
             copy_data = []
             copy_data.extend(data)
             for key in copy_data:
-                if not FieldConfigs.is_pts_fields(key):
+                field = FieldConfigs.get_field(key)
+                if field is None or not field.is_pts:
                     data.pop(key, None)
-                if FieldConfigs.is_missing_field(key):
+                elif field.missing_fields:
                     data.pop(key, None)
                     data = TransformBase.add_missing_fields(key, data)
 
@@ -132,42 +172,18 @@ class TransformBase():
     @staticmethod
     def map_new_proposed(data):
         """ maps new to proposed """
-        data['projectDescription'] = data['newProjectDescription']
-        data['typeOfConstruction'] = data['newTypeOfConstruction']
-        data['occupancyClass'] = data['newOccupancyClass']
-        data['proposedDwellingUnits'] = data['newDwellingUnits']
-        data['proposedOccupancyStories'] = data['newOccupancyStories']
-        data['proposedBasementsAndCellars'] = data['newBasements']
+        for proposed_key, new_key in FieldConfigs.new_proposed_map.items():
+            data[proposed_key] = data[new_key]
 
         return data
 
     @staticmethod
     def add_missing_fields(key, output):
         """ add missing MIS fields """
-        address_prefix = ''
-        if key == 'ownerName':
-            address_prefix = 'owner'
-        elif key == 'contractorName':
-            address_prefix = 'contractor'
-        elif key == 'engineerName':
-            address_prefix = 'engineer'
-        elif key == 'architectName':
-            address_prefix = 'architect'
-        elif key == 'agentName':
-            address_prefix = 'contractor'
-        elif key == 'attorneyName':
-            address_prefix = 'attorney'
-
-        if address_prefix != '':
-            output[address_prefix + 'FirstName'] = ''
-            output[address_prefix + 'LastName'] = ''
-            if address_prefix != 'owner':
-                output[address_prefix + 'PhoneNumber'] = ''
-                output[address_prefix + 'Address1'] = ''
-                output[address_prefix + 'Address2'] = ''
-                output[address_prefix + 'City'] = ''
-                output[address_prefix + 'State'] = ''
-                output[address_prefix + 'ZipCode'] = ''
+        record = FieldConfigs.get_field(key)
+        if record is not None:
+            for field in record.missing_fields:
+                output[field] = ''
 
         return output
 
@@ -175,11 +191,8 @@ class TransformBase():
     def reorder_fields(data):
         """ reorder fields into MIS expected order """
         ret = {}
-        for key in FieldConfigs.ordered_fields:
-            if key in data:
-                ret[key] = data[key]
-            else:
-                ret[key] = ''
+        for key in FieldConfigs.get_ordered_columns():
+            ret[key] = data.get(key, '')
         return ret
 
     @staticmethod
@@ -187,10 +200,14 @@ class TransformBase():
         """ reorder fields into MIS expected order """
         for key in FieldConfigs.convert_bool_fields:
             if key in data:
-                if data[key].lower() == 'yes':
-                    data[key] = 'Y'
-                elif data[key].lower() == 'no':
-                    data[key] = 'N'
-                else:
-                    data[key] = ''
+                data[key] = TransformBase.convert_bool(data[key])
         return data
+
+    @staticmethod
+    def convert_bool(value):
+        """ convert yes/no value to Y/N """
+        if value.lower() == 'yes':
+            return 'Y'
+        if value.lower() == 'no':
+            return 'N'
+        return ''
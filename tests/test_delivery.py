@@ -0,0 +1,82 @@
+"""Tests for concurrent export delivery """
+import time
+from unittest.mock import Mock
+import pytest
+from service.modules import delivery
+from service.modules import log
+
+def slow(seconds, response=None):
+    """ a channel taking `seconds` """
+    def send():
+        time.sleep(seconds)
+        return response
+    return send
+
+def test_deliver_concurrently():
+    """ Test channels run at the same time and their responses are returned """
+    start = time.time()
+    results, responses = delivery.deliver({
+        'upload': slow(0.3, Mock(status_code=200)),
+        'email': slow(0.3, Mock(status_code=202))
+    })
+    assert time.time() - start < 0.55
+    assert results['upload']['status'] == delivery.STATUS_SUCCESS
+    assert results['upload']['status_code'] == 200
+    assert results['email']['status_code'] == 202
+    assert results['email']['seconds'] >= 0.3
+    assert responses['upload'].status_code == 200
+
+def test_deliver_failure_and_timeout():
+    """ Test one failing or slow channel doesn't hide the others """
+    def fail():
+        raise ValueError('no route to host')
+
+    start = time.time()
+    results, responses = delivery.deliver(
+        {'upload': fail, 'email': slow(1), 'local': slow(0, 'saved')},
+        timeouts={'email': 0.2})
+    assert time.time() - start < 0.8
+    assert results['upload'] == {
+        'status': delivery.STATUS_FAILED,
+        'seconds': results['upload']['seconds'],
+        'error': 'ValueError: no route to host'
+    }
+    assert results['email']['status'] == delivery.STATUS_TIMEOUT
+    assert results['local']['status'] == delivery.STATUS_SUCCESS
+    assert responses == {'local': 'saved'}
+
+    error = delivery.DeliveryError(results)
+    assert str(error) == 'Delivery failed: email, upload'
+    assert error.results is results
+
+def test_deliver_error_status():
+    """ Test an http error response fails its channel, its response is still returned """
+    results, responses = delivery.deliver({
+        'upload': slow(0, Mock(status_code=500)),
+        'email': slow(0, Mock(status_code=202))
+    })
+    assert results['upload']['status'] == delivery.STATUS_FAILED
+    assert results['upload']['status_code'] == 500
+    assert results['upload']['error'] == 'HTTP 500'
+    assert results['email']['status'] == delivery.STATUS_SUCCESS
+    assert responses['upload'].status_code == 500
+    assert str(delivery.DeliveryError(results)) == 'Delivery failed: upload'
+
+def test_deliver_keeps_request_id():
+    """ Test channels log with the request's correlation id """
+    token = log.set_request_id('abc123')
+    try:
+        _results, responses = delivery.deliver({'upload': log.get_request_id})
+    finally:
+        log.reset_request_id(token)
+    assert responses['upload'] == 'abc123'
+
+def test_deliver_nothing():
+    """ Test an export without channels """
+    assert delivery.deliver({}) == ({}, {})
+
+@pytest.mark.parametrize('timeout', [0, 0.1])
+def test_deliver_zero_timeout(timeout):
+    """ Test short timeouts report the channel as timed out """
+    results, _responses = delivery.deliver({'upload': slow(0.3)}, timeouts={'upload': timeout})
+    assert results['upload']['status'] == delivery.STATUS_TIMEOUT
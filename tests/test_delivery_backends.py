@@ -0,0 +1,117 @@
+# pylint: disable=redefined-outer-name
+"""Tests for the export delivery backends """
+import io
+import os
+import copy
+import json
+import base64
+from unittest.mock import patch, Mock
+import pytest
+from falcon import testing
+import service.microservice
+from service.modules import delivery_backends
+from service.modules.delivery_backends import LocalBackend, MemoryBackend, SftpBackend
+
+CLIENT_HEADERS = {
+    "ACCESS_KEY": "1234567"
+}
+
+@pytest.fixture()
+def client():
+    """ client fixture """
+    return testing.TestClient(app=service.microservice.start_service(), headers=CLIENT_HEADERS)
+
+@pytest.fixture
+def mock_env(monkeypatch):
+    """ mock environment access key """
+    monkeypatch.setenv("ACCESS_KEY", CLIENT_HEADERS["ACCESS_KEY"])
+    monkeypatch.setenv("EXPORT_TOKEN", "xyz")
+    monkeypatch.setenv("EXPORT_EMAIL_FROM", "from@example.com")
+    monkeypatch.setenv("EXPORT_EMAIL_TO", "to@example.com")
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    """ uploads and emails kept in memory """
+    monkeypatch.setenv("EXPORT_UPLOAD_BACKEND", "memory")
+    monkeypatch.setenv("EXPORT_EMAIL_BACKEND", "memory")
+    backend = MemoryBackend()
+    previous = delivery_backends.set_backend('memory', backend)
+    yield backend
+    delivery_backends.set_backend('memory', previous)
+
+def test_get_backend(monkeypatch):
+    """ Test backends are chosen by configuration """
+    monkeypatch.delenv("EXPORT_UPLOAD_BACKEND", raising=False)
+    monkeypatch.delenv("EXPORT_EMAIL_BACKEND", raising=False)
+    assert isinstance(delivery_backends.get_upload_backend(), delivery_backends.SftpProxyBackend)
+    assert isinstance(delivery_backends.get_email_backend(), delivery_backends.SendGridBackend)
+    assert delivery_backends.get_backend('local') is delivery_backends.get_backend('local')
+
+    monkeypatch.setenv("EXPORT_UPLOAD_BACKEND", "sendgrid")
+    with pytest.raises(ValueError):
+        delivery_backends.get_upload_backend()
+    monkeypatch.setenv("EXPORT_EMAIL_BACKEND", "carrier_pigeon")
+    with pytest.raises(ValueError):
+        delivery_backends.get_email_backend()
+    with pytest.raises(ValueError):
+        delivery_backends.set_backend('carrier_pigeon', MemoryBackend())
+
+def test_local_backend(tmp_path):
+    """ Test files and mails are saved to the directory """
+    backend = LocalBackend(str(tmp_path))
+    response = backend.upload('a|b\r\n', '../DBI_permits_1.csv')
+    assert response.status_code == 201
+    with open(os.path.join(str(tmp_path), 'DBI_permits_1.csv'), 'rb') as file_obj:
+        assert file_obj.read() == b'a|b\r\n'
+
+    response = backend.send({'subject': 'PTS_Export'})
+    assert response.status_code == 202
+    with open(response.body, 'r') as file_obj:
+        assert json.load(file_obj) == {'subject': 'PTS_Export'}
+    assert os.listdir(os.path.join(str(tmp_path), 'mail')) == [os.path.basename(response.body)]
+
+def test_local_backend_state_dir(tmp_path, monkeypatch):
+    """ Test the default directory is in DISPATCHER_STATE_DIR """
+    monkeypatch.setenv('DISPATCHER_STATE_DIR', str(tmp_path))
+    monkeypatch.delenv('EXPORT_LOCAL_DIR', raising=False)
+    response = LocalBackend().upload(b'\x1f\x8b', 'DBI_permits_1.csv.gz')
+    assert response.body == os.path.join(str(tmp_path), 'deliveries', 'DBI_permits_1.csv.gz')
+
+def test_sftp_backend():
+    """ Test direct sftp uploads """
+    sftp = Mock()
+    sftp.putfo.side_effect = lambda file_obj, remotepath: setattr(sftp, 'uploaded', (file_obj.read(), remotepath))
+    response = SftpBackend(sftp).upload('a|b\r\n', 'DBI_permits_1.csv')
+    assert response.status_code == 201
+    assert sftp.uploaded == (b'a|b\r\n', 'DBI_permits_1.csv')
+
+def test_sftp_proxy_backend(monkeypatch):
+    """ Test the sftp proxy gets a streamed multipart upload """
+    monkeypatch.setenv('SFTP_ENDPOINT', 'https://sftp.example.com/upload')
+    with patch('service.modules.http_client.HttpClient.post') as mock_post:
+        delivery_backends.SftpProxyBackend().upload('a|b\r\n', 'DBI_permits_1.csv')
+    assert mock_post.call_args[0][0] == 'https://sftp.example.com/upload'
+    assert mock_post.call_args[1]['params'] == {'remotepath': '', 'filename': 'DBI_permits_1.csv'}
+    assert b'a|b\r\n' in b''.join(mock_post.call_args[1]['data'])
+
+def test_export_memory_backend(client, mock_env, memory_backend):
+    # pylint: disable=unused-argument
+    """ Test a full export delivered to the memory backend, only Form.io is mocked """
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.return_value.json.side_effect = lambda: copy.deepcopy(mock_responses)
+        response = client.simulate_get('/export', params={
+            "token": "xyz", "sftp_upload": "1", "send_email": "1", "part_rows": "2"})
+
+    assert response.status_code == 200
+    assert response.json['data']['deliveries']['upload']['status_code'] == 201
+    assert response.json['data']['deliveries']['email']['status_code'] == 202
+    assert [item['file_name'].rsplit('_', 1)[-1] for item in memory_backend.files] == [
+        'part1.csv', 'part2.csv', 'manifest.json']
+
+    mail = memory_backend.mails[0]
+    assert mail['personalizations'][0]['to'] == [{'email': 'to@example.com'}]
+    attachment = base64.b64decode(mail['attachments'][0]['content']).decode('utf-8')
+    assert len(io.StringIO(attachment, newline='').readlines()) == len(mock_responses) + 1
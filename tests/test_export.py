@@ -1,11 +1,18 @@
 # pylint: disable=redefined-outer-name
 """Tests for export """
+import copy
+import gzip
 import json
+import time
+import threading
+import base64
 from unittest.mock import patch
 import pytest
 from falcon import testing
 from service.transforms.transform import TransformBase
 from service.resources.export import Export
+from service.modules import job_queue
+from service.modules import export_ledger
 import service.microservice
 
 CLIENT_HEADERS = {
@@ -45,7 +52,7 @@ def test_export(client, mock_env):
 
     assert mock_responses
 
-    with patch('service.modules.permit_applications.requests.get') as mock:
+    with patch('service.modules.http_client.HttpClient.get') as mock:
         mock.return_value.status_code = 200
         mock.return_value.json.return_value = mock_responses
 
@@ -91,12 +98,325 @@ def test_export(client, mock_env):
             assert 'data' in response_json
             assert 'responses' in response_json['data']
 
+def test_export_paginated(client, mock_env):
+    # pylint: disable=unused-argument
+    """Test export with paginated fetch and the streaming writer"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.return_value.json.side_effect = [mock_responses[:2], mock_responses[2:]]
+
+        with patch('service.resources.export.Export.sftp') as mock_sftp:
+            mock_sftp.return_value.status_code = 200
+
+            response = client.simulate_get(
+                '/export', params={
+                    "token": "xyz",
+                    "sftp_upload": "1",
+                    "paginate": "1",
+                    "page_size": "2",
+                    "writer": "stream"})
+
+            assert response.status_code == 200
+            assert response.json['data']['responses'] == len(mock_responses)
+            assert mock.call_count == 2
+
+            submissions_csv = mock_sftp.call_args[0][0].decode('utf-8')
+            assert len(submissions_csv.split('\r\n')) == len(mock_responses) + 2
+
+            # a misspelled writer isn't silently replaced by pandas
+            mock.reset_mock()
+            response = client.simulate_get('/export', params={"token": "xyz", "sftp_upload": "1", "writer": "steam"})
+            assert response.status_code == 500
+            assert response.json['message'] == 'Invalid writer, use pandas or stream'
+            assert not mock.called
+
+@pytest.fixture
+def mock_job_queue(tmp_path, monkeypatch):
+    """ export jobs stored in a temporary directory """
+    monkeypatch.setenv('DISPATCHER_STATE_DIR', str(tmp_path))
+    previous = job_queue.set_queue(None)
+    yield
+    queue = job_queue.set_queue(previous)
+    if queue is not None:
+        queue.close()
+
+def test_export_async(client, mock_env, mock_job_queue):
+    # pylint: disable=unused-argument
+    """Test export queued as a background job and its status"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.return_value.json.return_value = mock_responses
+
+        with patch('service.resources.export.Export.sftp') as mock_sftp, \
+                patch('service.resources.export.Export.send_email') as mock_send_email:
+            mock_sftp.return_value.status_code = 200
+            mock_send_email.return_value.status_code = 202
+
+            response = client.simulate_get(
+                '/export', params={
+                    "token": "xyz",
+                    "name": "Building Permit Application",
+                    "sftp_upload": "1",
+                    "send_email": "1",
+                    "async": "1"})
+
+            assert response.status_code == 202
+            job_id = response.json['data']['job_id']
+            assert response.json['data']['url'] == '/export/jobs/' + job_id
+
+            Export.get_job_queue().wait(job_id, timeout=30)
+
+    response = client.simulate_get('/export/jobs/' + job_id, params={"token": "xyz"})
+    assert response.status_code == 200
+    job = response.json['data']
+    assert job['status'] == job_queue.STATUS_SUCCEEDED
+    assert job['params'] == {"name": "Building Permit Application", "sftp_upload": "1", "send_email": "1"}
+    assert job['result']['responses'] == len(mock_responses)
+    # the upload and the email finish in either order
+    assert list(job['progress'].keys())[:2] == ['fetched', 'transformed']
+    assert set(list(job['progress'].keys())[2:]) == {'uploaded', 'emailed'}
+    assert job['progress']['fetched']['submissions'] == len(mock_responses)
+    assert job['stage'] in ('uploaded', 'emailed')
+
+def test_export_async_failed(client, mock_env, mock_job_queue):
+    # pylint: disable=unused-argument
+    """Test a failing background export"""
+
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.side_effect = ValueError('ERROR_TEST')
+
+        response = client.simulate_get('/export', params={"token": "xyz", "async": "1"})
+        assert response.status_code == 202
+        job_id = response.json['data']['job_id']
+        Export.get_job_queue().wait(job_id, timeout=30)
+
+    response = client.simulate_get('/export/jobs/' + job_id, params={"token": "xyz"})
+    assert response.json['data']['status'] == job_queue.STATUS_FAILED
+    assert response.json['data']['error'] == 'ERROR_TEST'
+
+def test_export_job_status_errors(client, mock_env, mock_job_queue):
+    # pylint: disable=unused-argument
+    """Test export job status access and unknown jobs"""
+
+    response = client.simulate_get('/export/jobs/123', params={"token": "fail_me"})
+    assert response.status_code == 500
+    assert response.json['message'] == 'Unauthorized'
+
+    response = client.simulate_get('/export/jobs/123', params={"token": "xyz"})
+    assert response.status_code == 404
+    assert response.json['status'] == 'fail'
+
+@pytest.fixture
+def mock_ledger(tmp_path):
+    """ export ledger in a temporary directory """
+    previous = export_ledger.set_ledger(export_ledger.ExportLedger(str(tmp_path / 'ledger.sqlite3')))
+    yield
+    export_ledger.set_ledger(previous)
+
+def test_export_incremental(client, mock_env, mock_ledger):
+    # pylint: disable=unused-argument
+    """Test incremental export skips submissions already exported"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    # the mock submissions share one _id
+    for index, submission in enumerate(mock_responses):
+        submission['_id'] = submission['_id'][:-1] + str(index)
+
+    params = {"token": "xyz", "sftp_upload": "1", "incremental": "1"}
+    with patch('service.modules.http_client.HttpClient.get') as mock, \
+            patch('service.resources.export.Export.sftp') as mock_sftp:
+        # the transform changes submissions in place, every fetch gets a fresh copy
+        mock.return_value.json.side_effect = lambda: copy.deepcopy(mock_responses)
+        mock_sftp.return_value.status_code = 200
+
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 200
+        assert response.json['data']['responses'] == len(mock_responses)
+        assert response.json['data']['skipped'] == 0
+        assert 'modified__gte' not in mock.call_args[1]['params']
+
+        # unchanged, nothing is uploaded
+        mock_sftp.reset_mock()
+        response = client.simulate_get('/export', params=params)
+        assert mock.call_args[1]['params']['modified__gte'] == mock_responses[0]['modified']
+        assert not mock_sftp.called
+
+        # changed data is exported again
+        mock_responses[0]['data']['projectDescription'] = 'changed'
+        response = client.simulate_get('/export', params=params)
+        assert response.json['data']['responses'] == 1
+        assert response.json['data']['skipped'] == len(mock_responses) - 1
+        assert mock_sftp.called
+
+def test_export_incremental_upload_failed(client, mock_env, mock_ledger):
+    # pylint: disable=unused-argument
+    """Test submissions are not recorded when the upload fails"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    params = {"token": "xyz", "sftp_upload": "1", "incremental": "1"}
+    with patch('service.modules.http_client.HttpClient.get') as mock, \
+            patch('service.resources.export.Export.sftp') as mock_sftp:
+        mock.return_value.json.side_effect = lambda: copy.deepcopy(mock_responses)
+        mock_sftp.return_value.status_code = 500
+
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 500
+        assert response.json['message'] == 'Delivery failed: upload'
+        assert response.json['data']['upload']['status'] == 'failed'
+        assert response.json['data']['upload']['status_code'] == 500
+        assert export_ledger.get_ledger().get_mark() is None
+
+        mock_sftp.return_value.status_code = 200
+        response = client.simulate_get('/export', params=params)
+        assert response.json['data']['responses'] == len(mock_responses)
+
+def test_export_incremental_upload_late(client, mock_env, mock_ledger, monkeypatch):
+    # pylint: disable=unused-argument
+    """Test submissions are recorded when the upload finishes after its timeout"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    uploaded = threading.Event()
+
+    def slow_upload(*_args):
+        time.sleep(0.5)
+        uploaded.set()
+        return mock_upload_response
+
+    monkeypatch.setenv('EXPORT_UPLOAD_TIMEOUT', '0.1')
+    params = {"token": "xyz", "sftp_upload": "1", "incremental": "1"}
+    with patch('service.modules.http_client.HttpClient.get') as mock, \
+            patch('service.resources.export.Export.sftp') as mock_sftp:
+        mock.return_value.json.side_effect = lambda: copy.deepcopy(mock_responses)
+        mock_upload_response = mock_sftp.return_value
+        mock_upload_response.status_code = 200
+        mock_sftp.side_effect = slow_upload
+
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 500
+        assert response.json['data']['upload']['status'] == 'timeout'
+
+        # the upload goes on and is recorded once the file is delivered
+        assert uploaded.wait(5)
+        for _ in range(50):
+            if export_ledger.get_ledger().get_mark() is not None:
+                break
+            time.sleep(0.1)
+        assert export_ledger.get_ledger().get_mark() is not None
+
+def test_export_delivery(client, mock_env):
+    # pylint: disable=unused-argument
+    """Test the upload and the email are both sent and reported when one of them fails"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    params = {"token": "xyz", "sftp_upload": "1", "send_email": "1"}
+    with patch('service.modules.http_client.HttpClient.get') as mock, \
+            patch('service.resources.export.Export.sftp') as mock_sftp, \
+            patch('service.resources.export.Export.send_email') as mock_send_email:
+        mock.return_value.json.side_effect = lambda: copy.deepcopy(mock_responses)
+        mock_sftp.return_value.status_code = 200
+        mock_send_email.return_value.status_code = 202
+
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 200
+        deliveries = response.json['data']['deliveries']
+        assert deliveries['upload']['status'] == 'success'
+        assert deliveries['upload']['status_code'] == 200
+        assert deliveries['email']['status_code'] == 202
+
+        # the attachment is the uploaded csv
+        attachment = mock_send_email.call_args[0][0]['attachments'][0]['content']
+        assert base64.b64decode(attachment) == mock_sftp.call_args[0][0]
+
+        mock_sftp.side_effect = ValueError('sftp proxy down')
+        mock_send_email.reset_mock()
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 500
+        assert response.json['message'] == 'Delivery failed: upload'
+        assert response.json['data']['upload']['error'] == 'ValueError: sftp proxy down'
+        assert response.json['data']['email']['status'] == 'success'
+        assert mock_send_email.called
+
+        # an error response of the sftp proxy fails the upload too
+        mock_sftp.side_effect = None
+        mock_sftp.return_value.status_code = 500
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 500
+        assert response.json['message'] == 'Delivery failed: upload'
+        assert response.json['data']['upload']['status'] == 'failed'
+        assert response.json['data']['upload']['status_code'] == 500
+        assert response.json['data']['upload']['error'] == 'HTTP 500'
+        assert response.json['data']['email']['status'] == 'success'
+
+def test_export_compressed_parts(client, mock_env):
+    # pylint: disable=unused-argument
+    """Test exports uploaded as compressed part files with a manifest and emailed compressed"""
+
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    params = {"token": "xyz", "sftp_upload": "1", "send_email": "1", "compress": "gzip", "part_rows": "2"}
+    with patch('service.modules.http_client.HttpClient.get') as mock, \
+            patch('service.resources.export.Export.sftp') as mock_sftp, \
+            patch('service.resources.export.Export.send_email') as mock_send_email:
+        mock.return_value.json.side_effect = lambda: copy.deepcopy(mock_responses)
+        mock_sftp.return_value.status_code = 200
+        mock_send_email.return_value.status_code = 202
+
+        response = client.simulate_get('/export', params=params)
+        assert response.status_code == 200
+
+        uploads = [call[0] for call in mock_sftp.call_args_list]
+        parts = (len(mock_responses) + 1) // 2
+        assert [upload[1].split('_part')[-1] for upload in uploads[:-1]] == [
+            '{0}.csv.gz'.format(index) for index in range(1, parts + 1)]
+        assert uploads[-1][1].endswith('_manifest.json')
+        manifest = json.loads(uploads[-1][0])
+        assert manifest['rows'] == len(mock_responses)
+        assert len(manifest['parts']) == parts
+        rows = [
+            line for upload in uploads[:-1]
+            for line in gzip.decompress(upload[0]).decode('utf-8').split('\r\n')[1:] if line]
+        assert len(rows) == len(mock_responses)
+
+        attachment = mock_send_email.call_args[0][0]['attachments'][0]
+        assert attachment['filename'].endswith('.csv.gz')
+        assert attachment['type'] == 'application/gzip'
+        assert len(gzip.decompress(base64.b64decode(attachment['content'])).decode('utf-8').split('\r\n')) == len(mock_responses) + 2
+
+        # the manifest isn't uploaded when a part fails
+        mock_sftp.reset_mock()
+        mock_sftp.return_value.status_code = 500
+        response = client.simulate_get('/export', params=params)
+        assert mock_sftp.call_count == 1
+        assert response.status_code == 500
+        assert response.json['message'] == 'Delivery failed: upload'
+        assert response.json['data']['upload']['status'] == 'failed'
+        assert response.json['data']['email']['status'] == 'success'
+
+        response = client.simulate_get('/export', params=dict(params, compress='rar'))
+        assert response.status_code == 500
+        assert response.json['message'] == 'Invalid compress, use gzip or zip'
+
 def test_export_exception(client, mock_env):
     # pylint: disable=unused-argument
     # mock_env is a fixture and creates a false positive for pylint
     """Test export exception """
 
-    with patch('service.modules.permit_applications.requests.get') as mock:
+    with patch('service.modules.http_client.HttpClient.get') as mock:
         mock.return_value.status_code = 500
         mock.side_effect = ValueError('ERROR_TEST')
 
@@ -136,7 +456,7 @@ def test_export_exception_email(client, mock_env):
 
     assert mock_responses
 
-    with patch('service.modules.permit_applications.requests.get') as mock:
+    with patch('service.modules.http_client.HttpClient.get') as mock:
         mock.return_value.status_code = 200
         mock.return_value.json.return_value = mock_responses
 
@@ -166,7 +486,7 @@ def test_export_exception_sftp(client, mock_env):
 
     assert mock_responses
 
-    with patch('service.modules.permit_applications.requests.get') as mock:
+    with patch('service.modules.http_client.HttpClient.get') as mock:
         mock.return_value.status_code = 200
         mock.return_value.json.return_value = mock_responses
 
@@ -0,0 +1,92 @@
+"""Tests for compressed and split export files """
+import io
+import csv
+import gzip
+import json
+import hashlib
+import zipfile
+import pytest
+from service.modules import export_files
+
+CSV = (
+    'id|description|notes\r\n'
+    '1|plain|\r\n'
+    '2|"New 3 story mixed use building\nwith ground floor retail"|x\r\n'
+    '3|"quoted ""pipe | inside"""|\r\n'
+    '4|last|y\r\n'
+)
+
+def read_rows(text):
+    """ csv rows of text """
+    return list(csv.reader(io.StringIO(text, newline=''), delimiter='|'))
+
+def test_iter_records():
+    """ Test records keep their line breaks, in and after quoted fields """
+    records = list(export_files.iter_records(CSV, '|'))
+    assert len(records) == 5
+    assert ''.join(records) == CSV
+    assert records[2] == '2|"New 3 story mixed use building\nwith ground floor retail"|x\r\n'
+
+def test_split():
+    """ Test parts have the header and at most part_rows rows """
+    parts = export_files.split(CSV, '|', 3)
+    assert [rows for _part, rows in parts] == [3, 1]
+    assert all(part.startswith('id|description|notes\r\n') for part, _rows in parts)
+    assert read_rows(parts[0][0])[1:] + read_rows(parts[1][0])[1:] == read_rows(CSV)[1:]
+
+    assert export_files.split('id|description\r\n', '|', 3) == [('id|description\r\n', 0)]
+
+def test_compress():
+    """ Test gzip and zip files hold the csv and are the same for the same csv """
+    content = CSV.encode('utf-8')
+    assert export_files.compress('a.csv', content) == ('a.csv', content)
+
+    file_name, compressed = export_files.compress('a.csv', content, 'gzip')
+    assert file_name == 'a.csv.gz'
+    assert gzip.decompress(compressed) == content
+    assert export_files.compress('a.csv', content, 'gzip')[1] == compressed
+
+    file_name, compressed = export_files.compress('a.csv', content, 'zip')
+    assert file_name == 'a.csv.zip'
+    with zipfile.ZipFile(io.BytesIO(compressed)) as archive:
+        assert archive.namelist() == ['a.csv']
+        assert archive.read('a.csv') == content
+    assert export_files.compress('a.csv', content, 'zip')[1] == compressed
+
+    with pytest.raises(ValueError):
+        export_files.compress('a.csv', content, 'rar')
+
+def test_get_files():
+    """ Test part files are followed by their manifest """
+    assert export_files.get_files(CSV, '|', 'DBI_permits_1') == [{
+        'file_name': 'DBI_permits_1.csv',
+        'content': CSV.encode('utf-8'),
+        'content_type': 'text/csv',
+        'rows': None
+    }]
+
+    files = export_files.get_files(CSV, '|', 'DBI_permits_1', 'gzip', 2)
+    assert [item['file_name'] for item in files] == [
+        'DBI_permits_1_part1.csv.gz', 'DBI_permits_1_part2.csv.gz', 'DBI_permits_1_manifest.json']
+    assert files[0]['content_type'] == 'application/gzip'
+    rows = [row for item in files[:-1] for row in read_rows(gzip.decompress(item['content']).decode('utf-8'))[1:]]
+    assert rows == read_rows(CSV)[1:]
+
+    manifest = json.loads(files[-1]['content'])
+    assert manifest['file_name'] == 'DBI_permits_1.csv'
+    assert manifest['compression'] == 'gzip'
+    assert manifest['rows'] == 4
+    assert manifest['parts'][1] == {
+        'file_name': 'DBI_permits_1_part2.csv.gz',
+        'rows': 2,
+        'bytes': len(files[1]['content']),
+        'sha256': hashlib.sha256(files[1]['content']).hexdigest()
+    }
+
+def test_get_options():
+    """ Test compress and part_rows params """
+    assert export_files.get_options({}) == (None, 0)
+    assert export_files.get_options({'compress': 'zip', 'part_rows': '500'}) == ('zip', 500)
+    for params in ({'compress': 'rar'}, {'part_rows': 'many'}, {'part_rows': '-1'}):
+        with pytest.raises(ValueError):
+            export_files.get_options(params)
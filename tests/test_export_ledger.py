@@ -0,0 +1,62 @@
+# pylint: disable=redefined-outer-name
+"""Tests for the export ledger """
+import pytest
+from service.modules.export_ledger import ExportLedger, content_hash
+
+@pytest.fixture
+def ledger(tmp_path):
+    """ ledger in a temporary directory """
+    return ExportLedger(db_path=str(tmp_path / 'ledger.sqlite3'))
+
+def make_submission(submission_id, modified, **data):
+    """ minimal Form.io submission """
+    return {'_id': submission_id, 'modified': modified, 'created': '2020-01-01T00:00:00.000Z', 'data': data}
+
+def test_content_hash():
+    """ hash follows the form data only """
+    submission = make_submission('1', '2020-01-01T00:00:00.000Z', a=1, b=2)
+    assert content_hash(submission) == content_hash(make_submission('2', '2021-01-01T00:00:00.000Z', b=2, a=1))
+    assert content_hash(submission) != content_hash(make_submission('1', '2020-01-01T00:00:00.000Z', a=2, b=2))
+
+def test_filter_and_record(ledger):
+    """ exported unchanged submissions are skipped, new and changed ones pass """
+    assert ledger.get_mark() is None
+
+    first = [
+        make_submission('1', '2020-01-01T00:00:00.000Z', a=1),
+        make_submission('2', '2020-01-02T00:00:00.000Z', a=2)
+    ]
+    seen = []
+    assert list(ledger.filter_changed(first, seen)) == first
+    assert [entry['changed'] for entry in seen] == [True, True]
+    ledger.record(seen)
+    assert ledger.get_mark() == '2020-01-02T00:00:00.000Z'
+    assert ledger.get('1')['hash'] == content_hash(first[0])
+
+    second = [
+        make_submission('1', '2020-01-03T00:00:00.000Z', a=1),
+        make_submission('2', '2020-01-03T00:00:00.000Z', a=3),
+        make_submission('3', '2020-01-04T00:00:00.000Z', a=4)
+    ]
+    seen = []
+    assert [submission['_id'] for submission in ledger.filter_changed(second, seen)] == ['2', '3']
+    assert [entry['changed'] for entry in seen] == [False, True, True]
+
+    # nothing is recorded until the export went through
+    assert ledger.get('3') is None
+    ledger.record(seen)
+    assert ledger.get('2')['hash'] == content_hash(second[1])
+    assert ledger.get('1')['modified'] == '2020-01-03T00:00:00.000Z'
+    assert ledger.get_mark() == '2020-01-04T00:00:00.000Z'
+
+def test_filter_chunks(ledger, monkeypatch):
+    """ ledger lookups are chunked """
+    monkeypatch.setattr('service.modules.export_ledger.LEDGER_LOOKUP_CHUNK', 2)
+    submissions = [make_submission(str(i), '2020-01-01T00:00:00.000Z', a=i) for i in range(5)]
+    seen = []
+    list(ledger.filter_changed(submissions[:3], seen))
+    ledger.record(seen)
+
+    seen = []
+    assert [submission['_id'] for submission in ledger.filter_changed(submissions, seen)] == ['3', '4']
+    assert len(seen) == 5
@@ -0,0 +1,169 @@
+"""Tests for export submissions transform """
+import copy
+import json
+import concurrent.futures
+from unittest.mock import patch
+import pytest
+from service.transforms.export_submissions import ExportSubmissionsTransform
+from service.resources.field_maps import FieldMaps
+from service.modules.row_cache import RowCache
+from benchmarks import generator
+
+@pytest.fixture
+def submissions():
+    """ export submissions fixture """
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        return json.load(file_obj)
+
+@pytest.mark.parametrize('sep', [',', '|'])
+def test_compiled_plan_matches_pipeline(submissions, sep):
+    # pylint: disable=redefined-outer-name
+    """ test the compiled plan produces the same csv as the per key pipeline """
+    expected = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), sep)
+    actual = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), sep, compiled=True)
+    assert actual == expected
+
+def test_compiled_plan_variants(submissions):
+    # pylint: disable=redefined-outer-name
+    """ test site permit, datetime, multi-line and new construction values """
+    submissions[0]['data']['sitePermitForm38'] = ''
+    submissions[0]['data']['sitePermitForm12'] = 'yes'
+    submissions[0]['data']['notes'] = 'line 1\nline 2 | pipe'
+    submissions[1]['data']['onlyFireDepartmentReview'] = 'yes'
+    submissions[1]['data']['estimatedCostOfProject'] = 300
+    submissions[2]['data']['typeOfConstruction'] = '2020-08-17T16:56:09.191Z'
+    submissions[2]['data']['newTypeOfConstruction'] = ''
+
+    expected = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), '|')
+    actual = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), '|', compiled=True)
+    assert actual == expected
+
+def test_compiled_plan_skips_existing_permit_application(submissions):
+    # pylint: disable=redefined-outer-name
+    """ test existingPermitApplication submissions are not exported """
+    submissions[1]['data']['permitType'] = 'existingPermitApplication'
+    rows = ExportSubmissionsTransform().apply_plan(submissions)
+    assert len(rows) == 2
+
+@pytest.mark.parametrize('sep', [',', '|'])
+def test_stream_writer_matches_pandas(submissions, sep):
+    # pylint: disable=redefined-outer-name
+    """ test the streaming csv writer produces the same csv as pandas """
+    submissions[0]['data']['notes'] = 'quote " and, comma'
+    expected = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), sep)
+    actual = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), sep, writer='stream')
+    assert actual == expected
+
+def test_unknown_writer(submissions):
+    # pylint: disable=redefined-outer-name
+    """ test a writer other than pandas or stream is rejected """
+    with pytest.raises(ValueError):
+        ExportSubmissionsTransform().transform(submissions, '|', writer='steam')
+
+def test_iter_csv(submissions):
+    # pylint: disable=redefined-outer-name
+    """ test the header is emitted first, then one line per submission """
+    lines = list(ExportSubmissionsTransform().iter_csv(submissions, '|'))
+    assert len(lines) == len(submissions) + 1
+    assert lines[0].startswith('Id|Created|Permit Type|')
+    assert all(line.endswith('\r\n') for line in lines)
+    assert lines[1].startswith(submissions[0]['_id'] + '|')
+
+@pytest.mark.parametrize('writer', ['pandas', 'stream'])
+def test_row_cache(submissions, writer, tmp_path):
+    # pylint: disable=redefined-outer-name
+    """ test cached rows produce the same csv and repeated exports only hit the cache """
+    expected = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), '|', True, writer)
+
+    cache = RowCache(db_path=str(tmp_path / 'rows.sqlite3'))
+    transform = ExportSubmissionsTransform(cache)
+    assert transform.transform(copy.deepcopy(submissions), '|', True, writer) == expected
+    assert transform.transform(copy.deepcopy(submissions), '|', True, writer) == expected
+    assert cache.get_stats()['misses'] == len(submissions)
+    assert cache.get_stats()['hits'] == len(submissions)
+
+    # an edited submission is transformed again
+    edited = copy.deepcopy(submissions)
+    edited[0]['data']['notes'] = 'edited'
+    assert ExportSubmissionsTransform(cache).transform(edited, '|', True, writer) != expected
+    assert cache.get_stats()['misses'] == len(submissions) + 1
+
+    # rows on disk are used after a restart
+    restarted = RowCache(db_path=str(tmp_path / 'rows.sqlite3'))
+    actual = ExportSubmissionsTransform(restarted).transform(copy.deepcopy(submissions), '|', True, writer)
+    assert actual == expected
+    assert restarted.get_stats()['disk_hits'] == len(submissions)
+
+def test_row_cache_salt(submissions, monkeypatch):
+    # pylint: disable=redefined-outer-name
+    """ test cached rows are not used once the mapping data changes """
+    cache = RowCache()
+    ExportSubmissionsTransform(cache).apply_plan(copy.deepcopy(submissions))
+    monkeypatch.setattr(FieldMaps, '_signature', 'changed')
+    ExportSubmissionsTransform(cache).apply_plan(copy.deepcopy(submissions))
+    assert cache.get_stats()['hits'] == 0
+
+@pytest.mark.parametrize('compiled,writer', [(False, 'pandas'), (True, 'pandas'), (True, 'stream')])
+def test_parallel_transform(submissions, compiled, writer, monkeypatch):
+    # pylint: disable=redefined-outer-name
+    """ test the parallel transform keeps order and produces the same csv """
+    monkeypatch.setenv('PARALLEL_TRANSFORM_THRESHOLD', '4')
+    monkeypatch.setenv('PARALLEL_TRANSFORM_CHUNK', '2')
+    batch = []
+    for index in range(12):
+        submission = copy.deepcopy(submissions[index % len(submissions)])
+        submission['_id'] = '{:024x}'.format(index)
+        batch.append(submission)
+
+    expected = ExportSubmissionsTransform().transform(copy.deepcopy(batch), '|', compiled, writer)
+    actual = ExportSubmissionsTransform(workers=2).transform(copy.deepcopy(batch), '|', compiled, writer)
+    assert actual == expected
+
+    # with a row cache only the misses go to the pool
+    cache = RowCache()
+    ExportSubmissionsTransform(cache).apply_plan(copy.deepcopy(batch[:5]))
+    rows = ExportSubmissionsTransform(cache, workers=2).apply_plan(copy.deepcopy(batch))
+    assert rows == ExportSubmissionsTransform().apply_plan(copy.deepcopy(batch))
+    assert cache.get_stats()['hits'] == 5
+
+def test_parallel_transform_cache_hits(submissions, monkeypatch):
+    # pylint: disable=redefined-outer-name
+    """ test cache hits between the misses don't make the transform serial, one pool serves every miss """
+    monkeypatch.setenv('PARALLEL_TRANSFORM_THRESHOLD', '4')
+    batch = []
+    for index in range(12):
+        submission = copy.deepcopy(submissions[index % len(submissions)])
+        submission['_id'] = '{:024x}'.format(index)
+        batch.append(submission)
+    cache = RowCache()
+    ExportSubmissionsTransform(cache).apply_plan(copy.deepcopy(batch[::2]))
+
+    process_pool = concurrent.futures.ProcessPoolExecutor
+    def pool(*args, **kwargs):
+        return process_pool(*args, **kwargs)
+    with patch('concurrent.futures.ProcessPoolExecutor', side_effect=pool) as mock_pool:
+        rows = ExportSubmissionsTransform(cache, workers=2).apply_plan(copy.deepcopy(batch))
+    assert mock_pool.call_count == 1
+    # the workers aren't forked from a process running threads
+    assert mock_pool.call_args[1]['mp_context'].get_start_method() == 'spawn'
+    assert rows == ExportSubmissionsTransform().apply_plan(copy.deepcopy(batch))
+    assert cache.get_stats()['hits'] == 6
+
+def test_parallel_transform_threshold(submissions, monkeypatch):
+    # pylint: disable=redefined-outer-name
+    """ test small batches stay serial """
+    monkeypatch.setenv('PARALLEL_TRANSFORM_THRESHOLD', '4')
+    with patch('concurrent.futures.ProcessPoolExecutor') as mock_pool:
+        rows = ExportSubmissionsTransform(workers=2).apply_plan(submissions)
+    assert len(rows) == len(submissions)
+    assert not mock_pool.called
+
+@pytest.mark.parametrize('permit_type', ['existingBuilding', 'newConstruction'])
+def test_generated_submissions(permit_type):
+    """ test the compiled plan and stream writer on synthetic submissions of every field family """
+    submissions = generator.generate(50, seed=1, permit_type=permit_type)
+    expected = ExportSubmissionsTransform().transform(copy.deepcopy(submissions), '|')
+    assert len(expected.split('\r\n')) == len(submissions) + 2
+    assert ExportSubmissionsTransform().transform(copy.deepcopy(submissions), '|', True) == expected
+    assert ExportSubmissionsTransform().transform(copy.deepcopy(submissions), '|', True, 'stream') == expected
+    assert generator.generate(50, seed=1, permit_type=permit_type) == submissions
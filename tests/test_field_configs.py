@@ -8,3 +8,32 @@ from service.resources.field_configs import FieldConfigs
 def test_get_field_key(name, expected):
     """ test get map files """
     assert expected == FieldConfigs.get_field_key(name, 'map')
+
+def test_get_field():
+    """ test compiled field index records """
+    field = FieldConfigs.get_field('typeOfConstruction')
+    assert field.map_key == 'construction_type'
+    assert field.relabel == 'proposedTypeOfConstruction'
+    assert field.is_pts
+    assert field.position is None
+
+    field = FieldConfigs.get_field('applicantPhoneNumber')
+    assert field.pretty_key == 'phone_fields'
+    assert field.position == FieldConfigs.ordered_fields.index('applicantPhoneNumber')
+
+    assert FieldConfigs.get_field('ownerName').missing_fields == ('ownerFirstName', 'ownerLastName')
+    assert len(FieldConfigs.get_field('agentName').missing_fields) == 8
+    assert FieldConfigs.get_field('notAField') is None
+
+@pytest.mark.parametrize('name', FieldConfigs.pts_fields + FieldConfigs.ordered_fields + ['notAField', ''])
+def test_field_index_matches_configs(name):
+    """ test the index lookups agree with the config lists """
+    assert bool(FieldConfigs.is_pts_fields(name)) == (bool(name) and name in FieldConfigs.pts_fields)
+    assert bool(FieldConfigs.is_missing_field(name)) == (bool(name) and name in FieldConfigs.missing_fields)
+    assert FieldConfigs.get_relabel_fields(name) == FieldConfigs.relabel_fields.get(name)
+
+def test_get_ordered_columns():
+    """ test ordered columns drop duplicates and keep order """
+    columns = FieldConfigs.get_ordered_columns()
+    assert len(columns) == len(set(columns))
+    assert list(columns) == list(dict.fromkeys(FieldConfigs.ordered_fields))
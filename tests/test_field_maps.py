@@ -1,5 +1,6 @@
 # pylint: disable=redefined-outer-name
 """Tests for field configs and mappings """
+from unittest.mock import patch
 import pytest
 from service.resources.field_maps import FieldMaps
 
@@ -19,3 +20,44 @@ def test_map_key_value_states(name, expected):
 def test_map_key_value_street_suffix(name, expected):
     """ test mapping values to key from map_type """
     assert expected == FieldMaps.map_key_value('street_suffix_fields', name)
+
+def test_map_key_value_multi_select():
+    """ test comma separated multi-select values """
+    assert FieldMaps.map_key_value('state_fields', '"california, colorado,unknown"') == 'CA,CO'
+    assert FieldMaps.map_key_value('state_fields', 'california,colorado') == 'CA,CO'
+
+def test_map_key_value_not_mapped():
+    """ test values with no mapping are returned as is """
+    assert FieldMaps.map_key_value('state_fields', 'atlantis') == 'atlantis'
+    assert FieldMaps.map_key_value('state_fields', '') == ''
+
+def test_load_reads_files_once():
+    """ test mapping files are only read when the registry is loaded """
+    FieldMaps.load()
+    with patch('builtins.open') as mock_open:
+        FieldMaps.map_key_value('state_fields', 'california')
+        FieldMaps.map_key_value('street_suffix_fields', 'Avenue')
+        FieldMaps.map_key_value('building_use', 'apartments, office')
+        mock_open.assert_not_called()
+
+def test_registry_is_immutable():
+    """ test the lookup registry can't be modified """
+    with pytest.raises(TypeError):
+        FieldMaps.get_map('state_fields')['california'] = 'XX'
+
+def test_hot_reload(monkeypatch):
+    """ test the registry is reloaded when a data file changes on disk """
+    FieldMaps.load()
+    assert not FieldMaps.is_stale()
+
+    monkeypatch.setenv('FIELD_MAPS_HOT_RELOAD', '1')
+    monkeypatch.setenv('FIELD_MAPS_RELOAD_INTERVAL', '0')
+    file_path = FieldMaps.get_map_path('state_fields')
+    monkeypatch.setitem(FieldMaps._mtimes, file_path, 0) # pylint: disable=protected-access
+    assert FieldMaps.is_stale()
+
+    with patch('service.resources.field_maps.FieldMaps.load', wraps=FieldMaps.load) as mock_load:
+        monkeypatch.setitem(FieldMaps._mtimes, file_path, 0) # pylint: disable=protected-access
+        assert FieldMaps.map_key_value('state_fields', 'california') == 'CA'
+        mock_load.assert_called_once()
+    assert not FieldMaps.is_stale()
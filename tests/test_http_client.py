@@ -0,0 +1,155 @@
+# pylint: disable=redefined-outer-name
+"""Tests for the shared http client """
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from service.modules import http_client
+from service.modules.http_client import HttpClient
+from service.modules.permit_applications import PermitApplication
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ local stub server, fails the first `failures` requests with a 503 """
+    failures = 0
+    delay = 0
+    paths = []
+    bodies = []
+
+    def do_GET(self):
+        # pylint: disable=invalid-name
+        """ handle GET """
+        StubHandler.paths.append(self.path)
+        if StubHandler.failures > 0:
+            StubHandler.failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps([{'_id': '1', 'data': {}}]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # pylint: disable=invalid-name
+        """ handle POST, keeping the request body and headers """
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        StubHandler.bodies.append((dict(self.headers), body))
+        if StubHandler.delay:
+            time.sleep(StubHandler.delay)
+        self.do_GET()
+
+    do_PUT = do_POST
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        """ silence request logs """
+
+@pytest.fixture
+def stub_server():
+    """ run the stub server in a background thread """
+    StubHandler.failures = 0
+    StubHandler.delay = 0
+    StubHandler.paths = []
+    StubHandler.bodies = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_request_stats(stub_server):
+    """ test latency and request counters per endpoint """
+    client = HttpClient(max_retries=0)
+    response = client.get(stub_server + '/applications', endpoint='stub')
+
+    assert response.status_code == 200
+    stats = client.get_stats()['stub']
+    assert stats['requests'] == 1
+    assert stats['errors'] == 0
+    assert stats['retries'] == 0
+    assert stats['seconds'] > 0
+
+def test_retry_on_503(stub_server):
+    """ test 5xx responses are retried with backoff """
+    StubHandler.failures = 2
+    client = HttpClient(max_retries=3, backoff_factor=0)
+    response = client.get(stub_server + '/applications', endpoint='stub')
+
+    assert response.status_code == 200
+    assert len(StubHandler.paths) == 3
+    assert client.get_stats()['stub']['retries'] == 2
+
+def test_retries_exhausted(stub_server):
+    """ test the last error response is returned when retries run out """
+    StubHandler.failures = 5
+    client = HttpClient(max_retries=1, backoff_factor=0)
+    response = client.get(stub_server + '/applications', endpoint='stub')
+
+    assert response.status_code == 503
+    assert client.get_stats()['stub']['errors'] == 1
+
+def test_connection_error():
+    """ test connection errors are counted and raised """
+    client = HttpClient(max_retries=0, connect_timeout=1)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('http://127.0.0.1:1/', endpoint='closed')
+    assert client.get_stats()['closed']['errors'] == 1
+
+def test_set_client(stub_server, monkeypatch):
+    """ test the shared client can be swapped for tests """
+    monkeypatch.setenv('X_APIKEY', 'abc')
+    client = HttpClient(max_retries=0)
+    previous = http_client.set_client(client)
+    try:
+        assert http_client.get_client() is client
+        responses = PermitApplication.get_applications_by_query({'actionState': 'Export to PTS'}, base_url=stub_server)
+        assert responses[0]['_id'] == '1'
+        assert StubHandler.paths[0].startswith('/applications?actionState=Export')
+        assert client.get_stats()['formio.get_applications']['requests'] == 1
+    finally:
+        http_client.set_client(previous)
+
+def test_multipart_stream(stub_server):
+    """ test a streamed multipart file is sent as requests' files= would send it, again on a retry """
+    data = 'id|name\r\n1|café\r\n'.encode('utf-8') * 10000
+    body = http_client.MultipartStream('file', 'export.csv', data, 'text/plain', {'Expires': '0'})
+    expected = requests.Request('POST', stub_server, files={
+        'file': ('export.csv', data, 'text/plain', {'Expires': '0'})
+    }).prepare()
+    boundary = body.content_type.split('boundary=')[1]
+    assert expected.body.replace(expected.headers['Content-Type'].split('boundary=')[1].encode(), boundary.encode()) == b''.join(body)
+    assert len(body) == len(b''.join(body))
+
+    StubHandler.failures = 1
+    client = HttpClient(max_retries=1, backoff_factor=0)
+    response = client.request('PUT', stub_server + '/upload', endpoint='stub', data=body, headers={'Content-Type': body.content_type})
+    assert response.status_code == 200
+    assert len(StubHandler.bodies) == 2
+    for headers, sent in StubHandler.bodies:
+        assert sent == b''.join(body)
+        assert headers['Content-Length'] == str(len(body))
+        assert 'Transfer-Encoding' not in headers
+
+    bytes_body = http_client.MultipartStream('file', 'export.csv.gz', b'\x1f\x8b' * 5, 'application/gzip')
+    assert b''.join(bytes_body).count(b'\x1f\x8b') == 5
+    assert b'Content-Type: application/gzip' in bytes_body.head
+
+def test_post_not_retried(stub_server):
+    """ test an upload isn't sent again after a read timeout or an error response """
+    StubHandler.delay = 0.5
+    client = HttpClient(max_retries=3, backoff_factor=0, read_timeout=0.1)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.post(stub_server + '/upload', endpoint='stub', data=b'file')
+    time.sleep(0.6)
+    assert len(StubHandler.bodies) == 1
+
+    StubHandler.delay = 0
+    StubHandler.failures = 1
+    response = client.post(stub_server + '/upload', endpoint='stub', data=b'file')
+    assert response.status_code == 503
+    assert len(StubHandler.bodies) == 2
@@ -0,0 +1,166 @@
+# pylint: disable=redefined-outer-name
+"""Tests for the background job queue """
+import os
+import time
+import socket
+import subprocess
+import threading
+import pytest
+from service.modules import job_queue
+from service.modules.job_queue import JobQueue
+
+@pytest.fixture
+def db_path(tmp_path):
+    """ jobs database in a temporary directory """
+    return str(tmp_path / 'jobs.sqlite3')
+
+def test_job_success(db_path):
+    """ a job runs in the background and records its stages and result """
+    def runner(params, progress):
+        progress('fetched', submissions=2)
+        progress('transformed', submissions=2)
+        return {'name': params['name']}
+
+    queue = JobQueue(runner, db_path=db_path)
+    job_id = queue.enqueue({'name': 'test'})
+    job = queue.wait(job_id, timeout=5)
+    queue.close()
+
+    assert job['status'] == job_queue.STATUS_SUCCEEDED
+    assert job['params'] == {'name': 'test'}
+    assert job['result'] == {'name': 'test'}
+    assert job['stage'] == 'transformed'
+    assert list(job['progress'].keys()) == ['fetched', 'transformed']
+    assert job['progress']['fetched']['submissions'] == 2
+    assert job['progress']['fetched']['seconds'] >= 0
+    assert job['error'] is None
+    assert job['started'] >= job['created']
+    assert job['finished'] >= job['started']
+
+def test_job_failure(db_path):
+    """ a runner exception fails the job with its message """
+    def runner(_params, progress):
+        progress('fetched', submissions=1)
+        raise ValueError('ERROR_TEST')
+
+    queue = JobQueue(runner, db_path=db_path)
+    job = queue.wait(queue.enqueue({}), timeout=5)
+    queue.close()
+
+    assert job['status'] == job_queue.STATUS_FAILED
+    assert job['error'] == 'ERROR_TEST'
+    assert job['stage'] == 'fetched'
+    assert job['result'] is None
+
+def test_job_not_found(db_path):
+    """ unknown job ids """
+    queue = JobQueue(lambda params, progress: None, db_path=db_path)
+    assert queue.get('nope') is None
+    assert queue.wait('nope') is None
+    queue.close()
+
+def test_job_status_while_running(db_path):
+    """ the job status is readable while the job runs """
+    release = threading.Event()
+    def runner(_params, progress):
+        progress('fetched', submissions=1)
+        release.wait(5)
+
+    queue = JobQueue(runner, db_path=db_path)
+    job_id = queue.enqueue({})
+    for _ in range(100):
+        job = queue.get(job_id)
+        if job['stage'] == 'fetched':
+            break
+        time.sleep(0.05)
+    assert job['status'] == job_queue.STATUS_RUNNING
+    release.set()
+    assert queue.wait(job_id, timeout=5)['status'] == job_queue.STATUS_SUCCEEDED
+    queue.close()
+
+def test_job_claimed_once(db_path):
+    """ a job is run by only one of the queues sharing a store """
+    calls = []
+    queue = JobQueue(lambda params, progress: calls.append(params), db_path=db_path, max_workers=1)
+    job_id = queue.enqueue({})
+    queue.wait(job_id, timeout=5)
+    # another process picking up the same job does nothing
+    other = JobQueue(lambda params, progress: calls.append(params), db_path=db_path)
+    other.run(job_id)
+    queue.close()
+    other.close()
+
+    assert calls == [{}]
+
+def test_resume(db_path):
+    """ queued jobs survive a restart, jobs left running too long are failed """
+    release = threading.Event()
+    stopped = JobQueue(lambda params, progress: release.wait(5), db_path=db_path)
+    running_id = stopped.enqueue({'job': 'running'})
+    for _ in range(100):
+        if stopped.get(running_id)['status'] == job_queue.STATUS_RUNNING:
+            break
+        time.sleep(0.05)
+    # the single worker is busy so this one stays queued
+    queued_id = stopped.enqueue({'job': 'queued'})
+    assert stopped.get(queued_id)['status'] == job_queue.STATUS_QUEUED
+
+    calls = []
+    restarted = JobQueue(lambda params, progress: calls.append(params) or 'done', db_path=db_path)
+    assert restarted.resume(timeout=3600) == [queued_id]
+    assert restarted.wait(queued_id, timeout=5)['result'] == 'done'
+    assert stopped.get(running_id)['status'] == job_queue.STATUS_RUNNING
+
+    restarted.resume(timeout=0)
+    job = restarted.get(running_id)
+    assert job['status'] == job_queue.STATUS_FAILED
+    assert job['error'] == job_queue.ERROR_JOB_INTERRUPTED
+    assert calls == [{'job': 'queued'}]
+
+    release.set()
+    stopped.close()
+    restarted.close()
+
+def test_resume_gone_worker(db_path):
+    """ jobs of a process of this host that went away are failed right away, whatever their age """
+    process = subprocess.Popen(['true'])
+    process.wait()
+    host = socket.gethostname()
+    queue = JobQueue(lambda params, progress: 'done', db_path=db_path)
+    workers = {
+        'dead': '{0}:{1}:token'.format(host, process.pid),
+        'earlier': '{0}:{1}'.format(host, os.getpid()),
+        'other_host': 'elsewhere:1:token',
+        'alive': queue.worker
+    }
+    with queue.transaction() as connection:
+        connection.executemany(
+            'INSERT INTO jobs (id, status, params, progress, worker, created, started) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(name, job_queue.STATUS_RUNNING, '{}', '{}', worker, time.time(), time.time())
+             for name, worker in workers.items()])
+
+    queue.resume(timeout=3600)
+    with queue.transaction() as connection:
+        statuses = dict(connection.execute('SELECT id, status FROM jobs').fetchall())
+    assert statuses == {
+        'dead': job_queue.STATUS_FAILED,
+        'earlier': job_queue.STATUS_FAILED,
+        'other_host': job_queue.STATUS_RUNNING,
+        'alive': job_queue.STATUS_RUNNING
+    }
+    queue.close()
+
+def test_get_gone_worker(db_path):
+    """ a poller sees a job whose process went away as failed without waiting for a restart """
+    process = subprocess.Popen(['true'])
+    process.wait()
+    queue = JobQueue(lambda params, progress: 'done', db_path=db_path)
+    with queue.transaction() as connection:
+        connection.execute(
+            'INSERT INTO jobs (id, status, params, progress, worker, created, started) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ('job', job_queue.STATUS_RUNNING, '{}', '{}',
+             '{0}:{1}:token'.format(socket.gethostname(), process.pid), time.time(), time.time()))
+    job = queue.get('job')
+    assert job['status'] == job_queue.STATUS_FAILED
+    assert job['error'] == job_queue.ERROR_JOB_INTERRUPTED
+    queue.close()
@@ -0,0 +1,131 @@
+# pylint: disable=redefined-outer-name
+"""Tests for structured logging """
+import sys
+import json
+import logging
+from unittest.mock import patch, Mock
+import pytest
+from falcon import testing
+import service.microservice
+from service.modules import log
+from service.resources.export import Export
+
+CLIENT_HEADERS = {
+    "ACCESS_KEY": "1234567"
+}
+
+@pytest.fixture()
+def client():
+    """ client fixture """
+    return testing.TestClient(app=service.microservice.start_service(), headers=CLIENT_HEADERS)
+
+def make_record(msg='message', level=logging.INFO, **extra):
+    """ a LogRecord with extra fields """
+    record = logging.LogRecord('service.test', level, __file__, 1, msg, (), None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+def test_json_formatter():
+    """ Test records are formatted as one JSON object with the request id and extra fields """
+    formatter = log.JsonFormatter(max_field_length=10)
+    token = log.set_request_id('abc123')
+    try:
+        line = formatter.format(make_record('a' * 20, status_code=202, params={'form': 'b' * 20}))
+    finally:
+        log.reset_request_id(token)
+    entry = json.loads(line)
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'service.test'
+    assert entry['request_id'] == 'abc123'
+    assert entry['status_code'] == 202
+    assert entry['message'] == 'a' * 10 + '...(+10 chars)'
+    assert entry['params']['form'] == 'b' * 10 + '...(+10 chars)'
+    assert 'msg' not in entry and 'args' not in entry
+
+def test_json_formatter_exception():
+    """ Test the end of an exception traceback is kept """
+    formatter = log.JsonFormatter(max_field_length=10)
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record = logging.LogRecord('service.test', logging.ERROR, __file__, 1, 'failed', (), True)
+        record.exc_info = sys.exc_info()
+    entry = json.loads(formatter.format(record))
+    assert entry['exception'].endswith('ValueError: boom')
+    assert entry['exception'].startswith('...(+')
+    assert 'request_id' not in entry
+
+def test_sampling_filter():
+    """ Test sampling keeps warnings and keeps or drops a request's records together """
+    assert log.SamplingFilter(rate=0).filter(make_record(level=logging.WARNING))
+    assert log.SamplingFilter(rate=1).filter(make_record())
+
+    sampler = log.SamplingFilter(rate=0.5)
+    kept = set()
+    for index in range(200):
+        token = log.set_request_id('request{0}'.format(index))
+        try:
+            decisions = {sampler.filter(make_record()) for _ in range(3)}
+        finally:
+            log.reset_request_id(token)
+        assert len(decisions) == 1
+        kept |= decisions
+    assert kept == {True, False}
+
+def test_configure(monkeypatch):
+    """ Test configure replaces its own handler only """
+    monkeypatch.setenv('LOG_LEVEL', 'warning')
+    root = logging.getLogger()
+    previous_level = root.level
+    try:
+        first = log.configure()
+        second = log.configure()
+        assert first not in root.handlers
+        assert second in root.handlers
+        assert isinstance(second.formatter, log.JsonFormatter)
+        assert root.level == logging.WARNING
+
+        # leftover structured handlers next to each other are all replaced
+        extra = logging.StreamHandler()
+        extra.structured = True
+        root.addHandler(extra)
+        second = log.configure()
+        assert [handler for handler in root.handlers if getattr(handler, 'structured', False)] == [second]
+    finally:
+        root.removeHandler(second)
+        root.setLevel(previous_level)
+
+def test_request_id_header(client):
+    """ Test the request id is taken from the request header or generated, and returned """
+    response = client.simulate_get('/welcome', headers={'X-Request-ID': 'abc123'})
+    assert response.headers['X-Request-ID'] == 'abc123'
+
+    response = client.simulate_get('/welcome')
+    assert len(response.headers['X-Request-ID']) == 32
+    assert log.get_request_id() is None
+
+def test_request_log(client, caplog):
+    """ Test each request is logged without its query string """
+    with caplog.at_level(logging.INFO, logger='service.request'):
+        response = client.simulate_get('/welcome', query_string='token=secret', headers={'X-Request-ID': 'abc123'})
+    record = [record for record in caplog.records if record.name == 'service.request'][-1]
+    assert record.path == '/welcome'
+    assert record.status == response.status
+    assert 'secret' not in record.getMessage() + json.dumps(vars(record), default=str)
+
+def test_email_logs_metadata(capsys, caplog):
+    """ Test the SendGrid response is logged, not printed, with the body only at DEBUG """
+    response = Mock(status_code=202, body='{"pii": "applicant@example.com"}', headers='X-Message-Id: 1')
+    with patch.object(Export, 'send_email', return_value=response):
+        with caplog.at_level(logging.INFO, logger='service.resources.export'):
+            Export().email({
+                'from_email': 'from@example.com',
+                'to_emails': 'to@example.com',
+                'cc_emails': '',
+                'bcc_emails': ''
+            }, 'subject', 'content', 'file_name.csv', b'a|b')
+    assert capsys.readouterr().out == ''
+    messages = [record for record in caplog.records if record.name == 'service.resources.export']
+    assert [record.getMessage() for record in messages] == ['Email sent']
+    assert messages[0].status_code == 202
@@ -0,0 +1,126 @@
+# pylint: disable=redefined-outer-name
+"""Tests for metrics """
+import json
+from unittest.mock import patch
+import pytest
+from falcon import testing
+import service.microservice
+from service.modules import metrics
+from service.modules import row_cache
+from service.modules.metrics import MetricsRegistry
+
+CLIENT_HEADERS = {
+    "ACCESS_KEY": "1234567"
+}
+
+@pytest.fixture()
+def client():
+    """ client fixture """
+    return testing.TestClient(app=service.microservice.start_service(), headers=CLIENT_HEADERS)
+
+@pytest.fixture
+def mock_env(monkeypatch):
+    """ mock environment access key """
+    monkeypatch.setenv("ACCESS_KEY", CLIENT_HEADERS["ACCESS_KEY"])
+    monkeypatch.setenv("EXPORT_TOKEN", "xyz")
+
+@pytest.fixture
+def registry():
+    """ empty process wide registry """
+    previous = metrics.set_registry(MetricsRegistry())
+    yield metrics.get_registry()
+    metrics.set_registry(previous)
+
+def test_counters_and_timers():
+    """ counters add up by labels, timers keep count, sum and max """
+    registry = MetricsRegistry()
+    registry.inc('export_submissions', 3)
+    registry.inc('export_submissions', 2)
+    registry.inc('export_runs', result='success')
+    registry.observe('export_stage_seconds', 1.5, stage='fetch')
+    registry.observe('export_stage_seconds', 0.5, stage='fetch')
+
+    stats = registry.get_stats()
+    assert stats['counters'][('export_submissions', ())] == 5
+    assert stats['counters'][('export_runs', (('result', 'success'),))] == 1
+    assert stats['timers'][('export_stage_seconds', (('stage', 'fetch'),))] == {'count': 2, 'sum': 2.0, 'max': 1.5}
+
+def test_timer_records_errors():
+    """ a block that raises is still timed """
+    registry = MetricsRegistry()
+    with pytest.raises(ValueError):
+        with registry.timer('export_stage_seconds', stage='upload'):
+            raise ValueError('ERROR_TEST')
+    assert registry.get_stats()['timers'][('export_stage_seconds', (('stage', 'upload'),))]['count'] == 1
+
+def test_render():
+    """ Prometheus text format """
+    registry = MetricsRegistry()
+    registry.inc('export_submissions', 3)
+    registry.inc('result_rows', 2, status='Error "quoted"')
+    registry.observe('export_stage_seconds', 0.25, stage='fetch')
+    text = registry.render({
+        ('http_requests', (('endpoint', 'formio.get_applications'),)): 4,
+        ('http_request_max_seconds', (('endpoint', 'formio.get_applications'),)): 0.5
+    })
+    lines = text.splitlines()
+
+    assert '# TYPE pts_dispatcher_export_submissions_total counter' in lines
+    assert 'pts_dispatcher_export_submissions_total 3.0' in lines
+    assert 'pts_dispatcher_result_rows_total{status="Error \\"quoted\\""} 2.0' in lines
+    assert '# TYPE pts_dispatcher_export_stage_seconds summary' in lines
+    assert 'pts_dispatcher_export_stage_seconds_count{stage="fetch"} 1' in lines
+    assert 'pts_dispatcher_export_stage_seconds_sum{stage="fetch"} 0.25' in lines
+    assert 'pts_dispatcher_http_requests_total{endpoint="formio.get_applications"} 4.0' in lines
+    assert '# TYPE pts_dispatcher_http_request_max_seconds gauge' in lines
+    assert text.endswith('\n')
+
+def test_metrics_access(client, mock_env):
+    # pylint: disable=unused-argument
+    """ metrics need the access key """
+    response = testing.TestClient(service.microservice.start_service()).simulate_get('/metrics')
+    assert response.status_code == 403
+
+def test_metrics_after_export(client, mock_env, registry):
+    # pylint: disable=unused-argument
+    """ export stages, counts and http stats are exposed """
+    with open('tests/mocks/export_submissions.json', 'r') as file_obj:
+        mock_responses = json.load(file_obj)
+
+    with patch('service.modules.http_client.HttpClient.get') as mock, \
+            patch('service.resources.export.Export.sftp') as mock_sftp:
+        mock.return_value.json.return_value = mock_responses
+        mock_sftp.return_value.status_code = 200
+        response = client.simulate_get('/export', params={"token": "xyz", "sftp_upload": "1"})
+        assert response.status_code == 200
+
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.side_effect = ValueError('ERROR_TEST')
+        client.simulate_get('/export', params={"token": "xyz"})
+
+    response = client.simulate_get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    lines = response.text.splitlines()
+    assert 'pts_dispatcher_export_runs_total{result="success"} 1.0' in lines
+    assert 'pts_dispatcher_export_runs_total{result="error"} 1.0' in lines
+    assert 'pts_dispatcher_export_submissions_total {0}'.format(float(len(mock_responses))) in lines
+    # the failed run is timed up to its fetch
+    assert 'pts_dispatcher_export_stage_seconds_count{stage="fetch"} 2' in lines
+    for stage in ('transform', 'upload'):
+        assert 'pts_dispatcher_export_stage_seconds_count{{stage="{0}"}} 1'.format(stage) in lines
+    assert any(line.startswith('pts_dispatcher_export_upload_bytes_total ') for line in lines)
+
+def test_metrics_without_row_cache(client, mock_env, registry):
+    # pylint: disable=unused-argument
+    """ a scrape doesn't create the row cache """
+    previous = row_cache.set_cache(None)
+    try:
+        with patch('service.modules.row_cache.RowCache') as mock_cache:
+            response = client.simulate_get('/metrics')
+        assert response.status_code == 200
+        assert not mock_cache.called
+        assert row_cache.peek_cache() is None
+        assert 'row_cache_hits' not in response.text
+    finally:
+        row_cache.set_cache(previous)
@@ -0,0 +1,64 @@
+"""Tests for permit applications """
+from unittest.mock import patch
+from service.modules.permit_applications import PermitApplication
+
+def make_pages(total, page_size):
+    """ split fake submissions into Form.io pages """
+    submissions = [{'_id': '{:024d}'.format(index), 'data': {}} for index in range(total)]
+    return [submissions[index:index + page_size] for index in range(0, total, page_size)] + [[]]
+
+def test_iter_applications_by_query():
+    """ test submissions are yielded across pages with limit/skip """
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.return_value.json.side_effect = make_pages(5, 2)
+
+        submissions = list(PermitApplication.iter_applications_by_query({'actionState': 'Export to PTS'}, page_size=2))
+
+        assert [item['_id'] for item in submissions] == ['{:024d}'.format(index) for index in range(5)]
+        assert mock.call_count == 3
+        params = [call[1]['params'] for call in mock.call_args_list]
+        assert [param['skip'] for param in params] == [0, 2, 4]
+        assert all(param['limit'] == 2 and param['actionState'] == 'Export to PTS' for param in params)
+
+def test_iter_applications_by_query_cursor():
+    """ test cursor pages are requested after the last _id """
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.return_value.json.side_effect = make_pages(4, 2)
+
+        submissions = list(PermitApplication.iter_applications_by_query({}, page_size=2, cursor=True, prefetch=False))
+
+        assert len(submissions) == 4
+        params = [call[1]['params'] for call in mock.call_args_list]
+        assert '_id__gt' not in params[0]
+        assert params[1]['_id__gt'] == submissions[1]['_id']
+        assert params[2]['_id__gt'] == submissions[3]['_id']
+
+def test_iter_applications_by_query_lazy():
+    """ test pages are only fetched as submissions are consumed """
+    with patch('service.modules.http_client.HttpClient.get') as mock:
+        mock.return_value.json.side_effect = make_pages(6, 2)
+
+        submissions = PermitApplication.iter_applications_by_query({}, page_size=2, prefetch=False)
+        assert mock.call_count == 0
+        next(submissions)
+        assert mock.call_count == 1
+        submissions.close()
+
+def test_update_statuses():
+    """ test concurrent status updates report per id results and continue past failures """
+    def update_status(formio_id, *_args):
+        if formio_id == 'bad':
+            raise ValueError('PATCH failed')
+        return {'_id': formio_id}
+
+    with patch('service.modules.permit_applications.PermitApplication.update_status', side_effect=update_status) as mock:
+        ret = PermitApplication.update_statuses(['a', 'bad', 'b', 'c'], max_workers=2)
+
+        assert mock.call_count == 4
+        assert ret['a'] == {'status': 'success'}
+        assert ret['c'] == {'status': 'success'}
+        assert ret['bad'] == {'status': 'error', 'message': 'PATCH failed'}
+
+def test_update_statuses_empty():
+    """ test no executor work for an empty id list """
+    assert PermitApplication.update_statuses([]) == {}
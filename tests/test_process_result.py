@@ -1,15 +1,25 @@
 # pylint: disable=redefined-outer-name
 """Tests for export """
 import datetime
+import io
 import json
+import os
+import zipfile
+import threading
 from unittest.mock import patch
 import unittest.mock as mock
 import pytest
 import pysftp
 import pytz
 from falcon import testing
+from service.modules import sftp_client
+from service.modules import metrics
+from service.modules import local_store
+from service.modules import process_result
+from service.modules.metrics import MetricsRegistry
 from service.modules.process_result import ProcessResultFile
 import service.microservice
+from .test_sftp_client import FakeConnection
 
 CLIENT_HEADERS = {
     "ACCESS_KEY": "1234567"
@@ -35,6 +45,13 @@ def client():
     """ client fixture """
     return testing.TestClient(app=service.microservice.start_service())
 
+@pytest.fixture(autouse=True)
+def reset_sftp_client():
+    """ don't share sftp connections between tests """
+    previous = sftp_client.set_client(None)
+    yield
+    sftp_client.set_client(previous)
+
 @pytest.fixture
 def mock_env(monkeypatch):
     """ mock environment access key """
@@ -95,7 +112,7 @@ def test_get_exported_submissions():
 
     assert mock_responses
 
-    with patch('service.modules.permit_applications.requests.get') as mock:
+    with patch('service.modules.http_client.HttpClient.get') as mock:
         mock.return_value.status_code = 200
         mock.return_value.json.return_value = mock_responses
 
@@ -116,23 +133,34 @@ def test_process_file(client, mock_env):
         mock_send_email.return_value.body = "Content"
         mock_send_email.return_value.headers = "X-Message-Id: 12345"
 
-        with patch('service.modules.permit_applications.requests.patch') as mock_patch:
+        with patch('service.modules.http_client.HttpClient.patch') as mock_patch:
             mock_patch.return_value.text = "TEST"
             mock_patch.return_value.status_code = 200
 
             with patch('service.modules.process_result.ProcessResultFile.get_exported_submissions') as mock_patch:
                 mock_patch.return_value = mock_responses
 
-                content = ProcessResultFile().process_file('tests/mocks/result_file.csv')
+                previous = metrics.set_registry(MetricsRegistry())
+                try:
+                    content = ProcessResultFile().process_file('tests/mocks/result_file.csv')
+                    stats = metrics.get_registry().get_stats()
+                finally:
+                    metrics.set_registry(previous)
 
                 assert content != ''
+                assert content['status_updates'] == {formio_id: {'status': 'success'} for formio_id in content['success_ids']}
+
+                for stage in ('fetch', 'read', 'status_update', 'tracker', 'email'):
+                    assert stats['timers'][('result_stage_seconds', (('stage', stage),))]['count'] == 1
+                assert stats['counters'][('result_rows', (('status', 'Success'),))] == len(content['success_ids'])
+                assert stats['counters'][('result_status_updates', (('result', 'success'),))] == len(content['success_ids'])
 
 def test_process_result_exception(client, mock_env):
     # pylint: disable=unused-argument
     # mock_env is a fixture and creates a false positive for pylint
     """Test export exception """
 
-    with patch('service.modules.permit_applications.requests.get') as mock:
+    with patch('service.modules.http_client.HttpClient.get') as mock:
         mock.return_value.status_code = 500
         mock.side_effect = ValueError('ERROR_TEST')
 
@@ -157,3 +185,151 @@ def test_process_result_exception_access(client, mock_env):
     response_json = response.json
     assert response_json['status'] == 'error'
     assert response_json['message'] == 'Unauthorized'
+
+def test_iter_result_rows():
+    """ test result file rows are parsed lazily with short rows padded """
+    lines = io.StringIO('FORMIO|STATUS|ERROR_MSG\r\nid1|Success|\r\nid2|Error| "quoted" error\r\n\r\nid3|Error\r\n')
+    rows = ProcessResultFile.iter_result_rows(lines)
+    assert next(rows) == ('id1', 'Success', '')
+    assert list(rows) == [('id2', 'Error', ' "quoted" error'), ('id3', 'Error', '')]
+
+def test_create_email_content_large_file(tmp_path, monkeypatch):
+    """ test a large result file without a debug dump """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('RESULT_DEBUG_DUMP', raising=False)
+    result_file = tmp_path / 'result_file.csv'
+    rows = ['id{0}|{1}|'.format(index, 'Success' if index % 2 else 'Error') for index in range(20000)]
+    result_file.write_text('FORMIO|STATUS|ERROR_MSG\n' + '\n'.join(rows) + '\n')
+
+    content = ProcessResultFile().create_email_content(str(result_file), ProcessResultFile.new_tracker(), {})
+
+    assert len(content['success_ids']) == 10000
+    assert content['email_body_content'].count('<tr>') == 20001
+    assert content['tracker_content']['formio id'] == []
+    assert not (tmp_path / 'tracker.txt').exists()
+
+def test_create_email_content_debug_dump(tmp_path, monkeypatch):
+    """ test the tracker debug dump """
+    monkeypatch.setenv('AWS_FILE_URL', 'https://aws')
+    monkeypatch.setenv('DS_FILE_URL', 'https://ds')
+    with open('tests/mocks/exported_submissions.json', 'r') as file_obj:
+        exported_submissions = json.load(file_obj)
+    dump_file = tmp_path / 'tracker.txt'
+
+    content = ProcessResultFile().create_email_content(
+        'tests/mocks/result_file.csv', ProcessResultFile.new_tracker(), exported_submissions, debug_dump=str(dump_file))
+
+    assert content['tracker_content']['formio id'] == list(exported_submissions)
+    assert dump_file.read_text() == str(content['tracker_content'])
+
+@pytest.mark.parametrize('writer', ['pandas', 'xlsxwriter'])
+def test_create_tracker_file(writer):
+    """ test the tracker spreadsheet is built in memory """
+    tracker = ProcessResultFile.new_tracker()
+    for column in tracker:
+        tracker[column] = [column + ' value 1', column + ' value 2']
+
+    content = ProcessResultFile().create_tracker_file(tracker, writer)
+
+    with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+        assert 'xl/worksheets/sheet1.xml' in workbook.namelist()
+        shared_strings = workbook.read('xl/sharedStrings.xml').decode()
+    assert 'Formio Id' in shared_strings
+    assert 'issued_closed_date value 2' in shared_strings
+    assert not os.path.exists(ProcessResultFile.data_file_path + 'tracker_tmp.xlsx')
+
+def test_process_remote_file(mock_env):
+    # pylint: disable=unused-argument
+    """ test the result file is streamed from sftp into process_file """
+    with open('tests/mocks/result_file.csv', 'rb') as file_obj:
+        remote_files = {'result_file.csv': (0, file_obj.read())}
+    client = sftp_client.SftpClient(connection_factory=lambda: FakeConnection(remote_files))
+    sftp_client.set_client(client)
+
+    def process_file(rows):
+        # the remote file is closed and the connection free for other threads before the network calls
+        acquired = []
+        def acquire():
+            acquired.append(client.lock.acquire(blocking=False))
+            if acquired[0]:
+                client.lock.release()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+        return rows
+
+    with patch('service.modules.process_result.ProcessResultFile.process_file') as mock_process_file:
+        mock_process_file.side_effect = process_file
+        rows = ProcessResultFile().process_remote_file('result_file.csv')
+        assert ProcessResultFile().process_remote_file('missing.csv') is None
+        mock_process_file.assert_called_once()
+    assert rows[0] == ('5fb706db031847d89394838d', 'Success', '')
+    assert rows[1][1] == 'Error'
+
+def test_process_result_stream(client, mock_env):
+    # pylint: disable=unused-argument
+    """ test /processResultFile?stream=1 """
+    with patch('service.modules.process_result.ProcessResultFile.process_remote_file') as mock_process:
+        mock_process.return_value = {}
+        response = client.simulate_get('/processResultFile', params={"token": "xyz", "stream": "1"})
+        assert response.status_code == 200
+        assert response.json['data']['message'] == mock_process.call_args[0][0]
+
+def test_process_new_result_files(tmp_path, monkeypatch):
+    """ test result files newer than the high-water mark are processed in order """
+    monkeypatch.setenv('DISPATCHER_STATE_DIR', str(tmp_path))
+    monkeypatch.setenv('RESULT_FILE_LOOKBACK_HOURS', '1000000')
+    remote_files = {
+        'DBI_permits_2020122953_response.csv': (200, b'FORMIO|STATUS|ERROR_MSG\n'),
+        'DBI_permits_20201211053_response.csv': (100, b'FORMIO|STATUS|ERROR_MSG\n'),
+        'DBI_permits_20201211053.csv': (150, b'')
+    }
+    sftp_client.set_client(sftp_client.SftpClient(connection_factory=lambda: FakeConnection(remote_files)))
+
+    with patch('service.modules.process_result.ProcessResultFile.process_file') as mock_process_file:
+        processed = ProcessResultFile().process_new_result_files(stream=True)
+        assert processed == ['DBI_permits_20201211053_response.csv', 'DBI_permits_2020122953_response.csv']
+        assert mock_process_file.call_count == 2
+        assert ProcessResultFile.get_high_water_mark() == (200, 'DBI_permits_2020122953_response.csv')
+
+        assert ProcessResultFile().process_new_result_files(stream=True) == []
+
+        remote_files['DBI_permits_2020123053_response.csv'] = (300, b'FORMIO|STATUS|ERROR_MSG\n')
+        assert ProcessResultFile().process_new_result_files(stream=True) == ['DBI_permits_2020123053_response.csv']
+
+def test_process_new_result_files_download_error(tmp_path, monkeypatch):
+    """ test the high-water mark stops at a file that can't be downloaded """
+    monkeypatch.setenv('DISPATCHER_STATE_DIR', str(tmp_path))
+    ProcessResultFile.set_high_water_mark(50, '')
+    remote_files = {'DBI_permits_2020122953_response.csv': (100, b'')}
+    sftp_client.set_client(sftp_client.SftpClient(connection_factory=lambda: FakeConnection(remote_files)))
+
+    with patch('service.modules.process_result.ProcessResultFile.get_result_file') as mock_result_file:
+        mock_result_file.return_value = ''
+        with pytest.raises(IOError):
+            ProcessResultFile().process_new_result_files()
+    assert ProcessResultFile.get_high_water_mark() == (50, '')
+
+def test_process_new_result_files_state(tmp_path, monkeypatch):
+    """ test discovery needs a persistent state directory and runs one at a time """
+    monkeypatch.delenv('DISPATCHER_STATE_DIR', raising=False)
+    with pytest.raises(ValueError, match='DISPATCHER_STATE_DIR'):
+        ProcessResultFile().process_new_result_files()
+
+    monkeypatch.setenv('DISPATCHER_STATE_DIR', str(tmp_path))
+    sftp_client.set_client(sftp_client.SftpClient(connection_factory=lambda: FakeConnection({})))
+    with local_store.claim(process_result.RESULT_LOCK_FILE) as claimed:
+        assert claimed
+        with pytest.raises(ValueError, match='already being processed'):
+            ProcessResultFile().process_new_result_files()
+    assert ProcessResultFile().process_new_result_files() == []
+
+def test_process_result_discover(client, mock_env):
+    # pylint: disable=unused-argument
+    """ test /processResultFile?discover=1 """
+    with patch('service.modules.process_result.ProcessResultFile.process_new_result_files') as mock_process:
+        mock_process.return_value = ['DBI_permits_2020122953_response.csv']
+        response = client.simulate_get('/processResultFile', params={"token": "xyz", "discover": "1"})
+        assert response.status_code == 200
+        assert response.json['data']['responses'] == 1
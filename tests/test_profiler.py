@@ -0,0 +1,90 @@
+# pylint: disable=redefined-outer-name
+"""Tests for request profiling """
+import os
+import cProfile
+import pstats
+import pytest
+from falcon import testing
+import service.microservice
+from service.modules import profiler
+
+CLIENT_HEADERS = {
+    "ACCESS_KEY": "1234567"
+}
+
+@pytest.fixture()
+def client():
+    """ client fixture """
+    return testing.TestClient(app=service.microservice.start_service(), headers=CLIENT_HEADERS)
+
+@pytest.fixture
+def mock_env(monkeypatch, tmp_path):
+    """ mock environment access key and state dir """
+    monkeypatch.setenv("ACCESS_KEY", CLIENT_HEADERS["ACCESS_KEY"])
+    monkeypatch.setenv("EXPORT_TOKEN", "xyz")
+    monkeypatch.setenv("DISPATCHER_STATE_DIR", str(tmp_path))
+
+def test_profile_request(mock_env, client):
+    # pylint: disable=unused-argument
+    """ Test a flagged request is profiled and its profile read back """
+    response = client.simulate_get(
+        '/export', params={'token': 'bad'}, headers={'X-Profile': '1', 'X-Request-ID': 'abc123'})
+    assert response.headers['X-Profile-Id'] == 'abc123'
+    assert os.path.isfile(profiler.get_profile_path('abc123'))
+
+    response = client.simulate_get('/profiles/abc123', params={'sort': 'tottime', 'limit': 5})
+    assert response.status_code == 200
+    assert 'function calls' in response.text
+
+    response = client.simulate_get('/profiles/abc123', params={'format': 'pstats'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/octet-stream'
+    with open(profiler.get_profile_path('abc123'), 'rb') as file_obj:
+        assert response.content == file_obj.read()
+
+    response = client.simulate_get('/profiles/abc123', params={'sort': 'bogus'})
+    assert response.status_code == 400
+
+def test_profile_query_flag(mock_env, client):
+    # pylint: disable=unused-argument
+    """ Test the query flag works and an unsafe request id gets a new profile id """
+    response = client.simulate_get(
+        '/export', params={'token': 'bad', 'profile': '1'}, headers={'X-Request-ID': '../../etc'})
+    profile_id = response.headers['X-Profile-Id']
+    assert profile_id != '../../etc'
+    assert profiler.is_valid_profile_id(profile_id)
+
+def test_profile_requires_access_key(mock_env, client):
+    # pylint: disable=unused-argument
+    """ Test the flag is ignored without a valid access key or on other paths """
+    response = client.simulate_get(
+        '/export', params={'token': 'bad'}, headers={'X-Profile': '1', 'ACCESS_KEY': 'wrong'})
+    assert 'X-Profile-Id' not in response.headers
+
+    response = client.simulate_get('/welcome', headers={'X-Profile': '1'})
+    assert 'X-Profile-Id' not in response.headers
+
+    response = client.simulate_get('/export', params={'token': 'bad'})
+    assert 'X-Profile-Id' not in response.headers
+
+def test_profile_not_found(mock_env, client):
+    # pylint: disable=unused-argument
+    """ Test unknown and unsafe profile ids """
+    assert client.simulate_get('/profiles/missing').status_code == 404
+    assert client.simulate_get('/profiles/..%2F..%2Fetc').status_code == 404
+    assert client.simulate_get('/profiles/missing', headers={'ACCESS_KEY': 'wrong'}).status_code == 403
+
+def test_save_profile_keep(mock_env):
+    # pylint: disable=unused-argument
+    """ Test only the most recent profiles are kept """
+    for index in range(4):
+        profile = cProfile.Profile()
+        profile.enable()
+        sum(range(10))
+        profile.disable()
+        path = profiler.save_profile('profile{0}'.format(index), profile, keep=2)
+        os.utime(path, (index, index))
+    assert profiler.load_profile('profile0') is None
+    assert profiler.load_profile('profile1') is None
+    assert profiler.load_profile('profile3') is not None
+    assert isinstance(pstats.Stats(profiler.load_profile('profile3')), pstats.Stats)
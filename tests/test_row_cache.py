@@ -0,0 +1,58 @@
+"""Tests for the transformed row cache """
+from service.modules.row_cache import RowCache, get_key
+
+def test_get_key():
+    """ keys follow the submission content and the salt """
+    submission = {'_id': '1', 'created': '2020-01-01', 'data': {'a': 1, 'b': 2}}
+    same = {'_id': '1', 'created': '2020-01-01', 'data': {'b': 2, 'a': 1}, 'modified': 'later'}
+    assert get_key(submission) == get_key(same)
+    assert get_key(submission) != get_key(dict(submission, _id='2'))
+    assert get_key(submission) != get_key(dict(submission, data={'a': 2, 'b': 2}))
+    assert get_key(submission, 'v1') != get_key(submission, 'v2')
+
+def test_lru_eviction():
+    """ the least recently used rows are evicted """
+    cache = RowCache(max_size=2)
+    cache.set('a', ['1'])
+    cache.set('b', ['2'])
+    assert cache.get('a') == ['1']
+    cache.set('c', ['3'])
+
+    assert cache.get('b') is None
+    assert cache.get('a') == ['1']
+    assert cache.get('c') == ['3']
+    assert cache.get_stats() == {'hits': 3, 'misses': 1, 'disk_hits': 0, 'size': 2}
+
+    cache.clear()
+    assert cache.get('a') is None
+    assert cache.get_stats() == {'hits': 0, 'misses': 1, 'disk_hits': 0, 'size': 0}
+
+def test_disk_backing(tmp_path):
+    """ flushed rows are found by a new cache on the same file """
+    db_path = str(tmp_path / 'rows.sqlite3')
+    cache = RowCache(max_size=1, db_path=db_path)
+    cache.set('a', ['1', 2])
+    cache.set('b', ['3', 4])
+    # not flushed yet, and evicted from memory
+    assert cache.get('a') is None
+    cache.set('a', ['1', 2])
+    cache.flush()
+
+    restarted = RowCache(max_size=10, db_path=db_path)
+    assert restarted.get('a') == ['1', 2]
+    assert restarted.get('b') == ['3', 4]
+    assert restarted.get('a') == ['1', 2]
+    assert restarted.get_stats() == {'hits': 3, 'misses': 0, 'disk_hits': 2, 'size': 2}
+
+def test_disk_size(tmp_path):
+    """ the file keeps the most recently used rows """
+    db_path = str(tmp_path / 'rows.sqlite3')
+    cache = RowCache(max_size=10, db_path=db_path, max_disk_size=2)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, [key])
+        cache.flush()
+
+    restarted = RowCache(max_size=10, db_path=db_path)
+    assert restarted.get('a') is None
+    assert restarted.get('b') == ['b']
+    assert restarted.get('c') == ['c']
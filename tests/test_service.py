@@ -1,10 +1,17 @@
 # pylint: disable=redefined-outer-name
 """Tests for microservice"""
+import os
+import sys
 import json
+import subprocess
+from unittest.mock import patch
 import jsend
 import pytest
 from falcon import testing
 import service.microservice
+from service.modules import job_queue
+from service.resources.lazy import LazyResource
+from service.resources.welcome import Welcome
 
 CLIENT_HEADERS = {
     "ACCESS_KEY": "1234567"
@@ -57,3 +64,73 @@ def test_default_error(client, mock_env_access_key):
 
     expected_msg_error = jsend.error('404 - Not Found')
     assert json.loads(response.content) == expected_msg_error
+
+def test_lazy_routes():
+    """ Test start_service doesn't import the export and result file dependencies """
+    code = (
+        "import sys, service.microservice\n"
+        "service.microservice.start_service()\n"
+        "print(sorted(name for name in ('pysftp', 'sendgrid', 'xlsxwriter', 'service.resources.export') "
+        "if name in sys.modules))")
+    env = dict(os.environ)
+    env.pop('PRELOAD_ROUTES', None)
+    output = subprocess.run(
+        [sys.executable, '-c', code], env=env, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert output.strip().splitlines()[-1] == '[]'
+
+def test_lazy_resource():
+    """ Test a lazy resource is created once, on its first request """
+    resource = LazyResource('service.resources.welcome', 'Welcome')
+    assert resource.resource is None
+    assert callable(resource.on_get)
+    with pytest.raises(AttributeError):
+        resource.on_post # pylint: disable=pointless-statement
+
+    with patch('service.resources.welcome.Welcome.on_get') as mock_on_get:
+        resource.on_get('req', 'resp')
+        resource.on_get('req', 'resp', job_id='1')
+    assert isinstance(resource.resource, Welcome)
+    assert resource.load() is resource.resource
+    mock_on_get.assert_called_with('req', 'resp', job_id='1')
+
+def test_preload(client, mock_env_access_key, monkeypatch):
+    # pylint: disable=unused-argument
+    """ Test PRELOAD_ROUTES creates every lazy resource at start up """
+    with patch.object(LazyResource, 'load') as mock_load:
+        service.microservice.start_service()
+        assert mock_load.call_count == 0
+        monkeypatch.setenv('PRELOAD_ROUTES', '1')
+        service.microservice.start_service()
+        assert mock_load.call_count == len(service.microservice.LAZY_ROUTES)
+
+    # unknown methods are still answered by Falcon
+    assert client.simulate_post('/export').status_code == 405
+
+def test_resume_jobs(monkeypatch):
+    """ Test a preloading master leaves the queued jobs to the workers """
+    with patch('service.microservice.resume_jobs') as mock_resume:
+        service.microservice.start_service()
+        assert mock_resume.call_count == 1
+        monkeypatch.setenv('PRELOAD_ROUTES', '1')
+        service.microservice.start_service()
+        assert mock_resume.call_count == 1
+
+    # each worker resumes them after the fork
+    config = {}
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')) as config_file:
+        exec(config_file.read(), config) # pylint: disable=exec-used
+    with patch('service.microservice.resume_jobs') as mock_resume:
+        config['post_fork'](None, None)
+    mock_resume.assert_called_once_with()
+
+def test_resume_jobs_queue(tmpdir, monkeypatch):
+    """ Test the job queue is only started when jobs were queued before """
+    monkeypatch.setenv('DISPATCHER_STATE_DIR', str(tmpdir))
+    with patch('service.modules.job_queue.get_queue') as mock_get_queue:
+        service.microservice.resume_jobs()
+        assert mock_get_queue.call_count == 0
+        tmpdir.join(job_queue.JOBS_DB_FILE).write('')
+        service.microservice.resume_jobs()
+    mock_get_queue.assert_called_once_with(service.microservice.run_export_job)
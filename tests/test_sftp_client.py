@@ -0,0 +1,128 @@
+# pylint: disable=redefined-outer-name
+"""Tests for the reusable sftp client """
+import io
+import pytest
+from service.modules.sftp_client import SftpClient
+
+class FakeAttributes():
+    """ stand-in for paramiko SFTPAttributes """
+    def __init__(self, filename, st_mtime):
+        self.filename = filename
+        self.st_mtime = st_mtime
+
+class FakeTransport():
+    """ stand-in for the paramiko transport """
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        """ transport state """
+        return self.active
+
+class FakeConnection():
+    """ in-process stand-in for pysftp.Connection, files are kept in a dict """
+    def __init__(self, files):
+        self.files = files
+        self._transport = FakeTransport()
+        self.closed = False
+
+    def listdir(self, _remotepath='.'):
+        """ file names """
+        return sorted(self.files)
+
+    def listdir_attr(self, _remotepath='.'):
+        """ file attributes """
+        return [FakeAttributes(name, mtime) for name, (mtime, _content) in sorted(self.files.items())]
+
+    def exists(self, remotepath):
+        """ check a file exists """
+        return remotepath in self.files
+
+    def get(self, remotepath, localpath):
+        """ download a file """
+        if remotepath not in self.files:
+            raise FileNotFoundError(remotepath)
+        with open(localpath, 'wb') as file_obj:
+            file_obj.write(self.files[remotepath][1])
+
+    def open(self, remotepath, mode='r'):
+        """ open a file for reading, str lines in text mode like paramiko """
+        if remotepath not in self.files:
+            raise FileNotFoundError(remotepath)
+        if 'b' in mode:
+            return io.BytesIO(self.files[remotepath][1])
+        return io.StringIO(self.files[remotepath][1].decode('utf-8'), newline='')
+
+    def putfo(self, file_obj, remotepath):
+        """ upload a file """
+        self.files[remotepath] = (0, file_obj.read())
+
+    def close(self):
+        """ close the connection, pysftp drops the transport """
+        self.closed = True
+        self._transport = None
+
+@pytest.fixture
+def remote_files():
+    """ remote sftp folder """
+    return {
+        'DBI_permits_202012021753_response.csv': (100, b'FORMIO|STATUS|ERROR_MSG\r\nid1|Success|\r\n'),
+        'DBI_permits_202012021853_response.csv': (200, b'FORMIO|STATUS|ERROR_MSG\r\nid2|Error|missing\r\n'),
+        'DBI_permits_202012021853.csv': (150, b'')
+    }
+
+@pytest.fixture
+def client(remote_files):
+    """ sftp client with the in-process stand-in """
+    connections = []
+    def connection_factory():
+        connections.append(FakeConnection(remote_files))
+        return connections[-1]
+    sftp = SftpClient(connection_factory=connection_factory)
+    sftp.connections = connections
+    return sftp
+
+def test_connection_reused(client, tmp_path):
+    """ test several calls share one connection """
+    assert client.exists('DBI_permits_202012021753_response.csv')
+    client.get('DBI_permits_202012021753_response.csv', str(tmp_path / 'result.csv'))
+    assert client.listdir()
+    assert client.connects == 1
+    assert (tmp_path / 'result.csv').read_bytes().startswith(b'FORMIO')
+
+def test_reconnect(client):
+    """ test a dead transport is replaced """
+    client.listdir()
+    client.connections[0]._transport.active = False # pylint: disable=protected-access
+    client.listdir()
+    assert client.connects == 2
+    assert client.connections[0].closed
+
+    # a connection closed behind the client's back isn't reused
+    client.connections[1].close()
+    client.listdir()
+    assert client.connects == 3
+
+def test_list_files(client):
+    """ test listing matching files with their mtime """
+    files = client.list_files(r'DBI_permits_\d+_response\.csv')
+    assert [(attr.filename, attr.st_mtime) for attr in files] == [
+        ('DBI_permits_202012021753_response.csv', 100),
+        ('DBI_permits_202012021853_response.csv', 200)]
+
+def test_open_text(client):
+    """ test streaming a remote file as text lines """
+    with client.open_text('DBI_permits_202012021853_response.csv') as lines:
+        assert list(lines) == ['FORMIO|STATUS|ERROR_MSG\r\n', 'id2|Error|missing\r\n']
+
+def test_close(client):
+    """ test close drops the connection """
+    client.listdir()
+    client.close()
+    assert client.connection is None
+    assert client.connections[0].closed
+
+def test_putfo(client, remote_files):
+    """ test uploading a file object """
+    client.putfo(io.BytesIO(b'a|b\r\n'), 'DBI_permits_1.csv')
+    assert remote_files['DBI_permits_1.csv'][1] == b'a|b\r\n'
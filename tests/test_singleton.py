@@ -0,0 +1,58 @@
+"""Tests for process wide instances """
+import os
+import threading
+from unittest.mock import patch
+from service.modules.singleton import ProcessWide
+
+def test_get_creates_once():
+    """ Test the instance is created on first use and shared by every thread """
+    calls = []
+
+    def factory(*args):
+        calls.append(args)
+        return object()
+
+    process_wide = ProcessWide(factory)
+    instances = []
+    threads = [threading.Thread(target=lambda: instances.append(process_wide.get('runner'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [('runner',)]
+    assert all(instance is instances[0] for instance in instances)
+
+def test_set():
+    """ Test set swaps the instance and returns the previous one """
+    process_wide = ProcessWide(dict)
+    first = process_wide.get()
+    assert process_wide.set('swapped') is first
+    assert process_wide.get() == 'swapped'
+    assert process_wide.set(None) == 'swapped'
+    assert process_wide.get() == {}
+
+def test_peek():
+    """ Test peek doesn't create the instance """
+    process_wide = ProcessWide(dict)
+    assert process_wide.peek() is None
+    instance = process_wide.get()
+    assert process_wide.peek() is instance
+
+def test_factory_none():
+    """ Test a factory returning None is asked again on the next get """
+    values = [None, 'created']
+    process_wide = ProcessWide(lambda: values.pop(0))
+    assert process_wide.get() is None
+    assert process_wide.get() == 'created'
+
+def test_forked():
+    """ Test a forked child makes its own instance instead of using the parent's """
+    process_wide = ProcessWide(dict)
+    parent = process_wide.get()
+    with patch('os.getpid', return_value=os.getpid() + 1):
+        assert process_wide.peek() is None
+        child = process_wide.get()
+        assert child is not parent
+        assert process_wide.get() is child
+    assert process_wide.set('swapped') is None
+    assert process_wide.get() == 'swapped'
@@ -24,3 +24,25 @@ def test_datetime_valid():
     """ test string is valid datetime """
     assert TransformBase.datetime_valid('2020-08-17T16:56:09.191Z')
     assert not TransformBase.datetime_valid('2020-09-12')
+
+def test_datetime_valid_fast_path():
+    """ test Form.io timestamps and fallback inputs """
+    assert TransformBase.datetime_valid('2020-08-17T16:56:09.191+05:00')
+    assert TransformBase.datetime_valid('2020-08-17T16:56:09.191')
+    assert not TransformBase.datetime_valid('2020-13-17T16:56:09.191Z')
+    assert not TransformBase.datetime_valid('2020-08-17T16:56:09.191Z\n')
+    assert not TransformBase.datetime_valid('2020-08-17T16:56:09Z')
+    assert not TransformBase.datetime_valid(20200817)
+    assert not TransformBase.datetime_valid(None)
+
+def test_parse_datetime():
+    """ test parsing once and formatting the parsed value """
+    time = TransformBase.parse_datetime('2020-08-17T16:54:48.000Z')
+    assert time.utcoffset().total_seconds() == 0
+    assert TransformBase.format_time(time) == '2020-08-17 09:54:48 AM'
+    assert TransformBase.parse_datetime('2020-09-12') is None
+
+def test_pretty_time_fallback():
+    """ test pretty_time still accepts non Form.io datetime strings """
+    assert TransformBase.pretty_time('2020-08-17 16:54:48+00:00') == '2020-08-17 09:54:48 AM'
+    assert TransformBase.pretty_time('2020-08-17T16:54:48.000Z', 'UTC') == '2020-08-17 04:54:48 PM'